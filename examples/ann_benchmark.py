@@ -0,0 +1,82 @@
+import time
+import numpy as np
+import pandas as pd
+from libreco.data import random_split, DatasetPure
+from libreco.algorithms import ALS
+from libreco.utils.ann import IVFIndex
+from libreco.utils.topk import top_k_dot
+
+
+def recall(approx, exact):
+    hits = [len(np.intersect1d(a[a >= 0], e[e >= 0])) / max(np.sum(e >= 0), 1)
+            for a, e in zip(approx, exact)]
+    return np.mean(hits)
+
+
+def benchmark(search, exact, n_repeat=3):
+    start = time.perf_counter()
+    for _ in range(n_repeat):
+        approx = search()
+    elapsed = (time.perf_counter() - start) / n_repeat
+    return elapsed, recall(approx, exact)
+
+
+def benchmark_model(n_rec=10):
+    data = pd.read_csv("sample_data/sample_movielens_rating.dat", sep="::",
+                       names=["user", "item", "label", "time"])
+    train_data, _ = random_split(data, test_size=0.2)
+    train_data, data_info = DatasetPure.build_trainset(train_data)
+    als = ALS(task="ranking", data_info=data_info, embed_size=32,
+              n_epochs=5, reg=5.0, alpha=10)
+    als.fit(train_data, verbose=0)
+
+    users = np.arange(data_info.n_users)
+    start = time.perf_counter()
+    exact, _ = als.recommend_users(users, n_rec)
+    print(f"ALS exact: {time.perf_counter() - start:.4f}s "
+          f"for {len(users)} users")
+
+    for mips_transform in (False, True):
+        als.build_index(mips_transform=mips_transform)
+        for n_probe in (1, 4, 16):
+            elapsed, r = benchmark(
+                lambda: als.recommend_users(users, n_rec, n_probe=n_probe)[0],
+                exact)
+            print(f"ALS index mips_transform={mips_transform} "
+                  f"n_probe={n_probe}: {elapsed:.4f}s, "
+                  f"recall@{n_rec}: {r:.4f}")
+
+
+def benchmark_synthetic(n_items=500000, n_queries=1000, dim=32, n_rec=10,
+                        n_clusters=1000, seed=42):
+    # clustered item vectors, like trained embeddings
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    items = (centers[rng.integers(0, n_clusters, n_items)]
+             + 0.5 * rng.normal(size=(n_items, dim))).astype(np.float32)
+    queries = rng.normal(size=(n_queries, dim)).astype(np.float32)
+
+    start = time.perf_counter()
+    exact, _ = top_k_dot(queries, items, n_rec)
+    print(f"\nexact: {time.perf_counter() - start:.4f}s "
+          f"for {n_queries} queries, {n_items} items")
+
+    for backend in ("numpy", "faiss"):
+        try:
+            start = time.perf_counter()
+            index = IVFIndex(backend=backend).build(items)
+        except ImportError:
+            print(f"{backend} is not installed, skip")
+            continue
+        print(f"{backend} build: {time.perf_counter() - start:.2f}s, "
+              f"n_lists={index.n_lists}")
+        for n_probe in (1, 4, 16, 64):
+            elapsed, r = benchmark(
+                lambda: index.search(queries, n_rec, n_probe)[0], exact)
+            print(f"{backend} n_probe={n_probe}: {elapsed:.4f}s, "
+                  f"recall@{n_rec}: {r:.4f}")
+
+
+if __name__ == "__main__":
+    benchmark_model()
+    benchmark_synthetic()
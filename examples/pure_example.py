@@ -20,8 +20,8 @@ if __name__ == "__main__":
         data, multi_ratios=[0.8, 0.1, 0.1])
 
     train_data, data_info = DatasetPure.build_trainset(train_data)
-    eval_data = DatasetPure.build_testset(eval_data)
-    test_data = DatasetPure.build_testset(test_data)
+    eval_data = DatasetPure.build_testset(eval_data, data_info=data_info)
+    test_data = DatasetPure.build_testset(test_data, data_info=data_info)
     print(data_info)   # n_users: 5894, n_items: 3253, data sparsity: 0.4172 %
 
     svdpp = SVDpp(task="rating", data_info=data_info, embed_size=16,
@@ -0,0 +1,79 @@
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from libreco.data import DatasetPure
+from libreco.utils.similarities import cosine_sim, jaccard_sim
+
+
+def neighbor_recall(approx, exact):
+    hits, total = 0, 0
+    for row in range(exact.shape[0]):
+        e = exact.indices[exact.indptr[row]: exact.indptr[row + 1]]
+        a = approx.indices[approx.indptr[row]: approx.indptr[row + 1]]
+        hits += len(np.intersect1d(a, e))
+        total += len(e)
+    return hits / max(total, 1)
+
+
+def benchmark(name, sim_func, x, y, n_x, n_y, k, settings):
+    start = time.perf_counter()
+    exact = sim_func(x, y, n_x, n_y, mode="invert", topk=k)
+    print(f"{name} exact: {time.perf_counter() - start:.3f}s")
+    for n_hashes, n_bands, max_bucket_size in settings:
+        start = time.perf_counter()
+        approx = sim_func(x, y, n_x, n_y, mode="lsh", topk=k,
+                          lsh_params={"n_hashes": n_hashes,
+                                      "n_bands": n_bands,
+                                      "max_bucket_size": max_bucket_size})
+        elapsed = time.perf_counter() - start
+        print(f"{name} lsh n_hashes={n_hashes} n_bands={n_bands} "
+              f"max_bucket_size={max_bucket_size}: {elapsed:.3f}s, "
+              f"neighbor recall@{k}: {neighbor_recall(approx, exact):.4f}")
+
+
+def synthetic(n_x=200000, n_y=50000, n_topics=2000, per_row=20, skew=0.0,
+              seed=42):
+    # rows interact with columns of a few topics, like real items do, plus
+    # random columns whose popularity follows a power law of `skew`
+    rng = np.random.default_rng(seed)
+    topics = rng.integers(0, n_topics, n_x)
+    topic_cols = rng.integers(0, n_y, (n_topics, 50))
+    popularity = 1.0 / np.arange(1, n_y + 1) ** skew
+    cols = np.where(rng.random((n_x, per_row)) < 0.8,
+                    topic_cols[topics[:, np.newaxis],
+                               rng.integers(0, 50, (n_x, per_row))],
+                    rng.choice(n_y, (n_x, per_row),
+                               p=popularity / popularity.sum()))
+    x = csr_matrix((np.ones(n_x * per_row, dtype=np.float32),
+                    (np.repeat(np.arange(n_x), per_row), cols.ravel())),
+                   shape=(n_x, n_y))
+    # duplicate columns are summed, keep the data binary
+    x.data[:] = 1.0
+    return x, x.T.tocsr()
+
+
+if __name__ == "__main__":
+    data = pd.read_csv("sample_data/sample_movielens_rating.dat", sep="::",
+                       names=["user", "item", "label", "time"])
+    train_data, data_info = DatasetPure.build_trainset(data)
+    user_interaction = train_data.sparse_interaction
+    item_interaction = user_interaction.T.tocsr()
+    n_items, n_users = data_info.n_items, data_info.n_users
+    # one or two values per band, since similarities of interaction
+    # data are small
+    settings = [(32, 32, 8), (64, 64, 8), (64, 64, 16), (128, 128, 16)]
+    benchmark("movielens item jaccard", jaccard_sim, item_interaction,
+              user_interaction, n_items, n_users, 20, settings)
+    benchmark("movielens item cosine", cosine_sim, item_interaction,
+              user_interaction, n_items, n_users, 20, settings)
+
+    # cost of the exact invert mode grows with the squared counts of
+    # columns, while LSH doesn't depend on their popularity
+    for skew in (0.0, 1.0):
+        print()
+        x, y = synthetic(skew=skew)
+        for name, sim_func in (("jaccard", jaccard_sim),
+                               ("cosine", cosine_sim)):
+            benchmark(f"synthetic skew={skew} {name}", sim_func, x, y,
+                      x.shape[0], x.shape[1], 20, [(32, 32, 8), (64, 64, 16)])
@@ -36,9 +36,15 @@ cpdef bpr_update(optimizer, train_data, user_embed, item_embed, lr, reg,
                  n_users, n_items, shuffle, num_threads, seed, epoch, 
                  u_velocity=None, i_velocity=None, momentum=0.9, 
                  u_1st_mom=None, i_1st_mom=None, u_2nd_mom=None, 
-                 i_2nd_mom=None, rho1=0.9, rho2=0.999):
-
-    if train_data.has_sampled:
+                 i_2nd_mom=None, rho1=0.9, rho2=0.999, user_indices=None,
+                 item_indices=None):
+
+    # positive pairs can be provided explicitly, e.g. in incremental
+    # training, while negative items are still checked against train_data
+    if user_indices is not None and item_indices is not None:
+        user_indices = np.asarray(user_indices, dtype=np.int32)
+        item_indices = np.asarray(item_indices, dtype=np.int32)
+    elif train_data.has_sampled:
         user_indices = train_data.user_indices_orig.astype(np.int32)
         item_indices = train_data.item_indices_orig.astype(np.int32)
     else:
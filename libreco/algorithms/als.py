@@ -15,13 +15,14 @@ author: massquantity
 """
 import time
 import logging
-from itertools import islice
 from functools import partial
 import numpy as np
 from .base import Base
 from ..evaluate.evaluate import EvalMixin
+from ..data.growable import append_rows
 from ..utils.misc import time_block
 from ..utils.initializers import truncated_normal
+from ..utils.fold_in import interactions_to_csr, weighted_ridge
 try:
     from ._als import als_update
 except ImportError:
@@ -63,6 +64,26 @@ class ALS(Base, EvalMixin):
         self.item_embed = truncated_normal(
             shape=[self.n_items, self.embed_size], mean=0.0, scale=0.03)
 
+    def extend(self, data_info, train_data=None):
+        """Grow embeddings for new users and items after the data has been
+        extended by `Dataset.extend_trainset`. Embeddings of new users and
+        items are initialized the same way as in `_build_model`.
+
+        Parameters
+        ----------
+        data_info : `DataInfo` object
+            Extended data info.
+        train_data : `TransformedSet` object, optional
+            Extended train data, whose consumed items are used in
+            recommendation.
+        """
+        n_new_users, n_new_items = self._extend_data_info(data_info,
+                                                          train_data)
+        self.user_embed = append_rows(self.user_embed, truncated_normal(
+            shape=[n_new_users, self.embed_size], mean=0.0, scale=0.03))
+        self.item_embed = append_rows(self.item_embed, truncated_normal(
+            shape=[n_new_items, self.embed_size], mean=0.0, scale=0.03))
+
     def fit(self, train_data, verbose=1, shuffle=True, use_cg=True,
             n_threads=1, eval_data=None, metrics=None):
         self.show_start_time()
@@ -93,6 +114,62 @@ class ALS(Base, EvalMixin):
                 self.print_metrics(eval_data=eval_data, metrics=metrics)
                 print("="*30)
 
+    def partial_fit(self, train_data, delta_data, n_epochs=None, verbose=1,
+                    use_cg=True, n_threads=1):
+        """Incrementally train on new interactions, starting from current
+        embeddings.
+
+        Only the users and items that appear in `delta_data` are re-solved,
+        against their full interactions in `train_data`, so the cost is
+        proportional to the new interactions rather than the whole history.
+
+        Parameters
+        ----------
+        train_data : `TransformedSet` object
+            Whole train data, which has been extended with the new
+            interactions by `Dataset.extend_trainset`.
+        delta_data : `TransformedSet` object
+            New interactions encoded by the same `DataInfo`, e.g.
+            `DatasetPure.build_testset(delta, data_info=data_info)`.
+        n_epochs : int, optional
+            Number of epochs, default is `n_epochs` of the model.
+        verbose : int, optional
+        use_cg : bool, optional
+        n_threads : int, optional
+        """
+        self._check_data_size(train_data)
+        self.user_consumed = train_data.user_consumed
+        n_epochs = n_epochs or self.n_epochs
+        users = np.unique(delta_data.user_indices)
+        items = np.unique(delta_data.item_indices)
+
+        # slicing returns copies, so the train data is not modified
+        interaction = train_data.sparse_interaction
+        user_interaction = interaction[users]
+        item_interaction = interaction.tocsc()[:, items].T.tocsr()
+        if self.task == "ranking":
+            user_interaction.data = user_interaction.data * self.alpha + 1
+            item_interaction.data = item_interaction.data * self.alpha + 1
+        trainer = self._choose_algo(use_cg)
+
+        for epoch in range(1, n_epochs + 1):
+            with time_block(f"Epoch {epoch}", verbose):
+                user_embed = np.ascontiguousarray(self.user_embed[users])
+                trainer(interaction=user_interaction,
+                        X=user_embed,
+                        Y=self.item_embed,
+                        reg=self.reg,
+                        num_threads=n_threads)
+                self.user_embed[users] = user_embed
+
+                item_embed = np.ascontiguousarray(self.item_embed[items])
+                trainer(interaction=item_interaction,
+                        X=item_embed,
+                        Y=self.user_embed,
+                        reg=self.reg,
+                        num_threads=n_threads)
+                self.item_embed[items] = item_embed
+
     def _choose_algo(self, use_cg):
         if self.task == "rating":
             if use_cg:
@@ -131,24 +208,54 @@ class ALS(Base, EvalMixin):
 
         return preds[0] if len(user) == 1 else preds
 
-    def recommend_user(self, user, n_rec, **kwargs):
-        user = self._check_unknown_user(user)
-        if not user:
-            return   # popular ?
-
-        consumed = self.user_consumed[user]
-        count = n_rec + len(consumed)
-        recos = self.user_embed[user] @ self.item_embed.T
+    def _dot_factors(self, users):
+        return self.user_embed[users], self.item_embed, None, None
+
+    def recommend_from_interactions(self, item_ids, weights=None, n_rec=10):
+        """Recommend for users unseen in training, given their interacted
+        items.
+
+        User vectors are computed on the fly with the same least squares
+        solve as the user step of ALS, against fixed item embeddings, and
+        nothing is stored in the model.
+
+        Parameters
+        ----------
+        item_ids : array_like or list of array_like
+            Interacted item indices of a user, or a list of them for a batch
+            of users.
+        weights : array_like or list of array_like, optional
+            Weight of every interaction, i.e. rating in rating task and
+            interaction strength (e.g. count) in ranking task. Default is 1.
+        n_rec : int, optional
+            Number of recommendations for every user.
+
+        Returns
+        -------
+        result : list of tuples, or list of them for a batch of users
+            Each recommendation is an (item_id, score) tuple, items that
+            have been interacted are excluded.
+        """
+        interaction, is_batch = interactions_to_csr(
+            item_ids, weights, self.n_items)
+        eye = np.eye(self.embed_size, dtype=np.float32)
+        if self.task == "ranking":
+            confidence = interaction.data * self.alpha + 1
+            base_matrix = self.item_embed.T @ self.item_embed + self.reg * eye
+            user_embed = weighted_ridge(
+                interaction.indptr, interaction.indices, confidence - 1,
+                confidence, self.item_embed, base_matrix)
+        else:
+            user_embed = weighted_ridge(
+                interaction.indptr, interaction.indices,
+                np.ones_like(interaction.data), interaction.data,
+                self.item_embed, self.reg * eye)
+
+        scores = user_embed @ self.item_embed.T
         if self.task == "ranking":
-            recos = 1 / (1 + np.exp(-recos))
-
-        ids = np.argpartition(recos, -count)[-count:]
-        rank = sorted(zip(ids, recos[ids]), key=lambda x: -x[1])
-        return list(
-            islice(
-                (rec for rec in rank if rec[0] not in consumed), n_rec
-            )
-        )
+            scores = 1 / (1 + np.exp(-scores))
+        return self._recommend_from_scores(
+            scores, interaction, n_rec, is_batch)
 
 
 def _least_squares(sparse_interaction, X, Y, reg, embed_size, num, mode):
@@ -2,10 +2,15 @@ import abc
 import os
 import multiprocessing
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import tensorflow as tf
+from ..data.prefetch import Prefetcher
 from ..utils.misc import time_block, colorize
 from ..utils.exception import NotSamplingError
+from ..utils.tf_ops import TfDataInput
+from ..utils.topk import top_k, top_k_dot, top_k_sparse
+from ..utils.ann import IVFIndex
 
 
 class Base(abc.ABC):
@@ -21,6 +26,11 @@ class Base(abc.ABC):
         Lower and upper score bound for rating task.
     """
 
+    # upper bound of scores computed in one block of `recommend_users`
+    _score_block_size = 1 << 22
+    # approximate nearest neighbor index built by `build_index`
+    ann_index = None
+
     def __init__(self, task, data_info, lower_upper_bound=None):
         self.task = task
         if task == "rating":
@@ -66,10 +76,14 @@ class Base(abc.ABC):
         """
         raise NotImplementedError
 
-    @abc.abstractmethod
     def recommend_user(self, user, n_rec, **kwargs):
         """Recommend a list of items for given user.
 
+        Scores of consumed items are set to -inf before a single partition
+        of `n_rec` items, so heavy users cost no more than others. If
+        `ann_index` is built, items are retrieved from it, and `n_probe`
+        can be passed to trade recall for latency.
+
         Parameters
         ----------
         user : int
@@ -83,9 +97,211 @@ class Base(abc.ABC):
             A recommendation list, each recommendation
             contains an (item_id, score) tuple.
 
+        """
+        user = self._check_unknown_user(user)
+        if user is None:
+            return   # popular ?
+
+        items, scores = self._recommend_block(
+            np.array([user]), n_rec, filter_consumed=True,
+            n_probe=kwargs.get("n_probe"))
+        valid = items[0] >= 0
+        return list(zip(items[0][valid], scores[0][valid]))
+
+    def recommend_users(self, users, n_rec, filter_consumed=True,
+                        batch_size=None, num_threads=1, n_probe=None):
+        """Recommend items for a batch of users.
+
+        Users are processed in blocks. Scores of a whole block against all
+        items are computed at once, consumed items are masked through the
+        csr index of consumed items, and top items of every user are
+        selected by vectorized partition. Embedding based models use the
+        blocked top-k kernel instead, which multiplies user and item
+        factors block by block, and never materializes all the scores, or
+        `ann_index` if it is built by `build_index`. Neighborhood models
+        score a block with one sparse matrix product, and only items
+        reached by neighbors can be recommended.
+
+        Parameters
+        ----------
+        users : array_like
+            User ids to recommend.
+        n_rec : int
+            Number of recommendations for every user.
+        filter_consumed : bool, optional
+            Whether to exclude items consumed by users in train data.
+        batch_size : int, optional
+            Number of users scored together. Default is about 4M scores
+            per block for embedding based models, and fewer for feature
+            based models, which feed `batch_size * n_items` samples to the
+            session at once. Embedding and neighborhood based models use
+            4096 by default.
+        num_threads : int, optional
+            Number of threads used in the top-k kernel of embedding based
+            models, or in sparse products of neighborhood based models.
+        n_probe : int, optional
+            Number of lists searched in `ann_index`, more lists give higher
+            recall and latency. Default is the one of the index.
+
+        Returns
+        -------
+        items : numpy.ndarray of shape (n_users, n_rec)
+            Recommended items of every user in descending order of score.
+            Rows are padded with -1 if a user has fewer recommendations,
+            e.g. an unknown user.
+        scores : numpy.ndarray of shape (n_users, n_rec)
+            Scores of recommended items, padded with -inf.
+        """
+        users = np.asarray(users, dtype=np.int64).ravel()
+        n_rec = min(n_rec, self.n_items)
+        items = np.full((len(users), n_rec), -1, dtype=np.int64)
+        scores = np.full((len(users), n_rec), -np.inf, dtype=np.float32)
+        known = (users >= 0) & (users < self.n_users)
+        if not np.all(known):
+            unknown_str = (f"detect {np.count_nonzero(~known)} unknown "
+                           f"user(s), return no recommendation for them")
+            print(f"{colorize(unknown_str, 'red')}")
+
+        known_pos = np.flatnonzero(known)
+        use_factors = type(self)._dot_factors is not Base._dot_factors
+        use_sparse = (type(self)._score_users_sparse
+                      is not Base._score_users_sparse)
+        if batch_size is None and (use_factors or use_sparse):
+            batch_size = 4096
+        elif batch_size is None:
+            batch_size = max(1, self._score_block_size // max(self.n_items, 1))
+        for start in range(0, len(known_pos), batch_size):
+            pos = known_pos[start: start + batch_size]
+            block_items, block_scores = self._recommend_block(
+                users[pos], n_rec, filter_consumed, num_threads, n_probe)
+            items[pos] = block_items
+            scores[pos] = block_scores
+        return items, scores
+
+    def _score_users(self, users):
+        """Raw scores of `users` against all items, of shape
+        (len(users), n_items), where higher is better."""
+        raise NotImplementedError
+
+    def _score_users_sparse(self, users):
+        """Raw scores of `users` as a `scipy.sparse.csr_matrix` of shape
+        (len(users), n_items). Only stored items can be recommended, which
+        suits neighborhood based models."""
+        raise NotImplementedError
+
+    def _dot_factors(self, users):
+        """Factors of models whose scores are dot products, i.e.
+        `user_vecs @ item_vecs.T + item_bias + user_bias[:, None]`.
+
+        Returns
+        -------
+        user_vecs : numpy.ndarray of shape (len(users), dim)
+        item_vecs : numpy.ndarray of shape (n_items, dim)
+        item_bias : numpy.ndarray of shape (n_items,) or None
+        user_bias : numpy.ndarray of shape (len(users),) or None
         """
         raise NotImplementedError
 
+    def build_index(self, n_lists=None, n_probe=8, backend="numpy",
+                    seed=42, mips_transform=True):
+        """Build an `IVFIndex` of item factors for approximate retrieval,
+        which is then used by `recommend_user` and `recommend_users`.
+
+        Only supported by embedding based models. The index must be rebuilt
+        after training, and it is dropped when new items are added by
+        `extend`. It can be persisted with `model.ann_index.save(path)`,
+        and restored with `model.ann_index = IVFIndex.load(path)`.
+
+        Parameters
+        ----------
+        n_lists : int, optional
+            Number of lists, default is about `sqrt(n_items)`.
+        n_probe : int, optional
+            Default number of lists searched for every user.
+        backend : {"numpy", "faiss"}, optional
+            Use faiss `IndexIVFFlat` if "faiss", which must be installed.
+        seed : int, optional
+            Random seed of k-means.
+        mips_transform : bool, optional
+            Whether to norm-augment item factors, so that clustering and
+            probing in L2 space are consistent with inner product ranking.
+
+        Returns
+        -------
+        index : `IVFIndex` object
+        """
+        if type(self)._dot_factors is Base._dot_factors:
+            raise ValueError(f"{type(self).__name__} doesn't support "
+                             f"approximate retrieval index")
+        _, item_vecs, item_bias, _ = self._dot_factors(
+            np.zeros(0, dtype=np.int64))
+        self.ann_index = IVFIndex(
+            n_lists, n_probe, backend, seed=seed,
+            mips_transform=mips_transform).build(item_vecs, item_bias)
+        return self.ann_index
+
+    def _output_scores(self, scores):
+        """Convert raw scores of selected items to output scores. Only
+        applied to the top items, since it must not change the order."""
+        if self.task == "ranking":
+            return 1 / (1 + np.exp(-scores))
+        return scores
+
+    def _recommend_block(self, users, n_rec, filter_consumed,
+                         num_threads=1, n_probe=None):
+        exclude = (self.user_consumed.gather(users) if filter_consumed
+                   else None)
+        if self.ann_index is not None:
+            user_vecs, _, _, user_bias = self._dot_factors(users)
+            ids, top_scores = self.ann_index.search(user_vecs, n_rec,
+                                                    n_probe, exclude)
+            if user_bias is not None:
+                top_scores = top_scores + user_bias[:, np.newaxis]
+        elif type(self)._dot_factors is not Base._dot_factors:
+            user_vecs, item_vecs, item_bias, user_bias = (
+                self._dot_factors(users))
+            ids, top_scores = top_k_dot(user_vecs, item_vecs, n_rec,
+                                        item_bias, exclude, num_threads)
+            if user_bias is not None:
+                top_scores = top_scores + user_bias[:, np.newaxis]
+        elif (type(self)._score_users_sparse
+              is not Base._score_users_sparse):
+            ids, top_scores = self._recommend_sparse(users, n_rec, exclude,
+                                                     num_threads)
+        else:
+            scores = self._score_users(users)
+            if exclude is not None:
+                scores[exclude[0], exclude[1]] = -np.inf
+            ids, top_scores = top_k(scores, n_rec)
+        no_rec = np.isneginf(top_scores)
+        with np.errstate(over="ignore"):
+            top_scores = self._output_scores(top_scores)
+        ids[no_rec] = -1
+        top_scores[no_rec] = -np.inf
+        return ids, top_scores
+
+    def _recommend_sparse(self, users, n_rec, exclude, num_threads):
+        # sparse products release the GIL, so chunks of users are
+        # scored concurrently
+        chunks = np.array_split(np.arange(len(users)),
+                                max(1, min(num_threads, len(users))))
+
+        def recommend_chunk(chunk):
+            scores = self._score_users_sparse(users[chunk])
+            chunk_exclude = None
+            if exclude is not None and len(chunk) > 0:
+                lo, hi = np.searchsorted(exclude[0], [chunk[0], chunk[-1] + 1])
+                chunk_exclude = (exclude[0][lo: hi] - chunk[0],
+                                 exclude[1][lo: hi])
+            return top_k_sparse(scores, n_rec, chunk_exclude)
+
+        if len(chunks) == 1:
+            return recommend_chunk(chunks[0])
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            results = list(executor.map(recommend_chunk, chunks))
+        return (np.concatenate([ids for ids, _ in results]),
+                np.concatenate([scores for _, scores in results]))
+
     def _check_unknown(self, user, item):
         unknown_user_indices = list(
             np.where(np.logical_or(user >= self.n_users, user < 0))[0])
@@ -123,6 +339,50 @@ class Base(abc.ABC):
             print(f"{colorize(unknown_str, 'red')}")
             return
 
+    def _extend_data_info(self, data_info, train_data=None):
+        """Switch to `data_info` extended by `Dataset.extend_trainset`.
+
+        Returns
+        -------
+        n_new_users : int
+        n_new_items : int
+        """
+        n_new_users = data_info.n_users - self.n_users
+        n_new_items = data_info.n_items - self.n_items
+        if n_new_users < 0 or n_new_items < 0:
+            raise ValueError("data_info can only be extended, "
+                             "but it has fewer users or items than the model")
+        self.data_info = data_info
+        self.n_users = data_info.n_users
+        self.n_items = data_info.n_items
+        if n_new_items > 0:
+            # new items are not in the index
+            self.ann_index = None
+        if train_data is not None:
+            self.user_consumed = train_data.user_consumed
+        return n_new_users, n_new_items
+
+    def _check_data_size(self, train_data):
+        n_users, n_items = train_data.sparse_interaction.shape
+        if n_users > self.n_users or n_items > self.n_items:
+            raise ValueError("train data contains new users or items, "
+                             "call `model.extend(data_info, train_data)` "
+                             "before training on it")
+
+    @staticmethod
+    def _recommend_from_scores(scores, exclude, n_rec, is_batch):
+        """Top `n_rec` items of every row of `scores`, skipping items in
+        the csr_matrix `exclude`, e.g. items the users have interacted with.
+        Used by `recommend_from_interactions`."""
+        rows = np.repeat(np.arange(len(scores)), np.diff(exclude.indptr))
+        scores[rows, exclude.indices] = -np.inf
+        ids, top_scores = top_k(scores, n_rec)
+        result = [
+            [(i, s) for i, s in zip(row_ids, row_scores) if s != -np.inf]
+            for row_ids, row_scores in zip(ids, top_scores)
+        ]
+        return result if is_batch else result[0]
+
     @staticmethod
     def _check_has_sampled(data, verbose):
         if not data.has_sampled and verbose > 1:
@@ -180,9 +440,22 @@ class Base(abc.ABC):
 
 
 class TfMixin(object):
+    # model inputs in the order of batches yielded by data generators
+    batch_inputs = {
+        "pure": ("user_indices", "item_indices", "labels"),
+        "feat": ("user_indices", "item_indices", "labels",
+                 "sparse_indices", "dense_values"),
+        "seq": ("user_interacted_seq", "user_interacted_len",
+                "user_indices", "item_indices", "labels",
+                "sparse_indices", "dense_values"),
+    }
+
     def __init__(self, tf_sess_config=None):
         self.cpu_num = multiprocessing.cpu_count()
+        self.tf_sess_config = tf_sess_config
         self.sess = self._sess_config(tf_sess_config)
+        self.tf_input = None
+        self._variable_values = None
 
     def _sess_config(self, tf_sess_config=None):
         if not tf_sess_config:
@@ -199,29 +472,71 @@ class TfMixin(object):
         config = tf.ConfigProto(**tf_sess_config)
         return tf.Session(config=config)
 
-    def train_pure(self, data_generator, verbose, shuffle, eval_data, metrics):
+    def _reset_graph(self):
+        """Save values of all variables and clear the graph, so the model
+        can be rebuilt with larger embeddings after `extend`. Saved values
+        are loaded by `_restore_variables` once the new graph has been
+        initialized."""
+        variables = tf.global_variables()
+        if variables:
+            values = self.sess.run(variables)
+            self._variable_values = dict(
+                zip([v.name for v in variables], values))
+        self.sess.close()
+        tf.reset_default_graph()
+        self.sess = self._sess_config(self.tf_sess_config)
+
+    def _restore_variables(self):
+        """Load values saved by `_reset_graph` into variables of the same
+        name. If the first dimension of a variable has grown, e.g. embeddings
+        of new users, only the leading rows are overwritten, and the new rows
+        keep their initialized values."""
+        if not self._variable_values:
+            return
+        for var in tf.global_variables():
+            value = self._variable_values.get(var.name)
+            if value is None:
+                continue
+            current = self.sess.run(var)
+            if value.shape == current.shape:
+                var.load(value, self.sess)
+            elif (value.ndim == current.ndim > 0
+                  and value.shape[1:] == current.shape[1:]
+                  and len(value) <= len(current)):
+                current[:len(value)] = value
+                var.load(current, self.sess)
+        self._variable_values = None
+
+    def train_pure(self, data_generator, verbose, shuffle, eval_data, metrics,
+                   **kwargs):
+        data_generator = self._prefetch_data(data_generator, **kwargs)
         for epoch in range(1, self.n_epochs + 1):
             with time_block(f"Epoch {epoch}", verbose):
-                train_total_loss = []
-                for user, item, label in data_generator(shuffle,
-                                                        self.batch_size):
+                if self.tf_input is not None:
+                    train_total_loss = self._train_tf_input(shuffle)
+                else:
+                    train_total_loss = []
+                    for user, item, label, *_ in data_generator(
+                            shuffle, self.batch_size):
 
-                    feed_dict = {self.user_indices: user,
-                                 self.item_indices: item,
-                                 self.labels: label}
-                    if hasattr(self, "is_training"):
-                        feed_dict.update({self.is_training: True})
+                        feed_dict = {self.user_indices: user,
+                                     self.item_indices: item,
+                                     self.labels: label}
+                        if hasattr(self, "is_training"):
+                            feed_dict.update({self.is_training: True})
 
-                    train_loss, _ = self.sess.run(
-                        [self.loss, self.training_op], feed_dict=feed_dict)
+                        train_loss, _ = self.sess.run(
+                            [self.loss, self.training_op],
+                            feed_dict=feed_dict)
 
-                    train_total_loss.append(train_loss)
+                        train_total_loss.append(train_loss)
 
             if verbose > 1:
                 train_loss_str = "train_loss: " + str(
                     round(np.mean(train_total_loss), 4)
                 )
                 print(f"\t {colorize(train_loss_str, 'green')}")
+                self._print_wait_time(data_generator)
 
                 class_name = self.__class__.__name__.lower()
                 if class_name.startswith("svd"):
@@ -230,28 +545,111 @@ class TfMixin(object):
 
                 self.print_metrics(eval_data=eval_data, metrics=metrics)
                 print("="*30)
+        data_generator.close()
 
-    def train_feat(self, data_generator, verbose, shuffle, eval_data, metrics):
+    def train_feat(self, data_generator, verbose, shuffle, eval_data, metrics,
+                   **kwargs):
+        data_generator = self._prefetch_data(data_generator, **kwargs)
         for epoch in range(1, self.n_epochs + 1):
             if self.lr_decay:
                 print(f"With lr_decay, epoch {epoch} learning rate: "
                       f"{self.sess.run(self.lr)}")
             with time_block(f"Epoch {epoch}", verbose):
-                train_total_loss = []
-                for u, i, label, si, dv in data_generator(shuffle,
-                                                          self.batch_size):
-                    feed_dict = self._get_feed_dict(u, i, si, dv, label, True)
-                    train_loss, _ = self.sess.run(
-                        [self.loss, self.training_op], feed_dict)
-                    train_total_loss.append(train_loss)
+                if self.tf_input is not None:
+                    train_total_loss = self._train_tf_input(shuffle)
+                else:
+                    train_total_loss = []
+                    for u, i, label, si, dv in data_generator(
+                            shuffle, self.batch_size):
+                        feed_dict = self._get_feed_dict(
+                            u, i, si, dv, label, True)
+                        train_loss, _ = self.sess.run(
+                            [self.loss, self.training_op], feed_dict)
+                        train_total_loss.append(train_loss)
 
             if verbose > 1:
                 train_loss_str = "train_loss: " + str(
                     round(np.mean(train_total_loss), 4)
                 )
                 print(f"\t {colorize(train_loss_str, 'green')}")
+                self._print_wait_time(data_generator)
                 self.print_metrics(eval_data=eval_data, metrics=metrics)
                 print("="*30)
+        data_generator.close()
+
+    def _build_tf_input(self, data_generator, batch_type, **kwargs):
+        """Build `tf.data` pipeline if `input_mode="tf_data"` is passed to
+        `fit`. Must be called before `_build_model`, since model inputs
+        are wired to the dataset iterator.
+
+        `batch_type` is one of "pure", "feat" and "seq", which determines
+        the layout of batches.
+        """
+        input_mode = kwargs.get("input_mode", "feed_dict")
+        if input_mode not in ("feed_dict", "tf_data"):
+            raise ValueError(
+                "input_mode must either be 'feed_dict' or 'tf_data'")
+        if input_mode == "feed_dict":
+            self.tf_input = None
+            return
+
+        input_names = []
+        for pos, name in enumerate(self.batch_inputs[batch_type]):
+            if name == "sparse_indices" and not getattr(self, "sparse", False):
+                continue
+            if name == "dense_values" and not getattr(self, "dense", False):
+                continue
+            input_names.append((name, pos))
+        self.tf_input = TfDataInput(
+            data_generator,
+            input_names,
+            num_parallel_calls=kwargs.get("num_workers", 1),
+            prefetch_size=max(1, kwargs.get("prefetch_size", 1))
+        )
+
+    def _input_placeholder(self, name, dtype, shape):
+        """Placeholder of model input, which defaults to the `tf.data`
+        iterator output in "tf_data" input mode."""
+        if self.tf_input is not None and name in self.tf_input.inputs:
+            return tf.placeholder_with_default(
+                self.tf_input.inputs[name], shape=shape)
+        return tf.placeholder(dtype, shape=shape)
+
+    def _train_tf_input(self, shuffle):
+        self.tf_input.initialize(self.sess, shuffle, self.batch_size)
+        feed_dict = ({self.is_training: True}
+                     if hasattr(self, "is_training") else None)
+        train_total_loss = []
+        while True:
+            try:
+                train_loss, _ = self.sess.run(
+                    [self.loss, self.training_op], feed_dict)
+            except tf.errors.OutOfRangeError:
+                break
+            train_total_loss.append(train_loss)
+        return train_total_loss
+
+    @staticmethod
+    def _prefetch_data(data_generator, **kwargs):
+        """Wrap data generator to build batches in background workers.
+
+        Options are passed from `fit`: `prefetch_size` (number of batches
+        produced in advance, 0 means no prefetching), `num_workers` and
+        `prefetch_backend` ("thread" or "process"). `shuffle_block_size`
+        enables block shuffling in the data generator.
+        """
+        if kwargs.get("shuffle_block_size"):
+            data_generator.shuffle_block_size = kwargs["shuffle_block_size"]
+        return Prefetcher(data_generator,
+                          prefetch_size=kwargs.get("prefetch_size", 0),
+                          num_workers=kwargs.get("num_workers", 1),
+                          backend=kwargs.get("prefetch_backend", "thread"))
+
+    def _print_wait_time(self, data_generator):
+        if self.tf_input is not None:
+            return
+        wait_time_str = f"data wait time: {data_generator.wait_time:.4f}s"
+        print(f"\t {colorize(wait_time_str, 'green')}")
 
     def train_seq(self):
         pass  # TODO: combine train_feat and train_seq
@@ -8,9 +8,9 @@ author: massquantity
 """
 import time
 import logging
-from itertools import islice
 from functools import partial
 import numpy as np
+from scipy.sparse import csr_matrix
 import tensorflow as tf
 from tensorflow.python.keras.initializers import (
     zeros as tf_zeros,
@@ -18,7 +18,10 @@ from tensorflow.python.keras.initializers import (
 )
 from .base import Base, TfMixin
 from ..evaluate.evaluate import EvalMixin
-from ..utils.sampling import PairwiseSampling
+from ..data.growable import append_rows
+from ..data.consumed import ConsumedIndex
+from ..utils.sampling import PairwiseSampling, sample_negative_items
+from ..utils.fold_in import interactions_to_csr
 from ..utils.misc import time_block, colorize
 from ..utils.initializers import truncated_normal
 try:
@@ -77,6 +80,40 @@ class BPR(Base, TfMixin, EvalMixin):
             shape=(self.n_items, self.embed_size + 1), mean=0.0, scale=0.03)
         self.item_embed[:, self.embed_size] = 0.0
 
+    def extend(self, data_info, train_data=None):
+        """Grow embeddings for new users and items after the data has been
+        extended by `Dataset.extend_trainset`. In tf version the graph is
+        rebuilt with larger variables, and trained values are restored.
+
+        Parameters
+        ----------
+        data_info : `DataInfo` object
+            Extended data info.
+        train_data : `TransformedSet` object, optional
+            Extended train data, whose consumed items are used in
+            recommendation.
+        """
+        n_new_users, n_new_items = self._extend_data_info(data_info,
+                                                          train_data)
+        if self.use_tf:
+            self._reset_graph()
+            self._build_model_tf()
+            self._build_train_ops()
+            self._restore_variables()
+            if self.user_embed is not None:
+                self._set_latent_factors()
+        else:
+            new_user_embed = truncated_normal(
+                shape=(n_new_users, self.embed_size + 1), mean=0.0,
+                scale=0.03)
+            new_user_embed[:, self.embed_size] = 1.0
+            new_item_embed = truncated_normal(
+                shape=(n_new_items, self.embed_size + 1), mean=0.0,
+                scale=0.03)
+            new_item_embed[:, self.embed_size] = 0.0
+            self.user_embed = append_rows(self.user_embed, new_user_embed)
+            self.item_embed = append_rows(self.item_embed, new_item_embed)
+
     def _build_model_tf(self):
         if isinstance(self.reg, float) and self.reg > 0.0:
             tf_reg = tf.keras.regularizers.l2(self.reg)
@@ -152,6 +189,27 @@ class BPR(Base, TfMixin, EvalMixin):
     def _fit_cython(self, train_data, verbose=1, shuffle=True, num_threads=1,
                     eval_data=None, metrics=None, optimizer="sgd"):
 
+        trainer = self._cython_trainer(optimizer)
+        for epoch in range(1, self.n_epochs + 1):
+            with time_block(f"Epoch {epoch}", verbose):
+                trainer(optimizer=optimizer,
+                        train_data=train_data,
+                        user_embed=self.user_embed,
+                        item_embed=self.item_embed,
+                        lr=self.lr,
+                        reg=self.reg,
+                        n_users=self.n_users,
+                        n_items=self.n_items,
+                        shuffle=shuffle,
+                        num_threads=num_threads,
+                        seed=self.seed,
+                        epoch=epoch)
+
+            if verbose > 1:
+                self.print_metrics(eval_data=eval_data, metrics=metrics)
+                print("="*30)
+
+    def _cython_trainer(self, optimizer):
         if optimizer == "sgd":
             trainer = partial(bpr_update)
 
@@ -183,25 +241,7 @@ class BPR(Base, TfMixin, EvalMixin):
         else:
             raise ValueError("optimizer must be one of these: "
                              "('sgd', 'momentum', 'adam')")
-
-        for epoch in range(1, self.n_epochs + 1):
-            with time_block(f"Epoch {epoch}", verbose):
-                trainer(optimizer=optimizer,
-                        train_data=train_data,
-                        user_embed=self.user_embed,
-                        item_embed=self.item_embed,
-                        lr=self.lr,
-                        reg=self.reg,
-                        n_users=self.n_users,
-                        n_items=self.n_items,
-                        shuffle=shuffle,
-                        num_threads=num_threads,
-                        seed=self.seed,
-                        epoch=epoch)
-
-            if verbose > 1:
-                self.print_metrics(eval_data=eval_data, metrics=metrics)
-                print("="*30)
+        return trainer
 
     def _fit_tf(self, train_data, verbose=1, shuffle=True,
                 eval_data=None, metrics=None):
@@ -212,15 +252,7 @@ class BPR(Base, TfMixin, EvalMixin):
 
         for epoch in range(1, self.n_epochs + 1):
             with time_block(f"Epoch {epoch}", verbose):
-                for (user,
-                     item_pos,
-                     item_neg) in data_generator(shuffle=shuffle,
-                                                 batch_size=self.batch_size):
-
-                    self.sess.run(self.training_op,
-                                  feed_dict={self.user_indices: user,
-                                             self.item_indices_pos: item_pos,
-                                             self.item_indices_neg: item_neg})
+                self._train_tf_epoch(data_generator, shuffle)
 
             if verbose > 1:
                 # set up parameters for evaluate
@@ -230,6 +262,93 @@ class BPR(Base, TfMixin, EvalMixin):
 
         self._set_latent_factors()  # for prediction and recommendation
 
+    def _train_tf_epoch(self, data_generator, shuffle):
+        for (user,
+             item_pos,
+             item_neg) in data_generator(shuffle=shuffle,
+                                         batch_size=self.batch_size):
+
+            self.sess.run(self.training_op,
+                          feed_dict={self.user_indices: user,
+                                     self.item_indices_pos: item_pos,
+                                     self.item_indices_neg: item_neg})
+
+    def partial_fit(self, train_data, delta_data, n_epochs=None,
+                    replay_ratio=1.0, verbose=1, shuffle=True, num_threads=1,
+                    optimizer="sgd"):
+        """Incrementally train on new interactions, starting from current
+        embeddings.
+
+        Every epoch only iterates over the positive pairs in `delta_data`,
+        plus `replay_ratio * len(delta_data)` pairs sampled from the whole
+        `train_data`, which keeps the model from drifting away from older
+        interactions. Negative items are sampled against `train_data`.
+
+        Parameters
+        ----------
+        train_data : `TransformedSet` object
+            Whole train data, which has been extended with the new
+            interactions by `Dataset.extend_trainset`.
+        delta_data : `TransformedSet` object
+            New interactions encoded by the same `DataInfo`, e.g.
+            `DatasetPure.build_testset(delta, data_info=data_info)`.
+        n_epochs : int, optional
+            Number of epochs, default is `n_epochs` of the model.
+        replay_ratio : float, optional
+            Number of replayed pairs relative to the number of new pairs.
+        """
+        self._check_data_size(train_data)
+        self.user_consumed = train_data.user_consumed
+        n_epochs = n_epochs or self.n_epochs
+        if not self.use_tf:
+            trainer = self._cython_trainer(optimizer)
+
+        for epoch in range(1, n_epochs + 1):
+            user_indices, item_indices = self._replay_sample(
+                train_data, delta_data, replay_ratio, self.seed + epoch)
+            with time_block(f"Epoch {epoch}", verbose):
+                if self.use_tf:
+                    data_generator = PairwiseSampling(
+                        train_data, self.data_info, self.num_neg,
+                        num_threads=num_threads, user_indices=user_indices,
+                        item_indices=item_indices)
+                    self._train_tf_epoch(data_generator, shuffle)
+                else:
+                    trainer(optimizer=optimizer,
+                            train_data=train_data,
+                            user_embed=self.user_embed,
+                            item_embed=self.item_embed,
+                            lr=self.lr,
+                            reg=self.reg,
+                            n_users=self.n_users,
+                            n_items=self.n_items,
+                            shuffle=shuffle,
+                            num_threads=num_threads,
+                            seed=self.seed + epoch,
+                            epoch=epoch,
+                            user_indices=user_indices,
+                            item_indices=item_indices)
+
+        if self.use_tf:
+            self._set_latent_factors()
+
+    @staticmethod
+    def _replay_sample(train_data, delta_data, replay_ratio, seed):
+        if train_data.has_sampled:
+            train_users = train_data.user_indices_orig
+            train_items = train_data.item_indices_orig
+        else:
+            train_users = train_data.user_indices
+            train_items = train_data.item_indices
+        n_replay = int(replay_ratio * len(delta_data))
+        random_state = np.random.RandomState(seed)
+        replay = random_state.randint(0, len(train_users), n_replay)
+        user_indices = np.concatenate([delta_data.user_indices,
+                                       train_users[replay]])
+        item_indices = np.concatenate([delta_data.item_indices,
+                                       train_items[replay]])
+        return user_indices, item_indices
+
     def predict(self, user, item):
         user = np.asarray(
             [user]) if isinstance(user, int) else np.asarray(user)
@@ -250,23 +369,77 @@ class BPR(Base, TfMixin, EvalMixin):
 
         return preds[0] if len(user) == 1 else preds
 
-    def recommend_user(self, user, n_rec, **kwargs):
-        user = self._check_unknown_user(user)
-        if not user:
-            return   # popular ?
-
-        consumed = self.user_consumed[user]
-        count = n_rec + len(consumed)
-        recos = self.user_embed[user] @ self.item_embed.T
-        recos = 1 / (1 + np.exp(-recos))
-
-        ids = np.argpartition(recos, -count)[-count:]
-        rank = sorted(zip(ids, recos[ids]), key=lambda x: -x[1])
-        return list(
-            islice(
-                (rec for rec in rank if rec[0] not in consumed), n_rec
-            )
-        )
+    def _dot_factors(self, users):
+        # item bias is the last dimension of item_embed
+        return self.user_embed[users], self.item_embed, None, None
+
+    def recommend_from_interactions(self, item_ids, weights=None, n_rec=10,
+                                    n_steps=20, lr=0.5, seed=42):
+        """Recommend for users unseen in training, given their interacted
+        items.
+
+        User vectors start from zero and take `n_steps` full-batch gradient
+        steps of the BPR objective against fixed item embeddings, with one
+        sampled negative item per interaction in every step. Gradients are
+        weighted averages over interactions of every user, so `lr` doesn't
+        depend on the number of interactions. All users in a batch are
+        updated together, and nothing is stored in the model.
+
+        Parameters
+        ----------
+        item_ids : array_like or list of array_like
+            Interacted item indices of a user, or a list of them for a batch
+            of users.
+        weights : array_like or list of array_like, optional
+            Weight of every interaction in the objective, default is 1.
+        n_rec : int, optional
+            Number of recommendations for every user.
+        n_steps : int, optional
+            Number of gradient steps.
+        lr : float, optional
+            Learning rate of gradient steps.
+        seed : int, optional
+            Random seed of negative sampling.
+
+        Returns
+        -------
+        result : list of tuples, or list of them for a batch of users
+            Each recommendation is an (item_id, score) tuple, items that
+            have been interacted are excluded.
+        """
+        interaction, is_batch = interactions_to_csr(
+            item_ids, weights, self.n_items)
+        n_users, nnz = interaction.shape[0], interaction.nnz
+        rows = np.repeat(np.arange(n_users), np.diff(interaction.indptr))
+        items = interaction.indices
+        consumed = ConsumedIndex(rows, items, n_rows=n_users)
+        # averages gradients of interactions of every user
+        total_weights = np.maximum(interaction.sum(axis=1).A1, 1e-8)
+        weight_matrix = csr_matrix(
+            (interaction.data / total_weights[rows], np.arange(nnz),
+             interaction.indptr),
+            shape=(n_users, nnz))
+        reg = self.reg or 0.0
+
+        # last dimension multiplies item bias, so it's fixed to 1.0
+        user_embed = np.zeros((n_users, self.embed_size + 1),
+                              dtype=np.float32)
+        user_embed[:, self.embed_size] = 1.0
+        for step in range(n_steps):
+            item_neg = sample_negative_items(
+                rows, self.n_items, consumed, seed=seed + step).ravel()
+            item_diff = self.item_embed[items] - self.item_embed[item_neg]
+            x_diff = np.sum(user_embed[rows] * item_diff, axis=1)
+            log_sigmoid_grad = 1.0 / (1.0 + np.exp(x_diff))
+            grad = weight_matrix @ (log_sigmoid_grad[:, np.newaxis]
+                                    * item_diff)
+            grad -= reg * user_embed
+            user_embed[:, :self.embed_size] += (
+                lr * grad[:, :self.embed_size])
+
+        scores = 1 / (1 + np.exp(-(user_embed @ self.item_embed.T)))
+        return self._recommend_from_scores(
+            scores, interaction, n_rec, is_batch)
 
     def _set_latent_factors(self):
         item_bias, user_embed, item_embed = self.sess.run(
@@ -7,7 +7,6 @@ author: massquantity
 
 """
 import time
-from itertools import islice
 import numpy as np
 import tensorflow as tf
 from tensorflow.python.keras.initializers import (
@@ -30,6 +29,9 @@ from ..utils.unique_features import (
 
 
 class DeepFM(Base, TfMixin, EvalMixin):
+    # upper bound of samples fed to the session in one block of
+    # `recommend_users`, which are much heavier than dot products
+    _score_block_size = 1 << 18
 
     def __init__(self, task, data_info=None, embed_size=16,
                  n_epochs=20, lr=0.001, lr_decay=False, reg=None,
@@ -71,7 +73,8 @@ class DeepFM(Base, TfMixin, EvalMixin):
 
     def _build_model(self):
         tf.set_random_seed(self.seed)
-        self.labels = tf.placeholder(tf.float32, shape=[None])
+        self.labels = self._input_placeholder(
+            "labels", tf.float32, shape=[None])
         self.is_training = tf.placeholder_with_default(False, shape=[])
         self.linear_embed, self.pairwise_embed, self.deep_embed = [], [], []
 
@@ -102,8 +105,10 @@ class DeepFM(Base, TfMixin, EvalMixin):
             tf.layers.dense(concat_layer, units=1, activation=None))
 
     def _build_user_item(self):
-        self.user_indices = tf.placeholder(tf.int32, shape=[None])
-        self.item_indices = tf.placeholder(tf.int32, shape=[None])
+        self.user_indices = self._input_placeholder(
+            "user_indices", tf.int32, shape=[None])
+        self.item_indices = self._input_placeholder(
+            "item_indices", tf.int32, shape=[None])
 
         linear_user_feat = tf.get_variable(
             name="linear_user_feat",
@@ -147,8 +152,8 @@ class DeepFM(Base, TfMixin, EvalMixin):
         self.deep_embed.extend([deep_user_embed, deep_item_embed])
 
     def _build_sparse(self):
-        self.sparse_indices = tf.placeholder(
-            tf.int32, shape=[None, self.sparse_field_size])
+        self.sparse_indices = self._input_placeholder(
+            "sparse_indices", tf.int32, shape=[None, self.sparse_field_size])
 
         linear_sparse_feat = tf.get_variable(
             name="linear_sparse_feat",
@@ -174,8 +179,8 @@ class DeepFM(Base, TfMixin, EvalMixin):
         self.deep_embed.append(deep_sparse_embed)
 
     def _build_dense(self):
-        self.dense_values = tf.placeholder(
-            tf.float32, shape=[None, self.dense_field_size])
+        self.dense_values = self._input_placeholder(
+            "dense_values", tf.float32, shape=[None, self.dense_field_size])
         dense_values_reshape = tf.reshape(
             self.dense_values, [-1, self.dense_field_size, 1])
         batch_size = tf.shape(self.dense_values)[0]
@@ -247,9 +252,6 @@ class DeepFM(Base, TfMixin, EvalMixin):
         else:
             global_steps = None
 
-        self._build_model()
-        self._build_train_ops(global_steps)
-
         if self.task == "ranking" and self.batch_sampling:
             self._check_has_sampled(train_data, verbose)
             data_generator = NegativeSampling(train_data,
@@ -263,8 +265,13 @@ class DeepFM(Base, TfMixin, EvalMixin):
             data_generator = DataGenFeat(train_data,
                                          self.sparse,
                                          self.dense)
+        self._build_tf_input(data_generator, "feat", **kwargs)
+
+        self._build_model()
+        self._build_train_ops(global_steps)
 
-        self.train_feat(data_generator, verbose, shuffle, eval_data, metrics)
+        self.train_feat(data_generator, verbose, shuffle, eval_data, metrics,
+                        **kwargs)
 
     def predict(self, user, item):
         user = np.asarray(
@@ -295,32 +302,14 @@ class DeepFM(Base, TfMixin, EvalMixin):
 
         return preds
 
-    def recommend_user(self, user, n_rec, **kwargs):
-        user = self._check_unknown_user(user)
-        if not user:
-            return   # popular ?
-
+    def _score_users(self, users):
         (user_indices,
          item_indices,
          sparse_indices,
          dense_values) = get_recommend_indices_and_values(
-            self.data_info, user, self.n_items, self.sparse, self.dense)
+            self.data_info, users, self.n_items, self.sparse, self.dense)
         feed_dict = self._get_feed_dict(user_indices, item_indices,
                                         sparse_indices, dense_values,
                                         None, False)
-
-        recos = self.sess.run(self.output, feed_dict)
-        if self.task == "ranking":
-            recos = 1 / (1 + np.exp(-recos))
-
-        consumed = self.user_consumed[user]
-        count = n_rec + len(consumed)
-        ids = np.argpartition(recos, -count)[-count:]
-        rank = sorted(zip(ids, recos[ids]), key=lambda x: -x[1])
-        return list(
-            islice(
-                (rec for rec in rank if rec[0] not in consumed), n_rec
-            )
-        )
-
-
+        scores = self.sess.run(self.output, feed_dict)
+        return scores.reshape(len(users), self.n_items)
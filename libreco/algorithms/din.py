@@ -7,7 +7,6 @@ author: massquantity
 
 """
 import time
-from itertools import islice
 import numpy as np
 import tensorflow as tf
 from tensorflow.python.keras.initializers import (
@@ -33,6 +32,9 @@ from ..utils.unique_features import (
 
 
 class DIN(Base, TfMixin, EvalMixin):
+    # upper bound of samples fed to the session in one block of
+    # `recommend_users`, which are much heavier than dot products
+    _score_block_size = 1 << 18
 
     def __init__(self, task, data_info=None, embed_size=16, n_epochs=20,
                  lr=0.001, lr_decay=False, reg=None, batch_size=256, num_neg=1,
@@ -109,20 +111,27 @@ class DIN(Base, TfMixin, EvalMixin):
         count_params()
 
     def _build_placeholders(self):
-        self.user_indices = tf.placeholder(tf.int32, shape=[None])
-        self.item_indices = tf.placeholder(tf.int32, shape=[None])
-        self.user_interacted_seq = tf.placeholder(
-            tf.int32, shape=[None, self.max_seq_len])   # B * seq
-        self.user_interacted_len = tf.placeholder(tf.float32, shape=[None])
-        self.labels = tf.placeholder(tf.float32, shape=[None])
+        self.user_indices = self._input_placeholder(
+            "user_indices", tf.int32, shape=[None])
+        self.item_indices = self._input_placeholder(
+            "item_indices", tf.int32, shape=[None])
+        self.user_interacted_seq = self._input_placeholder(
+            "user_interacted_seq", tf.int32,
+            shape=[None, self.max_seq_len])   # B * seq
+        self.user_interacted_len = self._input_placeholder(
+            "user_interacted_len", tf.float32, shape=[None])
+        self.labels = self._input_placeholder(
+            "labels", tf.float32, shape=[None])
         self.is_training = tf.placeholder_with_default(False, shape=[])
 
         if self.sparse:
-            self.sparse_indices = tf.placeholder(
-                tf.int32, shape=[None, self.sparse_field_size])
+            self.sparse_indices = self._input_placeholder(
+                "sparse_indices", tf.int32,
+                shape=[None, self.sparse_field_size])
         if self.dense:
-            self.dense_values = tf.placeholder(
-                tf.float32, shape=[None, self.dense_field_size])
+            self.dense_values = self._input_placeholder(
+                "dense_values", tf.float32,
+                shape=[None, self.dense_field_size])
 
     def _build_variables(self):
         self.user_feat = tf.get_variable(
@@ -325,38 +334,47 @@ class DIN(Base, TfMixin, EvalMixin):
         else:
             global_steps = None
 
-        self._build_model()
-        self._build_train_ops(global_steps)
-
         data_generator = DataGenSequence(train_data, self.sparse, self.dense,
                                          mode=self.interaction_mode,
                                          num=self.max_seq_len,
                                          padding_idx=0)
+        self._build_tf_input(data_generator, "seq", **kwargs)
+
+        self._build_model()
+        self._build_train_ops(global_steps)
+
+        data_generator = self._prefetch_data(data_generator, **kwargs)
         for epoch in range(1, self.n_epochs + 1):
             if self.lr_decay:
                 print(f"With lr_decay, epoch {epoch} learning rate: "
                       f"{self.sess.run(self.lr)}")
             with time_block(f"Epoch {epoch}", verbose):
-                train_total_loss = []
-                for (u_seq, u_len, user, item, label, sparse_idx, dense_val
-                     ) in data_generator(shuffle, self.batch_size):
-                    feed_dict = self._get_seq_feed_dict(
-                        u_seq, u_len, user, item, label,
-                        sparse_idx, dense_val, True)
-                    train_loss, _ = self.sess.run(
-                        [self.loss, self.training_op], feed_dict)
-                    train_total_loss.append(train_loss)
+                if self.tf_input is not None:
+                    train_total_loss = self._train_tf_input(shuffle)
+                else:
+                    train_total_loss = []
+                    for (u_seq, u_len, user, item, label, sparse_idx,
+                         dense_val) in data_generator(shuffle,
+                                                      self.batch_size):
+                        feed_dict = self._get_seq_feed_dict(
+                            u_seq, u_len, user, item, label,
+                            sparse_idx, dense_val, True)
+                        train_loss, _ = self.sess.run(
+                            [self.loss, self.training_op], feed_dict)
+                        train_total_loss.append(train_loss)
 
             if verbose > 1:
                 train_loss_str = "train_loss: " + str(
                     round(np.mean(train_total_loss), 4)
                 )
                 print(f"\t {colorize(train_loss_str, 'green')}")
+                self._print_wait_time(data_generator)
                 # for evaluation
                 self._set_last_interacted()
                 self.print_metrics(eval_data=eval_data, metrics=metrics)
                 print("=" * 30)
 
+        data_generator.close()
         # for prediction and recommendation
         self._set_last_interacted()
 
@@ -387,35 +405,21 @@ class DIN(Base, TfMixin, EvalMixin):
 
         return preds[0] if len(user) == 1 else preds
 
-    def recommend_user(self, user, n_rec, **kwargs):
-        user = self._check_unknown_user(user)
-        if not user:
-            return   # popular ?
-
+    def _score_users(self, users):
         (user_indices,
          item_indices,
          sparse_indices,
          dense_values) = get_recommend_indices_and_values(
-            self.data_info, user, self.n_items, self.sparse, self.dense)
-        u_last_interacted = np.tile(self.user_last_interacted[user],
-                                    (self.n_items, 1))
-        u_interacted_len = np.repeat(self.last_interacted_len[user],
+            self.data_info, users, self.n_items, self.sparse, self.dense)
+        u_last_interacted = np.repeat(self.user_last_interacted[users],
+                                      self.n_items, axis=0)
+        u_interacted_len = np.repeat(self.last_interacted_len[users],
                                      self.n_items)
         feed_dict = self._get_seq_feed_dict(u_last_interacted, u_interacted_len,
                                             user_indices, item_indices, None,
                                             sparse_indices, dense_values, False)
-
-        recos = self.sess.run(self.output, feed_dict)
-        recos = 1 / (1 + np.exp(-recos))
-        consumed = self.user_consumed[user]
-        count = n_rec + len(consumed)
-        ids = np.argpartition(recos, -count)[-count:]
-        rank = sorted(zip(ids, recos[ids]), key=lambda x: -x[1])
-        return list(
-            islice(
-                (rec for rec in rank if rec[0] not in consumed), n_rec
-            )
-        )
+        scores = self.sess.run(self.output, feed_dict)
+        return scores.reshape(len(users), self.n_items)
 
     def _set_last_interacted(self):
         user_indices = np.arange(self.n_users)
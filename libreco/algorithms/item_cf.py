@@ -1,12 +1,12 @@
 import random
 import time
-from operator import itemgetter
-from itertools import islice, takewhile
-from collections import defaultdict
 import numpy as np
 from scipy.sparse import issparse
 from .base import Base
-from ..utils.similarities import cosine_sim, pearson_sim, jaccard_sim
+from ..utils.similarities import (
+    cosine_sim, pearson_sim, jaccard_sim, adjusted_cosine_sim, tfidf_sim,
+    bm25_sim, asymmetric_cosine_sim, top_k_sim, common_neighbor_sums
+)
 from ..utils.misc import time_block, colorize
 from ..evaluate.evaluate import EvalMixin
 
@@ -32,11 +32,14 @@ class ItemCF(Base, EvalMixin):
         self.item_interaction = None
         # sparse similarity matrix
         self.sim_matrix = None
+        # sparse similarity matrix of top k neighbors
+        self.topk_sim = None
         self.print_count = 0
         self._caution_sim_type()
 
     def fit(self, train_data, block_size=None, num_threads=1, min_common=1,
-            mode="invert", verbose=1, eval_data=None, metrics=None):
+            mode="invert", verbose=1, eval_data=None, metrics=None,
+            lsh_params=None, sim_params=None):
         self.show_start_time()
         self.user_interaction = train_data.sparse_interaction
         self.item_interaction = self.user_interaction.T.tocsr()
@@ -49,15 +52,28 @@ class ItemCF(Base, EvalMixin):
                 sim_func = pearson_sim
             elif self.sim_type == "jaccard":
                 sim_func = jaccard_sim
+            elif self.sim_type == "adjusted_cosine":
+                sim_func = adjusted_cosine_sim
+            elif self.sim_type == "tfidf":
+                sim_func = tfidf_sim
+            elif self.sim_type == "bm25":
+                sim_func = bm25_sim
+            elif self.sim_type == "asymmetric_cosine":
+                sim_func = asymmetric_cosine_sim
             else:
                 raise ValueError("sim_type must be one of "
-                                 "('cosine', 'pearson', 'jaccard')")
+                                 "('cosine', 'pearson', 'jaccard', "
+                                 "'adjusted_cosine', 'tfidf', 'bm25', "
+                                 "'asymmetric_cosine')")
 
             self.sim_matrix = sim_func(
                 self.item_interaction, self.user_interaction, self.n_items,
-                self.n_users, block_size, num_threads, min_common, mode)
+                self.n_users, block_size, num_threads, min_common, mode,
+                topk=self.k, lsh_params=lsh_params,
+                **(sim_params or {}))
 
-        assert self.sim_matrix.has_sorted_indices
+        # only the top k positive neighbors are used in prediction
+        self.topk_sim = top_k_sim(self.sim_matrix, self.k)
         if issparse(self.sim_matrix):
             n_elements = self.sim_matrix.getnnz()
             sparsity_ratio = 100*n_elements / (self.n_users*self.n_users)
@@ -79,53 +95,28 @@ class ItemCF(Base, EvalMixin):
         unknown_num, unknown_index, user, item = self._check_unknown(
             user, item)
 
-        preds = []
-        sim_matrix = self.sim_matrix
-        interaction = self.user_interaction
-        for u, i in zip(user, item):
-            item_slice = slice(sim_matrix.indptr[i], sim_matrix.indptr[i+1])
-            sim_items = sim_matrix.indices[item_slice]
-            sim_values = sim_matrix.data[item_slice]
-
-            user_slice = slice(interaction.indptr[u], interaction.indptr[u+1])
-            user_interacted_i = interaction.indices[user_slice]
-            user_interacted_values = interaction.data[user_slice]
-            common_items, indices_in_i, indices_in_u = np.intersect1d(
-                sim_items, user_interacted_i,
-                assume_unique=True, return_indices=True)
-
-            common_sims = sim_values[indices_in_i]
-            common_labels = user_interacted_values[indices_in_u]
-            if common_items.size == 0 or np.all(common_sims <= 0.0):
-                self.print_count += 1
-                no_str = (f"No common interaction or similar neighbor "
-                          f"for user {u} and item {i}, "
-                          f"proceed with default prediction")
-                if self.print_count < 13:
-                    print(f"{colorize(no_str, 'red')}")
-                preds.append(self.default_prediction)
-            else:
-                k_neighbor_labels, k_neighbor_sims = zip(*islice(
-                    takewhile(lambda x: x[1] > 0,
-                              sorted(zip(common_labels, common_sims),
-                                     key=itemgetter(1),
-                                     reverse=True)
-                              ),
-                    self.k))
-
-                if self.task == "rating":
-                    sims_distribution = (
-                            k_neighbor_sims / np.sum(k_neighbor_sims)
-                    )
-                    weighted_pred = np.average(
-                        k_neighbor_labels, weights=sims_distribution
-                    )
-                    preds.append(
-                        np.clip(weighted_pred, self.lower_bound,
-                                self.upper_bound)
-                    )
-                elif self.task == "ranking":
-                    preds.append(np.mean(k_neighbor_sims))
+        # neighbors of item among the items user interacted with
+        weighted_sums, sim_sums, counts = common_neighbor_sums(
+            self.topk_sim, item, self.user_interaction, user)
+        no_neighbor = counts == 0
+        n_print = max(0, 12 - self.print_count)
+        self.print_count += np.count_nonzero(no_neighbor)
+        for u, i in zip(user[no_neighbor][:n_print],
+                        item[no_neighbor][:n_print]):
+            no_str = (f"No common interaction or similar neighbor "
+                      f"for user {u} and item {i}, "
+                      f"proceed with default prediction")
+            print(f"{colorize(no_str, 'red')}")
+
+        has_neighbor = ~no_neighbor
+        preds = np.full(len(user), self.default_prediction, dtype=np.float64)
+        if self.task == "rating":
+            preds[has_neighbor] = np.clip(
+                weighted_sums[has_neighbor] / sim_sums[has_neighbor],
+                self.lower_bound, self.upper_bound)
+        elif self.task == "ranking":
+            preds[has_neighbor] = (sim_sums[has_neighbor]
+                                   / counts[has_neighbor])
 
         if unknown_num > 0:
             preds[unknown_index] = self.default_prediction
@@ -134,30 +125,14 @@ class ItemCF(Base, EvalMixin):
 
     def recommend_user(self, user, n_rec, random_rec=False):
         user = self._check_unknown_user(user)
-        if not user:
+        if user is None:
             return   # popular ?
 
-        u_consumed = set(self.user_consumed[user])
-        user_slice = slice(self.user_interaction.indptr[user],
-                           self.user_interaction.indptr[user + 1])
-        user_interacted_i = self.user_interaction.indices[user_slice]
-        user_interacted_labels = self.user_interaction.data[user_slice]
-
-        result = defaultdict(lambda: 0.0)
-        for i, i_label in zip(user_interacted_i, user_interacted_labels):
-            item_slice = slice(self.sim_matrix.indptr[i],
-                               self.sim_matrix.indptr[i+1])
-            sim_items = self.sim_matrix.indices[item_slice]
-            sim_values = self.sim_matrix.data[item_slice]
-            item_sim_topk = sorted(
-                zip(sim_items, sim_values),
-                key=itemgetter(1), reverse=True)[:self.k]
-            for j, sim in item_sim_topk:
-                if j in u_consumed:
-                    continue
-                result[j] += sim * i_label
-
-        if len(result) == 0:
+        n_candidates = self.n_items if random_rec else n_rec
+        items, scores = self._recommend_block(
+            np.array([user]), n_candidates, filter_consumed=True)
+        valid = items[0] >= 0
+        if not np.any(valid):
             self.print_count += 1
             no_str = (f"no suitable recommendation for user {user}, "
                       f"return default recommendation")
@@ -165,8 +140,7 @@ class ItemCF(Base, EvalMixin):
                 print(f"{colorize(no_str, 'red')}")
             return -1
 
-        rank_items = [(k, v) for k, v in result.items()]
-        rank_items.sort(key=lambda x: -x[1])
+        rank_items = list(zip(items[0][valid], scores[0][valid]))
         if random_rec:
             if len(rank_items) < n_rec:
                 item_candidates = rank_items
@@ -176,8 +150,17 @@ class ItemCF(Base, EvalMixin):
         else:
             return rank_items[:n_rec]
 
+    def _score_users_sparse(self, users):
+        # sum of similarities of top k neighbors of consumed items,
+        # weighted by labels
+        return self.user_interaction[users] @ self.topk_sim
+
+    def _output_scores(self, scores):
+        return scores
+
     def _caution_sim_type(self):
-        if self.task == "ranking" and self.sim_type == "pearson":
+        if (self.task == "ranking"
+                and self.sim_type in ("pearson", "adjusted_cosine")):
             caution_str = (f"Warning: {self.sim_type} is not suitable "
                            f"for implicit data")
             print(f"{colorize(caution_str, 'red')}")
@@ -6,7 +6,6 @@ author: massquantity
 
 """
 import time
-from itertools import islice
 import numpy as np
 import tensorflow as tf
 from tensorflow.python.keras.initializers import (
@@ -26,6 +25,10 @@ from ..data.data_generator import DataGenPure
 
 
 class NCF(Base, TfMixin, EvalMixin):
+    # upper bound of samples fed to the session in one block of
+    # `recommend_users`, which are much heavier than dot products
+    _score_block_size = 1 << 18
+
     def __init__(self, task, data_info, embed_size=16, n_epochs=20, lr=0.01,
                  lr_decay=False, reg=None, batch_size=256, num_neg=1,
                  use_bn=True, dropout_rate=None, hidden_units="128,64,32",
@@ -59,9 +62,12 @@ class NCF(Base, TfMixin, EvalMixin):
         self.user_consumed = None
 
     def _build_model(self):
-        self.user_indices = tf.placeholder(tf.int32, shape=[None])
-        self.item_indices = tf.placeholder(tf.int32, shape=[None])
-        self.labels = tf.placeholder(tf.float32, shape=[None])
+        self.user_indices = self._input_placeholder(
+            "user_indices", tf.int32, shape=[None])
+        self.item_indices = self._input_placeholder(
+            "item_indices", tf.int32, shape=[None])
+        self.labels = self._input_placeholder(
+            "labels", tf.float32, shape=[None])
         self.is_training = tf.placeholder_with_default(False, shape=[])
 
         user_gmf = tf.get_variable(name="user_gmf",
@@ -131,21 +137,22 @@ class NCF(Base, TfMixin, EvalMixin):
         else:
             global_steps = None
 
-        self._build_model()
-        self._build_train_ops(global_steps)
-
         if self.task == "ranking" and self.batch_sampling:
             self._check_has_sampled(train_data, verbose)
             data_generator = NegativeSampling(train_data,
                                               self.data_info,
                                               self.num_neg,
-                                              self.batch_size,
                                               batch_sampling=True)
 
         else:
             data_generator = DataGenPure(train_data)
+        self._build_tf_input(data_generator, "pure", **kwargs)
+
+        self._build_model()
+        self._build_train_ops(global_steps)
 
-        self.train_pure(data_generator, verbose, shuffle, eval_data, metrics)
+        self.train_pure(data_generator, verbose, shuffle, eval_data, metrics,
+                        **kwargs)
 
     def predict(self, user, item):
         user = np.asarray(
@@ -172,31 +179,12 @@ class NCF(Base, TfMixin, EvalMixin):
 
         return preds[0] if len(user) == 1 else preds
 
-    def recommend_user(self, user, n_rec, **kwargs):
-        user = self._check_unknown_user(user)
-        if not user:
-            return   # popular ?
-
-        user_indices = np.full(self.n_items, user)
-        item_indices = np.arange(self.n_items)
-        recos = self.sess.run(self.output, feed_dict={
+    def _score_users(self, users):
+        user_indices = np.repeat(users, self.n_items)
+        item_indices = np.tile(np.arange(self.n_items), len(users))
+        scores = self.sess.run(self.output, feed_dict={
             self.user_indices: user_indices,
             self.item_indices: item_indices,
             self.is_training: False
         })
-        if self.task == "ranking":
-            recos = 1 / (1 + np.exp(-recos))
-
-        consumed = self.user_consumed[user]
-        count = n_rec + len(consumed)
-        ids = np.argpartition(recos, -count)[-count:]
-        rank = sorted(zip(ids, recos[ids]), key=lambda x: -x[1])
-        return list(
-            islice(
-                (rec for rec in rank if rec[0] not in consumed), n_rec
-            )
-        )
-
-
-
-
+        return scores.reshape(len(users), self.n_items)
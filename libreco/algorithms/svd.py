@@ -7,8 +7,8 @@ author: massquantity
 
 """
 import time
-from itertools import islice
 import numpy as np
+from scipy.sparse import csr_matrix
 import tensorflow as tf
 from tensorflow.python.keras.initializers import (
     zeros as tf_zeros,
@@ -17,8 +17,12 @@ from tensorflow.python.keras.initializers import (
 from .base import Base, TfMixin
 from ..evaluate.evaluate import EvalMixin
 from ..utils.tf_ops import reg_config
-from ..utils.sampling import NegativeSampling
+from ..utils.sampling import NegativeSampling, sample_negative_items
 from ..data.data_generator import DataGenPure
+from ..data.growable import append_rows, grow_rows
+from ..utils.initializers import truncated_normal
+from ..utils.fold_in import interactions_to_csr, weighted_ridge
+from ..data.consumed import ConsumedIndex
 
 
 class SVD(Base, TfMixin, EvalMixin):
@@ -52,13 +56,13 @@ class SVD(Base, TfMixin, EvalMixin):
         self.pu = None
         self.qi = None
 
-        self._build_model()
-        self._build_train_ops()
-
     def _build_model(self):
-        self.user_indices = tf.placeholder(tf.int32, shape=[None])
-        self.item_indices = tf.placeholder(tf.int32, shape=[None])
-        self.labels = tf.placeholder(tf.float32, shape=[None])
+        self.user_indices = self._input_placeholder(
+            "user_indices", tf.int32, shape=[None])
+        self.item_indices = self._input_placeholder(
+            "item_indices", tf.int32, shape=[None])
+        self.labels = self._input_placeholder(
+            "labels", tf.float32, shape=[None])
 
         self.bu_var = tf.get_variable(name="bu_var", shape=[self.n_users],
                                       initializer=tf_zeros,
@@ -108,7 +112,7 @@ class SVD(Base, TfMixin, EvalMixin):
         self.sess.run(tf.global_variables_initializer())
 
     def fit(self, train_data, verbose=1, shuffle=True,
-            eval_data=None, metrics=None):
+            eval_data=None, metrics=None, **kwargs):
         self.show_start_time()
         self.user_consumed = train_data.user_consumed
 
@@ -117,15 +121,50 @@ class SVD(Base, TfMixin, EvalMixin):
             data_generator = NegativeSampling(train_data,
                                               self.data_info,
                                               self.num_neg,
-                                              self.batch_size,
                                               batch_sampling=True)
 
         else:
             data_generator = DataGenPure(train_data)
+        # the graph is rebuilt on every fit, trained values are restored
+        if hasattr(self, "bu_var"):
+            self._reset_graph()
+        self._build_tf_input(data_generator, "pure", **kwargs)
+
+        self._build_model()
+        self._build_train_ops()
+        self._restore_variables()
 
-        self.train_pure(data_generator, verbose, shuffle, eval_data, metrics)
+        self.train_pure(data_generator, verbose, shuffle, eval_data, metrics,
+                        **kwargs)
         self._set_latent_factors()
 
+    def extend(self, data_info, train_data=None):
+        """Grow embeddings for new users and items after the data has been
+        extended by `Dataset.extend_trainset`.
+
+        Trained variables are kept, and the graph will be rebuilt with
+        larger variables in the next `fit`, which restores them.
+
+        Parameters
+        ----------
+        data_info : `DataInfo` object
+            Extended data info.
+        train_data : `TransformedSet` object, optional
+            Extended train data, whose consumed items are used in
+            recommendation.
+        """
+        n_new_users, n_new_items = self._extend_data_info(data_info,
+                                                          train_data)
+        if hasattr(self, "pu_var"):
+            self._reset_graph()
+        if self.pu is not None:
+            self.bu = grow_rows(self.bu, n_new_users)
+            self.bi = grow_rows(self.bi, n_new_items)
+            self.pu = append_rows(self.pu, truncated_normal(
+                shape=[n_new_users, self.embed_size], mean=0.0, scale=0.05))
+            self.qi = append_rows(self.qi, truncated_normal(
+                shape=[n_new_items, self.embed_size], mean=0.0, scale=0.05))
+
     def predict(self, user, item):
         user = np.asarray(
             [user]) if isinstance(user, int) else np.asarray(user)
@@ -149,26 +188,103 @@ class SVD(Base, TfMixin, EvalMixin):
 
         return preds[0] if len(user) == 1 else preds
 
-    def recommend_user(self, user, n_rec, **kwargs):
-        user = self._check_unknown_user(user)
-        if not user:
-            return   # popular ?
+    def _dot_factors(self, users):
+        user_bias = self.bu[users]
+        if self.task == "rating":
+            user_bias = user_bias + self.global_mean
+        return self.pu[users], self.qi, self.bi, user_bias
+
+    def recommend_from_interactions(self, item_ids, weights=None, n_rec=10,
+                                    n_steps=20, lr=0.5, seed=42):
+        """Recommend for users unseen in training, given their interacted
+        items.
 
-        consumed = self.user_consumed[user]
-        count = n_rec + len(consumed)
-        recos = self.bu[user] + self.bi + self.pu[user] @ self.qi.T
+        User bias and embedding are computed on the fly against fixed item
+        factors, and nothing is stored in the model. In rating task, they
+        are the exact least squares solution given the ratings. In ranking
+        task, they take `n_steps` full-batch gradient steps of the logistic
+        loss, with one sampled negative item per interaction in every step,
+        and gradients are weighted averages over interactions of every user.
 
+        Parameters
+        ----------
+        item_ids : array_like or list of array_like
+            Interacted item indices of a user, or a list of them for a batch
+            of users.
+        weights : array_like or list of array_like, optional
+            Ratings in rating task, or weights of interactions in ranking
+            task. Default is 1.
+        n_rec : int, optional
+            Number of recommendations for every user.
+        n_steps : int, optional
+            Number of gradient steps in ranking task.
+        lr : float, optional
+            Learning rate of gradient steps in ranking task.
+        seed : int, optional
+            Random seed of negative sampling in ranking task.
+
+        Returns
+        -------
+        result : list of tuples, or list of them for a batch of users
+            Each recommendation is an (item_id, score) tuple, items that
+            have been interacted are excluded.
+        """
+        interaction, is_batch = interactions_to_csr(
+            item_ids, weights, self.n_items)
+        # user bias is solved along with embedding as an extra dimension
+        item_factors = np.hstack(
+            [np.ones((self.n_items, 1), dtype=np.float32), self.qi])
+        # a small default keeps the least squares of few ratings stable
+        reg = float(getattr(self.reg, "l2", 0.0)) or 0.01
         if self.task == "rating":
-            recos += self.global_mean
-        elif self.task == "ranking":
-            recos = 1 / (1 + np.exp(-recos))
-        ids = np.argpartition(recos, -count)[-count:]
-        rank = sorted(zip(ids, recos[ids]), key=lambda x: -x[1])
-        return list(
-            islice(
-                (rec for rec in rank if rec[0] not in consumed), n_rec
-            )
-        )
+            targets = (interaction.data - self.global_mean
+                       - self.bi[interaction.indices])
+            user_factors = weighted_ridge(
+                interaction.indptr, interaction.indices,
+                np.ones_like(interaction.data), targets, item_factors,
+                reg * np.eye(self.embed_size + 1, dtype=np.float32))
+        else:
+            user_factors = self._fold_in_logistic(
+                interaction, item_factors, reg, n_steps, lr, seed)
+
+        scores = (user_factors[:, :1] + self.bi
+                  + user_factors[:, 1:] @ self.qi.T)
+        if self.task == "rating":
+            scores += self.global_mean
+        else:
+            scores = 1 / (1 + np.exp(-scores))
+        return self._recommend_from_scores(
+            scores, interaction, n_rec, is_batch)
+
+    def _fold_in_logistic(self, interaction, item_factors, reg, n_steps, lr,
+                          seed):
+        n_users, nnz = interaction.shape[0], interaction.nnz
+        rows = np.repeat(np.arange(n_users), np.diff(interaction.indptr))
+        items = interaction.indices
+        consumed = ConsumedIndex(rows, items, n_rows=n_users)
+        total_weights = np.maximum(interaction.sum(axis=1).A1, 1e-8)
+        weight_matrix = csr_matrix(
+            (interaction.data / total_weights[rows], np.arange(nnz),
+             interaction.indptr),
+            shape=(n_users, nnz))
+
+        user_factors = np.zeros((n_users, self.embed_size + 1),
+                                dtype=np.float32)
+        for step in range(n_steps):
+            item_neg = sample_negative_items(
+                rows, self.n_items, consumed, seed=seed + step).ravel()
+            # positive items have label 1 and negative items have label 0
+            grad_pos = 1 - _sigmoid(
+                np.sum(user_factors[rows] * item_factors[items], axis=1)
+                + self.bi[items])
+            grad_neg = -_sigmoid(
+                np.sum(user_factors[rows] * item_factors[item_neg], axis=1)
+                + self.bi[item_neg])
+            grad = weight_matrix @ (
+                grad_pos[:, np.newaxis] * item_factors[items]
+                + grad_neg[:, np.newaxis] * item_factors[item_neg])
+            user_factors += lr * (grad - reg * user_factors)
+        return user_factors
 
     def _set_latent_factors(self):
         self.bu, self.bi, self.pu, self.qi = self.sess.run(
@@ -176,3 +292,5 @@ class SVD(Base, TfMixin, EvalMixin):
         )
 
 
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
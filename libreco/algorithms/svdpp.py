@@ -7,7 +7,6 @@ author: massquantity
 
 """
 import time
-from itertools import islice
 import numpy as np
 import tensorflow as tf
 from tensorflow.python.keras.initializers import (
@@ -56,9 +55,12 @@ class SVDpp(Base, TfMixin, EvalMixin):
         self.yj = None
 
     def _build_model(self, sparse_implicit_interaction):
-        self.user_indices = tf.placeholder(tf.int32, shape=[None])
-        self.item_indices = tf.placeholder(tf.int32, shape=[None])
-        self.labels = tf.placeholder(tf.float32, shape=[None])
+        self.user_indices = self._input_placeholder(
+            "user_indices", tf.int32, shape=[None])
+        self.item_indices = self._input_placeholder(
+            "item_indices", tf.int32, shape=[None])
+        self.labels = self._input_placeholder(
+            "labels", tf.float32, shape=[None])
 
         self.bu_var = tf.get_variable(name="bu_var", shape=[self.n_users],
                                       initializer=tf_zeros,
@@ -118,26 +120,27 @@ class SVDpp(Base, TfMixin, EvalMixin):
         self.sess.run(tf.global_variables_initializer())
 
     def fit(self, train_data, verbose=1, shuffle=True, sample_rate=None,
-            recent_num=None, eval_data=None, metrics=None):
+            recent_num=None, eval_data=None, metrics=None, **kwargs):
         self.show_start_time()
         self.user_consumed = train_data.user_consumed
         sparse_implicit_interaction = sparse_tensor_interaction(
             train_data, random_sample_rate=sample_rate, recent_num=recent_num)
 
-        self._build_model(sparse_implicit_interaction)
-        self._build_train_ops()
-
         if self.task == "ranking" and self.batch_sampling:
             self._check_has_sampled(train_data, verbose)
             data_generator = NegativeSampling(train_data,
                                               self.data_info,
                                               self.num_neg,
-                                              self.batch_size,
                                               batch_sampling=True)
         else:
             data_generator = DataGenPure(train_data)
+        self._build_tf_input(data_generator, "pure", **kwargs)
+
+        self._build_model(sparse_implicit_interaction)
+        self._build_train_ops()
 
-        self.train_pure(data_generator, verbose, shuffle, eval_data, metrics)
+        self.train_pure(data_generator, verbose, shuffle, eval_data, metrics,
+                        **kwargs)
         self._set_latent_factors()
 
     def predict(self, user, item):
@@ -163,26 +166,11 @@ class SVDpp(Base, TfMixin, EvalMixin):
 
         return preds[0] if len(user) == 1 else preds
 
-    def recommend_user(self, user, n_rec, **kwargs):
-        user = self._check_unknown_user(user)
-        if not user:
-            return   # popular ?
-
-        consumed = self.user_consumed[user]
-        count = n_rec + len(consumed)
-        recos = self.bu[user] + self.bi + self.puj[user] @ self.qi.T
-
+    def _dot_factors(self, users):
+        user_bias = self.bu[users]
         if self.task == "rating":
-            recos += self.global_mean
-        elif self.task == "ranking":
-            recos = 1 / (1 + np.exp(-recos))
-        ids = np.argpartition(recos, -count)[-count:]
-        rank = sorted(zip(ids, recos[ids]), key=lambda x: -x[1])
-        return list(
-            islice(
-                (rec for rec in rank if rec[0] not in consumed), n_rec
-            )
-        )
+            user_bias = user_bias + self.global_mean
+        return self.puj[users], self.qi, self.bi, user_bias
 
     def _set_latent_factors(self):
         self.bu, self.bi, self.pu, self.qi, self.puj = self.sess.run(
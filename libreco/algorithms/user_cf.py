@@ -1,12 +1,12 @@
 import random
 import time
-from operator import itemgetter
-from itertools import islice, takewhile
-from collections import defaultdict
 import numpy as np
 from scipy.sparse import issparse
 from .base import Base
-from ..utils.similarities import cosine_sim, pearson_sim, jaccard_sim
+from ..utils.similarities import (
+    cosine_sim, pearson_sim, jaccard_sim, adjusted_cosine_sim, tfidf_sim,
+    bm25_sim, asymmetric_cosine_sim, top_k_sim, common_neighbor_sums
+)
 from ..utils.misc import time_block, colorize
 from ..evaluate.evaluate import EvalMixin
 
@@ -32,11 +32,16 @@ class UserCF(Base, EvalMixin):
         self.item_interaction = None
         # sparse similarity matrix
         self.sim_matrix = None
+        # sparse similarity matrix of top k neighbors
+        self.topk_sim = None
+        # binary user_interaction, used as the denominator of scores
+        self._interacted = None
         self.print_count = 0
         self._caution_sim_type()
 
     def fit(self, train_data, block_size=None, num_threads=1, min_common=1,
-            mode="invert", verbose=1, eval_data=None, metrics=None):
+            mode="invert", verbose=1, eval_data=None, metrics=None,
+            lsh_params=None, sim_params=None):
         self.show_start_time()
         self.user_interaction = train_data.sparse_interaction
         self.item_interaction = self.user_interaction.T.tocsr()
@@ -49,15 +54,29 @@ class UserCF(Base, EvalMixin):
                 sim_func = pearson_sim
             elif self.sim_type == "jaccard":
                 sim_func = jaccard_sim
+            elif self.sim_type == "adjusted_cosine":
+                sim_func = adjusted_cosine_sim
+            elif self.sim_type == "tfidf":
+                sim_func = tfidf_sim
+            elif self.sim_type == "bm25":
+                sim_func = bm25_sim
+            elif self.sim_type == "asymmetric_cosine":
+                sim_func = asymmetric_cosine_sim
             else:
                 raise ValueError("sim_type must be one of "
-                                 "('cosine', 'pearson', 'jaccard')")
+                                 "('cosine', 'pearson', 'jaccard', "
+                                 "'adjusted_cosine', 'tfidf', 'bm25', "
+                                 "'asymmetric_cosine')")
 
             self.sim_matrix = sim_func(
                 self.user_interaction, self.item_interaction, self.n_users,
-                self.n_items, block_size, num_threads, min_common, mode)
+                self.n_items, block_size, num_threads, min_common, mode,
+                topk=self.k, lsh_params=lsh_params,
+                **(sim_params or {}))
 
-        assert self.sim_matrix.has_sorted_indices
+        # only the top k positive neighbors are used in prediction
+        self.topk_sim = top_k_sim(self.sim_matrix, self.k)
+        self._interacted = None
         if issparse(self.sim_matrix):
             n_elements = self.sim_matrix.getnnz()
             sparsity_ratio = 100*n_elements / (self.n_users*self.n_users)
@@ -79,53 +98,28 @@ class UserCF(Base, EvalMixin):
         unknown_num, unknown_index, user, item = self._check_unknown(
             user, item)
 
-        preds = []
-        sim_matrix = self.sim_matrix
-        interaction = self.item_interaction
-        for u, i in zip(user, item):
-            user_slice = slice(sim_matrix.indptr[u], sim_matrix.indptr[u+1])
-            sim_users = sim_matrix.indices[user_slice]
-            sim_values = sim_matrix.data[user_slice]
-
-            item_slice = slice(interaction.indptr[i], interaction.indptr[i+1])
-            item_interacted_u = interaction.indices[item_slice]
-            item_interacted_values = interaction.data[item_slice]
-            common_users, indices_in_u, indices_in_i = np.intersect1d(
-                sim_users, item_interacted_u,
-                assume_unique=True, return_indices=True)
-
-            common_sims = sim_values[indices_in_u]
-            common_labels = item_interacted_values[indices_in_i]
-            if common_users.size == 0 or np.all(common_sims <= 0.0):
-                self.print_count += 1
-                no_str = (f"No common interaction or similar neighbor "
-                          f"for user {u} and item {i}, "
-                          f"proceed with default prediction")
-                if self.print_count < 13:
-                    print(f"{colorize(no_str, 'red')}")
-                preds.append(self.default_prediction)
-            else:
-                k_neighbor_labels, k_neighbor_sims = zip(*islice(
-                    takewhile(lambda x: x[1] > 0,
-                              sorted(zip(common_labels, common_sims),
-                                     key=itemgetter(1),
-                                     reverse=True)
-                              ),
-                    self.k))
-
-                if self.task == "rating":
-                    sims_distribution = (
-                            k_neighbor_sims / np.sum(k_neighbor_sims)
-                    )
-                    weighted_pred = np.average(
-                        k_neighbor_labels, weights=sims_distribution
-                    )
-                    preds.append(
-                        np.clip(weighted_pred, self.lower_bound,
-                                self.upper_bound)
-                    )
-                elif self.task == "ranking":
-                    preds.append(np.mean(k_neighbor_sims))
+        # neighbors of user among the users item interacted with
+        weighted_sums, sim_sums, counts = common_neighbor_sums(
+            self.topk_sim, user, self.item_interaction, item)
+        no_neighbor = counts == 0
+        n_print = max(0, 12 - self.print_count)
+        self.print_count += np.count_nonzero(no_neighbor)
+        for u, i in zip(user[no_neighbor][:n_print],
+                        item[no_neighbor][:n_print]):
+            no_str = (f"No common interaction or similar neighbor "
+                      f"for user {u} and item {i}, "
+                      f"proceed with default prediction")
+            print(f"{colorize(no_str, 'red')}")
+
+        has_neighbor = ~no_neighbor
+        preds = np.full(len(user), self.default_prediction, dtype=np.float64)
+        if self.task == "rating":
+            preds[has_neighbor] = np.clip(
+                weighted_sums[has_neighbor] / sim_sums[has_neighbor],
+                self.lower_bound, self.upper_bound)
+        elif self.task == "ranking":
+            preds[has_neighbor] = (sim_sums[has_neighbor]
+                                   / counts[has_neighbor])
 
         if unknown_num > 0:
             preds[unknown_index] = self.default_prediction
@@ -134,15 +128,14 @@ class UserCF(Base, EvalMixin):
 
     def recommend_user(self, user, n_rec, random_rec=False):
         user = self._check_unknown_user(user)
-        if not user:
+        if user is None:
             return   # popular ?
 
-        user_slice = slice(self.sim_matrix.indptr[user],
-                           self.sim_matrix.indptr[user+1])
-        sim_users = self.sim_matrix.indices[user_slice]
-        sim_values = self.sim_matrix.data[user_slice]
-        # TODO: return popular items
-        if sim_users.size == 0 or np.all(sim_values <= 0):
+        n_candidates = self.n_items if random_rec else n_rec
+        items, scores = self._recommend_block(
+            np.array([user]), n_candidates, filter_consumed=True)
+        valid = items[0] >= 0
+        if not np.any(valid):
             self.print_count += 1
             no_str = (f"no similar neighbor for user {user}, "
                       f"return default recommendation")
@@ -150,29 +143,7 @@ class UserCF(Base, EvalMixin):
                 print(f"{colorize(no_str, 'red')}")
             return -1
 
-        k_nbs_and_sims = islice(
-            sorted(zip(sim_users, sim_values),
-                   key=itemgetter(1), reverse=True),
-            self.k)
-        u_consumed = set(self.user_consumed[user])
-
-        all_item_indices = self.user_interaction.indices
-        all_item_indptr = self.user_interaction.indptr
-        all_item_values = self.user_interaction.data
-
-        result = defaultdict(lambda: [0.0, 0])  # [sim, count]
-        for n, n_sim in k_nbs_and_sims:
-            item_slices = slice(all_item_indptr[n], all_item_indptr[n+1])
-            n_interacted_items = all_item_indices[item_slices]
-            n_interacted_values = all_item_values[item_slices]
-            for i, v in zip(n_interacted_items, n_interacted_values):
-                if i in u_consumed:
-                    continue
-                result[i][0] += n_sim * v
-                result[i][1] += n_sim
-
-        rank_items = [(k, round(v[0] / v[1], 4)) for k, v in result.items()]
-        rank_items.sort(key=lambda x: -x[1])
+        rank_items = list(zip(items[0][valid], scores[0][valid]))
         if random_rec:
             if len(rank_items) < n_rec:
                 item_candidates = rank_items
@@ -182,10 +153,25 @@ class UserCF(Base, EvalMixin):
         else:
             return rank_items[:n_rec]
 
+    def _score_users_sparse(self, users):
+        # average label of top k neighbor users, weighted by similarities
+        sims = self.topk_sim[users]
+        weighted_sums = (sims @ self.user_interaction).tocsr()
+        if self._interacted is None:
+            self._interacted = self.user_interaction.copy()
+            self._interacted.data = np.ones_like(self._interacted.data)
+        sim_sums = (sims @ self._interacted).tocsr()
+        sim_sums.data = 1.0 / sim_sums.data
+        return weighted_sums.multiply(sim_sums).tocsr()
+
+    def _output_scores(self, scores):
+        return scores
+
     def _caution_sim_type(self):
         caution_str = (f"Warning: {self.sim_type} is not suitable "
                        f"for implicit data")
-        if self.task == "ranking" and self.sim_type == "pearson":
+        if (self.task == "ranking"
+                and self.sim_type in ("pearson", "adjusted_cosine")):
             print(f"{colorize(caution_str, 'red')}")
         if self.task == "rating" and self.sim_type == "jaccard":
             print(f"{colorize(caution_str, 'red')}")
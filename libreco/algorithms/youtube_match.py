@@ -7,7 +7,6 @@ author: massquantity
 
 """
 import time
-from itertools import islice
 import numpy as np
 import tensorflow as tf
 from tensorflow.python.keras.initializers import (
@@ -24,6 +23,7 @@ from ..utils.tf_ops import (
 )
 from ..data.data_generator import DataGenSequence
 from ..data.sequence import sparse_user_last_interacted
+from ..data.growable import grow_rows
 from ..utils.misc import time_block, colorize
 
 
@@ -228,12 +228,14 @@ class YouTubeMatch(Base, TfMixin, EvalMixin):
 
         self._build_model()
         self._build_train_ops(global_steps)
+        self._restore_variables()
 
         data_generator = DataGenSequence(
             train_data, self.sparse, self.dense,
             mode=self.interaction_mode, num=self.interaction_num,
             class_name="YoutubeMatch", padding_idx=self.n_items
         )
+        data_generator = self._prefetch_data(data_generator, **kwargs)
         for epoch in range(1, self.n_epochs + 1):
             with time_block(f"Epoch {epoch}", verbose):
                 train_total_loss = []
@@ -257,14 +259,40 @@ class YouTubeMatch(Base, TfMixin, EvalMixin):
                     round(np.mean(train_total_loss), 4)
                 )
                 print(f"\t {colorize(train_loss_str, 'green')}")
+                self._print_wait_time(data_generator)
                 # for evaluation
                 self._set_latent_vectors()
                 self.print_metrics(eval_data=eval_data, metrics=metrics)
                 print("="*30)
 
+        data_generator.close()
         # for prediction and recommendation
         self._set_latent_vectors()
 
+    def extend(self, data_info, train_data=None):
+        """Grow item embeddings and user vectors after the data has been
+        extended by `Dataset.extend_trainset`.
+
+        Trained variables are kept, and the graph will be rebuilt with
+        larger variables in the next `fit`, which restores them. Until then,
+        new users and items have zero vectors.
+
+        Parameters
+        ----------
+        data_info : `DataInfo` object
+            Extended data info.
+        train_data : `TransformedSet` object, optional
+            Extended train data, whose consumed items are used in
+            recommendation.
+        """
+        n_new_users, n_new_items = self._extend_data_info(data_info,
+                                                          train_data)
+        if hasattr(self, "nce_weights"):
+            self._reset_graph()
+        if self.user_vector is not None:
+            self.user_vector = grow_rows(self.user_vector, n_new_users)
+            self.item_weights = grow_rows(self.item_weights, n_new_items)
+
     def predict(self, user, item):
         user = np.asarray(
             [user]) if isinstance(user, int) else np.asarray(user)
@@ -285,23 +313,8 @@ class YouTubeMatch(Base, TfMixin, EvalMixin):
 
         return preds[0] if len(user) == 1 else preds
 
-    def recommend_user(self, user, n_rec, **kwargs):
-        user = self._check_unknown_user(user)
-        if not user:
-            return   # popular ?
-
-        consumed = self.user_consumed[user]
-        count = n_rec + len(consumed)
-        recos = self.user_vector[user] @ self.item_weights.T
-        recos = 1 / (1 + np.exp(-recos))
-
-        ids = np.argpartition(recos, -count)[-count:]
-        rank = sorted(zip(ids, recos[ids]), key=lambda x: -x[1])
-        return list(
-            islice(
-                (rec for rec in rank if rec[0] not in consumed), n_rec
-            )
-        )
+    def _dot_factors(self, users):
+        return self.user_vector[users], self.item_weights, None, None
 
     def _set_latent_vectors(self):
         user_indices = np.arange(self.n_users)
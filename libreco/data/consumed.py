@@ -0,0 +1,206 @@
+from collections.abc import Mapping
+import numpy as np
+
+
+class ConsumedIndex(Mapping):
+    """CSR-style index of consumed items for every user (or consumed users
+    for every item).
+
+    Consumed values of row `r` are stored in
+    `indices[indptr[r]: indptr[r + 1]]` in their original (insertion/time)
+    order, so the whole index is just two flat arrays. It can be used the
+    same way as a dict, i.e. `user_consumed[u]` returns the consumed items of
+    user `u` (an empty array for unknown users), and `contains` does
+    vectorized membership check for a batch of (row, value) pairs.
+
+    Parameters
+    ----------
+    rows : array_like
+        Row index of every interaction, e.g. user indices.
+    cols : array_like
+        Consumed value of every interaction, e.g. item indices.
+    n_rows : int, optional
+        Number of rows, default is `max(rows) + 1`.
+    """
+
+    def __init__(self, rows, cols, n_rows=None):
+        rows = np.asarray(rows)
+        cols = np.asarray(cols)
+        if n_rows is None:
+            n_rows = int(rows.max()) + 1 if len(rows) > 0 else 0
+        # stable sort to keep the original order within each row
+        order = np.argsort(rows, kind="stable")
+        self.indices = cols[order]
+        self.indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=self.indptr[1:])
+        self.n_rows = n_rows
+        self.n_cols = int(cols.max()) + 1 if len(cols) > 0 else 0
+        self._keys = None
+        self._sorted_pairs = None
+        self._sorted_indices = None
+        self._distinct_lengths = None
+
+    @classmethod
+    def from_arrays(cls, indices, indptr, n_cols):
+        """Construct from existing CSR `indices` and `indptr` arrays
+        without copying, e.g. memory-mapped ones."""
+        consumed = cls.__new__(cls)
+        consumed.indices = indices
+        consumed.indptr = indptr
+        consumed.n_rows = len(indptr) - 1
+        consumed.n_cols = n_cols
+        consumed._keys = None
+        consumed._sorted_pairs = None
+        consumed._sorted_indices = None
+        consumed._distinct_lengths = None
+        return consumed
+
+    def append(self, rows, cols, n_rows=None):
+        """Return a new index with interactions `(rows, cols)` appended
+        after the existing ones of every row.
+
+        Existing rows are moved as contiguous blocks, so merging takes
+        O(nnz) time instead of re-sorting all the interactions.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols)
+        if n_rows is None:
+            n_rows = max(self.n_rows,
+                         int(rows.max()) + 1 if len(rows) > 0 else 0)
+        old_lengths = np.zeros(n_rows, dtype=np.int64)
+        old_lengths[:self.n_rows] = self.row_lengths
+        new_lengths = np.bincount(rows, minlength=n_rows)
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(old_lengths + new_lengths, out=indptr[1:])
+
+        indices = np.empty(indptr[-1], dtype=np.result_type(self.indices,
+                                                            cols))
+        # existing values stay at the front of every row
+        old_rows = np.repeat(np.arange(self.n_rows), self.row_lengths)
+        old_positions = (np.arange(len(self.indices))
+                         - self.indptr[old_rows] + indptr[old_rows])
+        indices[old_positions] = self.indices
+        # new values follow in their original order
+        order = np.argsort(rows, kind="stable")
+        sorted_rows = rows[order]
+        new_starts = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(new_lengths, out=new_starts[1:])
+        rank = np.arange(len(rows)) - new_starts[sorted_rows]
+        indices[indptr[sorted_rows] + old_lengths[sorted_rows] + rank] = (
+            cols[order])
+
+        n_cols = max(self.n_cols, int(cols.max()) + 1 if len(cols) > 0 else 0)
+        return ConsumedIndex.from_arrays(indices, indptr, n_cols)
+
+    def gather(self, rows):
+        """Consumed values of a batch of rows as flat arrays, which can
+        index a (len(rows), n_cols) matrix directly, e.g.
+        `scores[positions, values] = -np.inf`.
+
+        Returns
+        -------
+        positions : numpy.ndarray
+            Position in `rows` of every consumed value.
+        values : numpy.ndarray
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        known = (rows >= 0) & (rows < self.n_rows)
+        if not np.any(known):
+            return np.zeros(0, dtype=np.int64), self.indices[:0]
+        safe_rows = np.where(known, rows, 0)
+        starts = self.indptr[safe_rows]
+        lengths = np.where(known, self.indptr[safe_rows + 1] - starts, 0)
+        positions = np.repeat(np.arange(len(rows)), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        flat = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+        return positions, self.indices[flat]
+
+    def __getitem__(self, row):
+        if 0 <= row < self.n_rows:
+            return self.indices[self.indptr[row]: self.indptr[row + 1]]
+        return self.indices[:0]
+
+    def __iter__(self):
+        return iter(self.keys_array.tolist())
+
+    def __len__(self):
+        return len(self.keys_array)
+
+    def __contains__(self, row):
+        return (0 <= row < self.n_rows
+                and self.indptr[row + 1] > self.indptr[row])
+
+    @property
+    def keys_array(self):
+        """Rows that have at least one consumed value."""
+        if self._keys is None:
+            self._keys = np.flatnonzero(np.diff(self.indptr))
+        return self._keys
+
+    @property
+    def row_lengths(self):
+        return np.diff(self.indptr)
+
+    @property
+    def distinct_lengths(self):
+        """Number of distinct consumed values of every row, which is less
+        than `row_lengths` if a row has repeated values."""
+        if self._distinct_lengths is None:
+            self._distinct_lengths = np.bincount(
+                self._distinct_pair_keys() // max(self.n_cols, 1),
+                minlength=self.n_rows)
+        return self._distinct_lengths
+
+    @property
+    def sorted_indices(self):
+        """Same as `indices`, but sorted in ascending order within each row,
+        which is required by binary search. It is always int64, the dtype
+        of the cython sampler, so batches don't copy the whole index."""
+        if self._sorted_indices is None:
+            self._sorted_indices = self._pair_keys() % max(self.n_cols, 1)
+        return self._sorted_indices
+
+    def _pair_keys(self):
+        # (row, col) pair encoded as a single int64 key, sorted globally
+        if self._sorted_pairs is None:
+            row_ids = np.repeat(np.arange(self.n_rows, dtype=np.int64),
+                                self.row_lengths)
+            keys = row_ids * self.n_cols + self.indices
+            keys.sort()
+            self._sorted_pairs = keys
+        return self._sorted_pairs
+
+    def _distinct_pair_keys(self):
+        keys = self._pair_keys()
+        if len(keys) > 1:
+            keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        return keys
+
+    def row_sums(self, values):
+        """Sum of `values[col]` over distinct consumed cols of every row."""
+        rows, cols = np.divmod(self._distinct_pair_keys(),
+                               max(self.n_cols, 1))
+        return np.bincount(rows, weights=np.asarray(values)[cols],
+                           minlength=self.n_rows)
+
+    def contains(self, rows, cols):
+        """Vectorized check of whether `cols[k]` is consumed by `rows[k]`.
+
+        Returns
+        -------
+        mask : numpy.ndarray of bool
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        mask = np.zeros(len(rows), dtype=bool)
+        if len(self.indices) == 0 or len(rows) == 0:
+            return mask
+
+        valid = ((rows >= 0) & (rows < self.n_rows)
+                 & (cols >= 0) & (cols < self.n_cols))
+        pair_keys = self._pair_keys()
+        query_keys = rows[valid] * self.n_cols + cols[valid]
+        positions = np.searchsorted(pair_keys, query_keys)
+        positions = np.minimum(positions, len(pair_keys) - 1)
+        mask[valid] = pair_keys[positions] == query_keys
+        return mask
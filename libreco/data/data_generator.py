@@ -1,34 +1,47 @@
 import numpy as np
 from .sequence import sparse_user_interacted, user_interacted_seq
+from ..utils.sampling import shuffle_indices
+
+MAX_SEED = 2 ** 31 - 1
 
 
 class DataGenPure(object):
-    def __init__(self, data):
+    def __init__(self, data, shuffle_block_size=None):
         self.data_size = len(data)
+        self.shuffle_block_size = shuffle_block_size
+        self.batch_order = None
         self.user_indices = data.user_indices
         self.item_indices = data.item_indices
         self.labels = data.labels
 
-    def __iter__(self, batch_size):
-        for i in range(0, self.data_size, batch_size):
-            batch_slice = slice(i, i + batch_size)
-            yield (
-                self.user_indices[batch_slice],
-                self.item_indices[batch_slice],
-                self.labels[batch_slice]
-            )
+    def make_batch(self, batch_slice):
+        batch_index = self._batch_index(batch_slice)
+        return (
+            self.user_indices[batch_index],
+            self.item_indices[batch_index],
+            self.labels[batch_index]
+        )
+
+    def _batch_index(self, batch_slice):
+        # gather rows through the shuffled order instead of copying data
+        if self.batch_order is None:
+            return batch_slice
+        return self.batch_order[batch_slice]
+
+    def batch_tasks(self, shuffle=True, batch_size=None):
+        self.batch_order = shuffle_indices(
+            self.data_size, self.shuffle_block_size) if shuffle else None
+        return [(slice(i, i + batch_size),)
+                for i in range(0, self.data_size, batch_size)]
 
     def __call__(self, shuffle=True, batch_size=None):
-        if shuffle:
-            mask = np.random.permutation(range(self.data_size))
-            self.user_indices = self.user_indices[mask]
-            self.item_indices = self.item_indices[mask]
-            self.labels = self.labels[mask]
-        return self.__iter__(batch_size)
+        tasks = self.batch_tasks(shuffle, batch_size)
+        return (self.make_batch(*task) for task in tasks)
 
 
 class DataGenFeat(object):
-    def __init__(self, data, sparse, dense, class_name=None):
+    def __init__(self, data, sparse, dense, class_name=None,
+                 shuffle_block_size=None):
         self.user_indices = data.user_indices
         self.item_indices = data.item_indices
         self.labels = data.labels
@@ -38,55 +51,58 @@ class DataGenFeat(object):
         self.dense = dense
         self.data_size = len(data)
         self.class_name = class_name
-
-    def __iter__(self, batch_size):
-        for i in range(0, self.data_size, batch_size):
-            batch_slice = slice(i, i + batch_size)
-            res = (
-                self.user_indices[batch_slice],
-                self.item_indices[batch_slice],
-                self.labels[batch_slice]
+        self.shuffle_block_size = shuffle_block_size
+        self.batch_order = None
+
+    def make_batch(self, batch_slice):
+        batch_index = self._batch_index(batch_slice)
+        res = (
+            self.user_indices[batch_index],
+            self.item_indices[batch_index],
+            self.labels[batch_index]
+        )
+        if self.sparse and self.dense:
+            res_other = (
+                self.sparse_indices[batch_index],
+                self.dense_values[batch_index]
             )
-            if self.sparse and self.dense:
-                res_other = (
-                    self.sparse_indices[batch_slice],
-                    self.dense_values[batch_slice]
-                )
-            elif self.sparse:
-                res_other =  (
-                    self.sparse_indices[batch_slice],
-                    None,
-                    None
-                )
-            elif self.dense:
-                res_other = (
-                    None,
-                    self.dense_values[batch_slice]
-                )
-            else:
-                res_other = (
-                    None,
-                    None
-                )
-            yield res + res_other
+        elif self.sparse:
+            res_other = (
+                self.sparse_indices[batch_index],
+                None
+            )
+        elif self.dense:
+            res_other = (
+                None,
+                self.dense_values[batch_index]
+            )
+        else:
+            res_other = (
+                None,
+                None
+            )
+        return res + res_other
 
-    def __call__(self, shuffle=True, batch_size=None):
-        if shuffle:
-            mask = np.random.permutation(range(self.data_size))
-            if self.sparse:
-                self.sparse_indices = self.sparse_indices[mask]
-            if self.dense:
-                self.dense_values = self.dense_values[mask]
-            self.user_indices = self.user_indices[mask]
-            self.item_indices = self.item_indices[mask]
-            self.labels = self.labels[mask]
+    def _batch_index(self, batch_slice):
+        # gather rows through the shuffled order instead of copying data
+        if self.batch_order is None:
+            return batch_slice
+        return self.batch_order[batch_slice]
+
+    def batch_tasks(self, shuffle=True, batch_size=None):
+        self.batch_order = shuffle_indices(
+            self.data_size, self.shuffle_block_size) if shuffle else None
+        return [(slice(i, i + batch_size),)
+                for i in range(0, self.data_size, batch_size)]
 
-        return self.__iter__(batch_size)
+    def __call__(self, shuffle=True, batch_size=None):
+        tasks = self.batch_tasks(shuffle, batch_size)
+        return (self.make_batch(*task) for task in tasks)
 
 
 class DataGenSequence(object):
     def __init__(self, data, sparse, dense, mode=None, num=None,
-                 class_name=None, padding_idx=None):
+                 class_name=None, padding_idx=None, shuffle_block_size=None):
         self.user_consumed = data.user_consumed
         self.padding_idx = padding_idx
         self.class_name = class_name
@@ -102,87 +118,93 @@ class DataGenSequence(object):
             self.labels = data.labels
             self.sparse_indices = data.sparse_indices
             self.dense_values = data.dense_values
-            self.user_consumed_set = {
-                u: set(items) for u, items in self.user_consumed.items()
-            }
         self.data_size = len(self.user_indices)
         self.sparse = sparse
         self.dense = dense
         self.mode = mode
         self.num = num
+        self.shuffle_block_size = shuffle_block_size
+        self.batch_order = None
+
+    def make_batch(self, batch_slice, seed):
+        batch_index = self._batch_index(batch_slice)
+        # each batch owns a random state, so batches can be built
+        # concurrently and still be reproducible
+        random_state = np.random.RandomState(seed)
+        batch_users = self.user_indices[batch_index]
+        batch_items = self.item_indices[batch_index]
+        if self.class_name == "YoutubeMatch":
+            (interacted_indices,
+             interacted_values,
+             modified_batch_size) = sparse_user_interacted(
+                batch_users,
+                batch_items,
+                self.user_consumed,
+                self.mode,
+                self.num,
+                random_state
+            )
+            res = (
+                modified_batch_size,
+                interacted_indices,
+                interacted_values,
+                batch_users,
+                batch_items,
+                self.labels[batch_index]
+            )
+        else:
+            (batch_interacted,
+             batch_interacted_len) = user_interacted_seq(
+                batch_users,
+                batch_items,
+                self.user_consumed,
+                self.padding_idx,
+                self.mode,
+                self.num,
+                random_state
+            )
+            res = (
+                batch_interacted,
+                batch_interacted_len,
+                batch_users,
+                batch_items,
+                self.labels[batch_index]
+            )
 
-    def __iter__(self, batch_size):
-        for i in range(0, self.data_size, batch_size):
-            batch_slice = slice(i, i + batch_size)
-            if self.class_name == "YoutubeMatch":
-                (interacted_indices,
-                 interacted_values,
-                 modified_batch_size) = sparse_user_interacted(
-                    self.user_indices[batch_slice],
-                    self.item_indices[batch_slice],
-                    self.user_consumed,
-                    self.mode,
-                    self.num
-                )
-                res = (
-                    modified_batch_size,
-                    interacted_indices,
-                    interacted_values,
-                    self.user_indices[batch_slice],
-                    self.item_indices[batch_slice],
-                    self.labels[batch_slice]
-                )
-            else:
-                (batch_interacted,
-                 batch_interacted_len) = user_interacted_seq(
-                    self.user_indices[batch_slice],
-                    self.item_indices[batch_slice],
-                    self.user_consumed,
-                    self.padding_idx,
-                    self.mode,
-                    self.num,
-                    self.user_consumed_set
-                )
-                res = (
-                    batch_interacted,
-                    batch_interacted_len,
-                    self.user_indices[batch_slice],
-                    self.item_indices[batch_slice],
-                    self.labels[batch_slice]
-                )
-
-            if self.sparse and self.dense:
-                res_other = (
-                    self.sparse_indices[batch_slice],
-                    self.dense_values[batch_slice]
-                )
-            elif self.sparse:
-                res_other = (
-                    self.sparse_indices[batch_slice],
-                    None
-                )
-            elif self.dense:
-                res_other = (
-                    None,
-                    self.dense_values[batch_slice]
-                )
-            else:
-                res_other = (
-                    None,
-                    None
-                )
-            yield res + res_other
+        if self.sparse and self.dense:
+            res_other = (
+                self.sparse_indices[batch_index],
+                self.dense_values[batch_index]
+            )
+        elif self.sparse:
+            res_other = (
+                self.sparse_indices[batch_index],
+                None
+            )
+        elif self.dense:
+            res_other = (
+                None,
+                self.dense_values[batch_index]
+            )
+        else:
+            res_other = (
+                None,
+                None
+            )
+        return res + res_other
 
-    def __call__(self, shuffle=True, batch_size=None):
-        if shuffle:
-            mask = np.random.permutation(range(self.data_size))
-            if self.sparse:
-                self.sparse_indices = self.sparse_indices[mask]
-            if self.dense:
-                self.dense_values = self.dense_values[mask]
-            self.user_indices = self.user_indices[mask]
-            self.item_indices = self.item_indices[mask]
-            self.labels = self.labels[mask]
-
-        return self.__iter__(batch_size)
+    def _batch_index(self, batch_slice):
+        # gather rows through the shuffled order instead of copying data
+        if self.batch_order is None:
+            return batch_slice
+        return self.batch_order[batch_slice]
+
+    def batch_tasks(self, shuffle=True, batch_size=None):
+        self.batch_order = shuffle_indices(
+            self.data_size, self.shuffle_block_size) if shuffle else None
+        return [(slice(i, i + batch_size), np.random.randint(MAX_SEED))
+                for i in range(0, self.data_size, batch_size)]
 
+    def __call__(self, shuffle=True, batch_size=None):
+        tasks = self.batch_tasks(shuffle, batch_size)
+        return (self.make_batch(*task) for task in tasks)
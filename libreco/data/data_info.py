@@ -1,33 +1,107 @@
-from collections import namedtuple
+from collections import defaultdict, namedtuple, OrderedDict
 import numpy as np
+import pandas as pd
+from .encoder import FeatureEncoder
+from .growable import append_rows
+from .storage import save_arrays, load_arrays, load_metadata
 
 
 Feature = namedtuple("Feature", ["name", "index"])
 Empty_Feature = Feature(name=[], index=[])
 
+_METADATA_NAME = "data_info.json"
+_UNIQUE_NAMES = ["user_sparse_unique", "user_dense_unique",
+                 "item_sparse_unique", "item_dense_unique",
+                 "user_unique_vals", "item_unique_vals"]
 
-class DataInfo(namedtuple("DataInfo",
-                          ["col_name_mapping", "interaction_data",
-                           "user_sparse_unique", "user_dense_unique",
-                           "item_sparse_unique", "item_dense_unique"])):
-    __slots__ = ()
 
-    def __new__(cls, col_name_mapping=None, interaction_data=None,
-                user_sparse_unique=None, user_dense_unique=None,
-                item_sparse_unique=None, item_dense_unique=None):
-        return super(DataInfo, cls).__new__(
-            cls, col_name_mapping, interaction_data, user_sparse_unique,
-            user_dense_unique, item_sparse_unique, item_dense_unique
-        )
+class DataInfo(object):
+    """Object that contains useful information for training and predicting.
+
+    All the statistics derived from `interaction_data`, i.e. unique users
+    and items, `global_mean` and `min_max_rating`, are computed once at
+    construction time. Unique users and items are kept as sorted arrays, so
+    id -> index mapping can be done with vectorized lookups of `encoder`,
+    and the dict views (`user2id`, `item2id`, ...) are only built when
+    they are first accessed.
+
+    `encoder` owns vocabularies of users, items and sparse features, and is
+    used to encode test data with `build_testset(..., data_info=data_info)`.
+
+    Interactions are kept as growable `user`, `item` and `label` arrays, and
+    `interaction_data` is only assembled as a DataFrame when it is accessed.
+    It can be passed as a DataFrame or a mapping of these arrays, e.g.
+    memory-mapped ones, which are used without copying. With
+    `interaction_encoded=True`, `user` and `item` arrays of the mapping
+    are inner indices of `encoder`, which are only decoded into original
+    ids when `interaction_data` is accessed.
+    """
+
+    def __init__(self, col_name_mapping=None, interaction_data=None,
+                 user_sparse_unique=None, user_dense_unique=None,
+                 item_sparse_unique=None, item_dense_unique=None,
+                 user_unique_vals=None, item_unique_vals=None,
+                 encoder=None, interaction_encoded=False):
+        self.col_name_mapping = col_name_mapping
+        self._interaction_encoded = interaction_encoded
+        self.interaction_data = interaction_data
+        self.user_sparse_unique = user_sparse_unique
+        self.user_dense_unique = user_dense_unique
+        self.item_sparse_unique = item_sparse_unique
+        self.item_dense_unique = item_dense_unique
+
+        if encoder is not None:
+            user_unique_vals = encoder.user_unique_vals
+            item_unique_vals = encoder.item_unique_vals
+        if user_unique_vals is None:
+            user_unique_vals = np.unique(interaction_data["user"])
+        if item_unique_vals is None:
+            item_unique_vals = np.unique(interaction_data["item"])
+        if encoder is None:
+            encoder = FeatureEncoder(user_unique_vals, item_unique_vals)
+        self.encoder = encoder
+
+        labels = interaction_data["label"]
+        self.global_mean = labels.mean()
+        self.min_max_rating = (labels.min(), labels.max())
+
+        # dict views, lazily constructed
+        self._user2id = None
+        self._item2id = None
+        self._id2user = None
+        self._id2item = None
 
     @property
-    def global_mean(self):
-        return self.interaction_data.label.mean()
+    def interaction_data(self):
+        if self._interaction_data is None:
+            columns = dict(self._interaction_columns)
+            if self._interaction_encoded:
+                # categorical columns don't repeat original ids of every
+                # interaction
+                columns["user"] = pd.Categorical.from_codes(
+                    columns["user"], self.encoder.user_unique_vals)
+                columns["item"] = pd.Categorical.from_codes(
+                    columns["item"], self.encoder.item_unique_vals)
+            self._interaction_data = pd.DataFrame(columns)
+        return self._interaction_data
+
+    @interaction_data.setter
+    def interaction_data(self, data):
+        if isinstance(data, pd.DataFrame):
+            self._interaction_data = data
+            self._interaction_encoded = False
+            self._interaction_columns = {
+                col: data[col].to_numpy() for col in ("user", "item", "label")
+            }
+        else:
+            self._interaction_data = None
+            self._interaction_columns = {
+                col: data[col] for col in ("user", "item", "label")
+            }
 
     @property
-    def min_max_rating(self):
-        return (self.interaction_data.label.min(),
-                self.interaction_data.label.max())
+    def n_interactions(self):
+        return len(self._interaction_columns["label"])
 
     @property
     def sparse_col(self):
@@ -95,46 +169,232 @@ class DataInfo(namedtuple("DataInfo",
         return self.col_name_mapping["item_sparse_col"].keys().__or__(
             self.col_name_mapping["item_dense_col"].keys())
 
+    @property
+    def user_unique_vals(self):
+        return self.encoder.user_unique_vals
+
+    @property
+    def item_unique_vals(self):
+        return self.encoder.item_unique_vals
+
     @property
     def n_users(self):
-        return self.interaction_data.user.nunique()
+        return len(self.user_unique_vals)
 
     @property
     def n_items(self):
-        return self.interaction_data.item.nunique()
+        return len(self.item_unique_vals)
 
     @property
     def user2id(self):
-        unique = np.unique(self.interaction_data["user"])
-        u2id = dict(zip(unique, range(self.n_users)))
-        u2id[-1] = len(unique)   # -1 represent new user
-        return u2id
+        if self._user2id is None:
+            self._user2id = _build_value2id(self.user_unique_vals)
+        return self._user2id
 
     @property
     def item2id(self):
-        unique = np.unique(self.interaction_data["item"])
-        i2id = dict(zip(unique, range(self.n_items)))
-        i2id[-1] = len(unique)  # -1 represent new item
-        return i2id
+        if self._item2id is None:
+            self._item2id = _build_value2id(self.item_unique_vals)
+        return self._item2id
 
     @property
     def id2user(self):
-        return {j: user for user, j in self.user2id.items()}
+        if self._id2user is None:
+            self._id2user = {j: user for user, j in self.user2id.items()}
+        return self._id2user
 
     @property
     def id2item(self):
-        return {j: item for item, j in self.item2id.items()}
+        if self._id2item is None:
+            self._id2item = {j: item for item, j in self.item2id.items()}
+        return self._id2item
+
+    def get_user_indices(self, users):
+        """Map original user ids to inner indices, unknown users
+        will be mapped to `n_users`."""
+        return self.encoder.encode_users(users)
+
+    def get_item_indices(self, items):
+        """Map original item ids to inner indices, unknown items
+        will be mapped to `n_items`."""
+        return self.encoder.encode_items(items)
+
+    def extend(self, data):
+        """Add new interactions, which may contain new users and items.
+
+        New users and items are appended to the vocabularies, and rows of
+        their features are appended to the unique feature tables, so inner
+        indices of existing users and items don't change. All the arrays
+        grow with amortized doubling capacity. New values of sparse
+        features are treated as unknown values.
+
+        Parameters
+        ----------
+        data : `pandas.DataFrame`
+            Data must contain `user`, `item`, `label` columns and all the
+            feature columns.
+
+        Returns
+        -------
+        user_indices : numpy.ndarray
+        item_indices : numpy.ndarray
+        sparse_indices : numpy.ndarray or None
+            Encoded data, which can be appended to the train data with
+            `TransformedSet.extend`.
+        """
+        n_users, n_items = self.n_users, self.n_items
+        self.encoder.extend(data["user"].to_numpy(), data["item"].to_numpy())
+        sparse_col = (self.sparse_col.name if self.col_name_mapping
+                      else None)
+        user_indices, item_indices, sparse_indices, _ = (
+            self.encoder.transform(data, sparse_col))
+
+        dense_values = (data[self.dense_col.name].to_numpy()
+                        if self.col_name_mapping and self.dense_col.name
+                        else None)
+        self.user_sparse_unique, self.user_dense_unique = (
+            _extend_unique_feat(n_users, self.n_users, user_indices,
+                                self.user_sparse_unique,
+                                self.user_dense_unique,
+                                sparse_indices, dense_values,
+                                self.col_name_mapping, "user"))
+        self.item_sparse_unique, self.item_dense_unique = (
+            _extend_unique_feat(n_items, self.n_items, item_indices,
+                                self.item_sparse_unique,
+                                self.item_dense_unique,
+                                sparse_indices, dense_values,
+                                self.col_name_mapping, "item"))
+
+        labels = data["label"]
+        n_old, n_new = self.n_interactions, len(labels)
+        if n_new > 0:
+            self.global_mean = (self.global_mean * n_old + labels.sum()) / (
+                n_old + n_new)
+            self.min_max_rating = (min(self.min_max_rating[0], labels.min()),
+                                   max(self.min_max_rating[1], labels.max()))
+            new_columns = {col: data[col].to_numpy()
+                           for col in ("user", "item", "label")}
+            if self._interaction_encoded:
+                new_columns["user"] = user_indices
+                new_columns["item"] = item_indices
+            for col, values in new_columns.items():
+                self._interaction_columns[col] = _append_column(
+                    self._interaction_columns[col], values)
+            self._interaction_data = None
+
+        self._user2id = None
+        self._item2id = None
+        self._id2user = None
+        self._id2item = None
+        return user_indices, item_indices, sparse_indices
 
     def __repr__(self):
         n_users = self.n_users
         n_items = self.n_items
-        n_labels = len(self.interaction_data)
+        n_labels = self.n_interactions
         return "n_users: %d, n_items: %d, data sparsity: %.4f %%" % (
             n_users, n_items, 100 * n_labels / (n_users*n_items))
 
+    def save(self, path):
+        """Save to directory `path`, which can be loaded by `DataInfo.load`
+        with memory-mapping. Can share the same directory with a saved
+        `TransformedSet`."""
+        arrays = {name: getattr(self, name) for name in _UNIQUE_NAMES}
+        for col in ("user", "item", "label"):
+            arrays[f"interaction_{col}"] = self._interaction_columns[col]
+        # sparse vocabularies are named by position, since column names
+        # may not be valid file names
+        sparse_vocab_cols = list(self.encoder.sparse_unique_vals.keys())
+        for i, col in enumerate(sparse_vocab_cols):
+            arrays[f"sparse_vocab_{i}"] = self.encoder.sparse_unique_vals[col]
+        metadata = {"col_name_mapping": self.col_name_mapping,
+                    "sparse_vocab_cols": sparse_vocab_cols,
+                    "interaction_encoded": self._interaction_encoded}
+        save_arrays(path, arrays, metadata, _METADATA_NAME)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Load `DataInfo` saved by `DataInfo.save`.
+
+        Parameters
+        ----------
+        path : str
+            Directory of saved data.
+        mmap_mode : {None, "r", "r+", "c"}, optional
+            Memory-map mode passed to `numpy.load`.
+
+        Returns
+        -------
+        data_info : `DataInfo` object
+        """
+        metadata = load_metadata(path, _METADATA_NAME)
+        arrays = load_arrays(path, metadata["arrays"], mmap_mode)
+        sparse_vocab_cols = metadata.get("sparse_vocab_cols", [])
+        col_name_mapping = metadata["col_name_mapping"]
+        if col_name_mapping is not None:
+            col_name_mapping = defaultdict(OrderedDict, {
+                family: OrderedDict(mapping)
+                for family, mapping in col_name_mapping.items()
+            })
+        # arrays stay memory-mapped, the DataFrame is built on access
+        interaction_data = {col: arrays[f"interaction_{col}"]
+                            for col in ("user", "item", "label")}
+        unique_arrays = {name: arrays.get(name) for name in _UNIQUE_NAMES}
+        encoder = FeatureEncoder(
+            unique_arrays.pop("user_unique_vals"),
+            unique_arrays.pop("item_unique_vals"),
+            {col: arrays[f"sparse_vocab_{i}"]
+             for i, col in enumerate(sparse_vocab_cols)}
+        )
+        return cls(col_name_mapping,
+                   interaction_data,
+                   encoder=encoder,
+                   interaction_encoded=metadata.get("interaction_encoded",
+                                                    False),
+                   **unique_arrays)
+
     def get_indexed_interaction(self):
+        if self._interaction_encoded:
+            return pd.DataFrame(self._interaction_columns)
         data = self.interaction_data.copy()
-        data.user = data.user.map(self.user2id)
-        data.item = data.item.map(self.item2id)
+        data["user"] = self.get_user_indices(data["user"].to_numpy())
+        data["item"] = self.get_item_indices(data["item"].to_numpy())
         return data
 
+
+def _build_value2id(unique_vals):
+    value2id = dict(zip(unique_vals.tolist(), range(len(unique_vals))))
+    value2id[-1] = len(unique_vals)   # -1 represent new user or item
+    return value2id
+
+
+def _append_column(column, values):
+    # values of another type, e.g. str ids after int ids, need a common
+    # dtype, which is the only case that copies the whole column
+    dtype = np.result_type(column.dtype, values.dtype)
+    if dtype != column.dtype:
+        column = column.astype(dtype)
+    return append_rows(column, values)
+
+
+def _extend_unique_feat(n_old, n_total, indices, sparse_unique, dense_unique,
+                        sparse_indices, dense_values, col_name_mapping,
+                        family):
+    # only features of new users or items are filled in,
+    # existing ones are kept unchanged
+    new_mask = indices >= n_old
+    new_rows = indices[new_mask] - n_old
+    n_new = n_total - n_old
+    if sparse_unique is not None:
+        sparse_col = list(col_name_mapping[f"{family}_sparse_col"].values())
+        new_sparse = np.zeros((n_new, len(sparse_col)),
+                              dtype=sparse_unique.dtype)
+        new_sparse[new_rows] = sparse_indices[new_mask][:, sparse_col]
+        sparse_unique = append_rows(sparse_unique, new_sparse)
+    if dense_unique is not None:
+        dense_col = list(col_name_mapping[f"{family}_dense_col"].values())
+        new_dense = np.zeros((n_new, len(dense_col)),
+                             dtype=dense_unique.dtype)
+        new_dense[new_rows] = dense_values[new_mask][:, dense_col]
+        dense_unique = append_rows(dense_unique, new_dense)
+    return sparse_unique, dense_unique
@@ -2,6 +2,8 @@ import numpy as np
 import pandas as pd
 from sklearn.preprocessing import OneHotEncoder, MultiLabelBinarizer
 from .data_info import DataInfo
+from .encoder import FeatureEncoder
+from .streaming import iter_chunks, allocate_array, scan_vocabs
 from .transformed import TransformedSet
 from ..utils.column_mapping import col_name2index
 from ..utils.unique_features import construct_unique_feat
@@ -15,9 +17,6 @@ class Dataset(object):
     Warning: This class should not be used directly. Use derived class instead.
     """
 
-    sparse_unique_vals = dict()
-    user_unique_vals = None
-    item_unique_vals = None
 #    dense_col = None
 #    sparse_col = None
 #    multi_sparse_col = None
@@ -50,65 +49,134 @@ class Dataset(object):
             raise NameError(
                 "Please use 'DatasetPure' or 'DatasetFeat' to call method")
 
-    @classmethod
-    def _set_sparse_unique_vals(cls, train_data, sparse_col):
-        if sparse_col is not None:
-            for col in sparse_col:
-                cls.sparse_unique_vals[col] = np.unique(train_data[col])
-        cls.user_unique_vals = np.unique(train_data["user"])
-        cls.item_unique_vals = np.unique(train_data["item"])
-
-    @classmethod
-    def _get_feature_offset(cls, sparse_col):
-        if cls.__name__.lower().endswith("pure"):
-            unique_values = [
-                len(cls.sparse_unique_vals[col]) for col in sparse_col
-            ]
-        elif cls.__name__.lower().endswith("feat"):
-            # plus one for value only in test data
-            unique_values = [
-                len(cls.sparse_unique_vals[col]) + 1 for col in sparse_col
-            ]
-        return np.cumsum(np.array([0] + unique_values))
-
     @staticmethod
-    def check_unknown(values, uniques):
-        diff = list(np.setdiff1d(values, uniques, assume_unique=True))
-        mask = np.in1d(values, uniques, invert=True)
-        return diff, mask
+    def _get_encoder(data_info):
+        # vocabularies only live in the `data_info` of train data
+        if data_info is None:
+            raise ValueError("`data_info` returned by `build_trainset` "
+                             "must be provided to build test data")
+        return data_info.encoder
 
     @classmethod
-    def _sparse_indices(cls, values, unique, mode="train"):
-        if mode == "test":
-            diff, not_in_mask = cls.check_unknown(values, unique)
-            col_indices = np.searchsorted(unique, values)
-            col_indices[not_in_mask] = len(unique)
-        elif mode == "train":
-            col_indices = np.searchsorted(unique, values)
-        else:
-            raise ValueError("mode must either be \"train\" or \"test\" ")
-        return col_indices
+    def _has_unknown_slot(cls):
+        # feat data reserves one more index for values only in test data
+        return cls.__name__.lower().endswith("feat")
 
     @classmethod
-    def _get_user_item_sparse_indices(cls, data, mode="train"):
-        user_indices = cls._sparse_indices(
-            data.user.to_numpy(), cls.user_unique_vals, mode)
-        item_indices = cls._sparse_indices(
-            data.item.to_numpy(), cls.item_unique_vals, mode)
-        return user_indices, item_indices
+    def _encode(cls, encoder, data, sparse_col=None, num_threads=1):
+        return encoder.transform(data, sparse_col, cls._has_unknown_slot(),
+                                 num_threads)
 
     @classmethod
-    def _get_sparse_indices_matrix(cls, data, sparse_col, mode="train"):
-        n_samples, n_features = len(data), len(sparse_col)
-        sparse_indices = np.zeros((n_samples, n_features), dtype=np.int32)
-        for i, col in enumerate(sparse_col):
-            col_values = data[col].to_numpy()
-            unique_values = cls.sparse_unique_vals[col]
-            sparse_indices[:, i] = cls._sparse_indices(
-                col_values, unique_values, mode)
-
-        feature_offset = cls._get_feature_offset(sparse_col)
-        return sparse_indices + feature_offset[:-1]
+    def _build_trainset_streaming(cls, path, user_col=None, item_col=None,
+                                  sparse_col=None, dense_col=None,
+                                  chunksize=1000000, file_format=None,
+                                  mmap_dir=None, **read_kwargs):
+        # first pass collects vocabularies, then second pass encodes every
+        # chunk into preallocated arrays, so only one chunk of original
+        # data is in memory at a time.
+        sparse_col = list(sparse_col) if sparse_col else []
+        dense_col = list(dense_col) if dense_col else []
+        columns = list(dict.fromkeys(
+            ["user", "item", "label"] + sparse_col + dense_col))
+
+        def chunks():
+            return iter_chunks(path, chunksize, columns, file_format,
+                               **read_kwargs)
+
+        vocab_cols = list(dict.fromkeys(["user", "item"] + sparse_col))
+        vocabs, n_rows = scan_vocabs(chunks(), vocab_cols)
+        encoder = FeatureEncoder(vocabs["user"], vocabs["item"],
+                                 {col: vocabs[col] for col in sparse_col})
+
+        col_name_mapping = col_name2index(
+            user_col, item_col, sparse_col, dense_col)
+        user_sparse_col = list(col_name_mapping["user_sparse_col"].values())
+        user_dense_col = list(col_name_mapping["user_dense_col"].values())
+        item_sparse_col = list(col_name_mapping["item_sparse_col"].values())
+        item_dense_col = list(col_name_mapping["item_dense_col"].values())
+        n_users = len(encoder.user_unique_vals)
+        n_items = len(encoder.item_unique_vals)
+
+        user_indices = allocate_array(
+            n_rows, np.int32, mmap_dir, "user_indices")
+        item_indices = allocate_array(
+            n_rows, np.int32, mmap_dir, "item_indices")
+        labels = allocate_array(n_rows, np.float32, mmap_dir, "labels")
+        sparse_indices, dense_values = None, None
+        user_sparse_unique, user_dense_unique = None, None
+        item_sparse_unique, item_dense_unique = None, None
+        if sparse_col:
+            sparse_indices = allocate_array(
+                (n_rows, len(sparse_col)), np.int32, mmap_dir,
+                "sparse_indices")
+            if user_sparse_col:
+                user_sparse_unique = np.zeros(
+                    (n_users, len(user_sparse_col)), dtype=np.int32)
+            if item_sparse_col:
+                item_sparse_unique = np.zeros(
+                    (n_items, len(item_sparse_col)), dtype=np.int32)
+        if dense_col:
+            dense_values = allocate_array(
+                (n_rows, len(dense_col)), np.float32, mmap_dir,
+                "dense_values")
+            if user_dense_col:
+                user_dense_unique = np.zeros(
+                    (n_users, len(user_dense_col)), dtype=np.float32)
+            if item_dense_col:
+                item_dense_unique = np.zeros(
+                    (n_items, len(item_dense_col)), dtype=np.float32)
+
+        start = 0
+        for chunk in chunks():
+            end = start + len(chunk)
+            chunk_users, chunk_items, chunk_sparse, _ = cls._encode(
+                encoder, chunk, sparse_col)
+            user_indices[start:end] = chunk_users
+            item_indices[start:end] = chunk_items
+            labels[start:end] = chunk["label"].to_numpy(dtype=np.float32)
+            if sparse_col:
+                sparse_indices[start:end] = chunk_sparse
+                # unique features of users and items are collected along
+                # the way, assuming they are consistent across rows
+                if user_sparse_col:
+                    user_sparse_unique[chunk_users] = (
+                        chunk_sparse[:, user_sparse_col])
+                if item_sparse_col:
+                    item_sparse_unique[chunk_items] = (
+                        chunk_sparse[:, item_sparse_col])
+            if dense_col:
+                chunk_dense = chunk[dense_col].to_numpy(dtype=np.float32)
+                dense_values[start:end] = chunk_dense
+                if user_dense_col:
+                    user_dense_unique[chunk_users] = (
+                        chunk_dense[:, user_dense_col])
+                if item_dense_col:
+                    item_dense_unique[chunk_items] = (
+                        chunk_dense[:, item_dense_col])
+            start = end
+
+        train_transformed = TransformedSet(user_indices,
+                                           item_indices,
+                                           labels,
+                                           sparse_indices,
+                                           dense_values,
+                                           train=True)
+        # interactions share the encoded arrays of train data, and original
+        # ids are only decoded when `interaction_data` is accessed
+        interaction_data = {"user": user_indices,
+                            "item": item_indices,
+                            "label": labels}
+        data_info = DataInfo(col_name_mapping if sparse_col or dense_col
+                             else None,
+                             interaction_data,
+                             user_sparse_unique,
+                             user_dense_unique,
+                             item_sparse_unique,
+                             item_dense_unique,
+                             encoder=encoder,
+                             interaction_encoded=True)
+        return train_transformed, data_info
 
     @classmethod
     def _get_dense_indices_matrix(cls, data, dense_col):
@@ -116,6 +184,52 @@ class Dataset(object):
         dense_indices = np.tile(np.arange(n_features), [n_samples, 1])
         return dense_indices
 
+    @classmethod
+    def extend_trainset(cls, trainset, data_info, new_data, shuffle=False,
+                        seed=42):
+        """Append new train data in place, without rebuilding the whole
+        train data.
+
+        New users and items get the next inner indices, so indices of
+        existing ones stay valid, and models can grow their embeddings
+        with `model.extend(data_info, trainset)`.
+
+        Parameters
+        ----------
+        trainset : `TransformedSet` object
+            Train data returned by `build_trainset`.
+        data_info : `DataInfo` object
+            Data info returned by `build_trainset`.
+        new_data : `pandas.DataFrame`
+            Data must contain `user`, `item`, `label` columns and the same
+            feature columns as the original train data.
+        shuffle : bool, optional
+            Whether to fully shuffle new data.
+        seed: int, optional
+            random seed.
+
+        Returns
+        -------
+        trainset : `TransformedSet` object
+            Same object as the argument, with new data appended.
+        data_info : `DataInfo` object
+            Same object as the argument, with new users and items.
+        """
+        cls._check_subclass()
+        cls._check_col_names(new_data, mode="train")
+        if shuffle:
+            new_data = new_data.sample(
+                frac=1, random_state=seed).reset_index(drop=True)
+
+        user_indices, item_indices, sparse_indices = data_info.extend(
+            new_data)
+        dense_values = (new_data[data_info.dense_col.name].to_numpy()
+                        if trainset.dense_values is not None else None)
+        labels = new_data["label"].to_numpy(dtype=np.float32)
+        trainset.extend(user_indices, item_indices, labels, sparse_indices,
+                        dense_values)
+        return trainset, data_info
+
 
 class DatasetPure(Dataset):
     """A derived class from :class:`Dataset`, used for pure
@@ -150,13 +264,12 @@ class DatasetPure(Dataset):
 
         cls._check_subclass()
         cls._check_col_names(train_data, mode="train")
-        cls._set_sparse_unique_vals(train_data, None)
+        encoder = FeatureEncoder.fit(train_data)
         if shuffle:
             train_data = train_data.sample(
                 frac=1, random_state=seed).reset_index(drop=True)
 
-        user_indices, item_indices = cls._get_user_item_sparse_indices(
-            train_data, mode="train")
+        user_indices, item_indices, _, _ = cls._encode(encoder, train_data)
         labels = train_data["label"].to_numpy(dtype=np.float32)
 
         interaction_data = train_data[["user", "item", "label"]]
@@ -164,11 +277,48 @@ class DatasetPure(Dataset):
                                            item_indices,
                                            labels,
                                            train=True)
-        data_info = DataInfo(interaction_data=interaction_data)
+        data_info = DataInfo(interaction_data=interaction_data,
+                             encoder=encoder)
         return train_transformed, data_info
 
     @classmethod
-    def build_testset(cls, test_data, shuffle=False, seed=42):
+    def build_trainset_from_file(cls, path, chunksize=1000000,
+                                 file_format=None, mmap_dir=None,
+                                 **read_kwargs):
+        """Build transformed pure train_data from CSV or Parquet files
+        chunk by chunk, without loading the whole data into memory.
+
+        Parameters
+        ----------
+        path : str or list of str
+            File path or list of file paths, which must contain
+            `user`, `item`, `label` columns.
+        chunksize : int, optional
+            Number of rows read at a time.
+        file_format : {"csv", "parquet"}, optional
+            Inferred from file extension if not provided.
+        mmap_dir : str, optional
+            If provided, arrays are written to memory-mapped `.npy` files
+            in this directory, and `trainset.save(mmap_dir)` will reuse them.
+        read_kwargs : dict
+            Other arguments passed to `pandas.read_csv`.
+
+        Returns
+        -------
+        trainset : `TransformedSet` object
+            Data object used for training.
+        data_info : `DataInfo` object
+            Object that contains some useful information
+            for training and predicting
+        """
+        cls._check_subclass()
+        return cls._build_trainset_streaming(
+            path, chunksize=chunksize, file_format=file_format,
+            mmap_dir=mmap_dir, **read_kwargs)
+
+    @classmethod
+    def build_testset(cls, test_data, shuffle=False, seed=42,
+                      data_info=None, num_threads=1):
         """Build transformed pure eval_data or test_data from original data.
 
         Normally, pure data only contains `user` and `item` columns,
@@ -182,6 +332,11 @@ class DatasetPure(Dataset):
             Whether to fully shuffle data.
         seed: int, optional
             random seed.
+        data_info : `DataInfo` object
+            Returned by `build_trainset`, whose encoder is used to map
+            original values to indices. Must be provided.
+        num_threads : int, optional
+            Number of threads used for encoding columns.
 
         Returns
         -------
@@ -195,9 +350,12 @@ class DatasetPure(Dataset):
             test_data = test_data.sample(
                 frac=1, random_state=seed).reset_index(drop=True)
 
+        encoder = cls._get_encoder(data_info)
         (test_user_indices,
-         test_item_indices) = cls._get_user_item_sparse_indices(
-            test_data, mode="test")
+         test_item_indices,
+         _,
+         unknown_rates) = cls._encode(encoder, test_data,
+                                      num_threads=num_threads)
         if "label" in test_data.columns:
             labels = test_data["label"].to_numpy(dtype=np.float32)
         else:
@@ -209,6 +367,7 @@ class DatasetPure(Dataset):
                                           test_item_indices,
                                           labels,
                                           train=False)
+        test_transformed.unknown_rates = unknown_rates
         return test_transformed
 
     @classmethod
@@ -244,7 +403,7 @@ class DatasetPure(Dataset):
         """
 
         trainset, data_info = cls.build_trainset(train_data, shuffle[0], seed)
-        testset = cls.build_testset(test_data, shuffle[1], seed)
+        testset = cls.build_testset(test_data, shuffle[1], seed, data_info)
         return trainset, testset, data_info
 
 
@@ -292,15 +451,15 @@ class DatasetFeat(Dataset):
 
         cls._check_subclass()
         cls._check_col_names(train_data, mode="train")
-        cls._set_sparse_unique_vals(train_data, sparse_col)
+        encoder = FeatureEncoder.fit(train_data, sparse_col)
         if shuffle:
             train_data = train_data.sample(
                 frac=1, random_state=seed).reset_index(drop=True)
 
-        user_indices, item_indices = cls._get_user_item_sparse_indices(
-            train_data, mode="train")
-        train_sparse_indices = cls._get_sparse_indices_matrix(
-            train_data, sparse_col, mode="train") if sparse_col else None
+        (user_indices,
+         item_indices,
+         train_sparse_indices,
+         _) = cls._encode(encoder, train_data, sparse_col)
         train_dense_values = (
             train_data[dense_col].to_numpy() if dense_col else None)
         labels = train_data["label"].to_numpy(dtype=np.float32)
@@ -339,13 +498,63 @@ class DatasetFeat(Dataset):
                              user_sparse_unique,
                              user_dense_unique,
                              item_sparse_unique,
-                             item_dense_unique)
-
+                             item_dense_unique,
+                             encoder=encoder)
         return train_transformed, data_info
 
+    @classmethod
+    def build_trainset_from_file(cls, path, user_col=None, item_col=None,
+                                 sparse_col=None, dense_col=None,
+                                 chunksize=1000000, file_format=None,
+                                 mmap_dir=None, **read_kwargs):
+        """Build transformed feat train_data from CSV or Parquet files
+        chunk by chunk, without loading the whole data into memory.
+
+        Vocabularies of `user`, `item` and `sparse_col` are collected in
+        the first pass, then every chunk is encoded into preallocated
+        arrays in the second pass, so peak memory of original data is
+        proportional to `chunksize`.
+
+        Parameters
+        ----------
+        path : str or list of str
+            File path or list of file paths, which must contain
+            `user`, `item`, `label` columns.
+        user_col : list of str
+            List of user feature column names.
+        item_col : list of str
+            List of item feature column names.
+        sparse_col : list of str
+            List of sparse feature columns names.
+        dense_col : list of str, optional
+            List of dense feature column names.
+        chunksize : int, optional
+            Number of rows read at a time.
+        file_format : {"csv", "parquet"}, optional
+            Inferred from file extension if not provided.
+        mmap_dir : str, optional
+            If provided, arrays are written to memory-mapped `.npy` files
+            in this directory, and `trainset.save(mmap_dir)` will reuse them.
+        read_kwargs : dict
+            Other arguments passed to `pandas.read_csv`.
+
+        Returns
+        -------
+        trainset : `TransformedSet` object
+            Data object used for training.
+        data_info : `DataInfo` object
+            Object that contains some useful information
+            for training and predicting
+        """
+        cls._check_subclass()
+        return cls._build_trainset_streaming(
+            path, user_col, item_col, sparse_col, dense_col, chunksize,
+            file_format, mmap_dir, **read_kwargs)
+
     @classmethod
     def build_testset(cls, test_data, sparse_col=None, dense_col=None,
-                      shuffle=False, seed=42):
+                      shuffle=False, seed=42, data_info=None,
+                      num_threads=1):
         """Build transformed feat eval_data or test_data from original data.
 
         Normally, `user` and `item` column will be transformed
@@ -364,6 +573,11 @@ class DatasetFeat(Dataset):
             Whether to fully shuffle data.
         seed: int, optional
             random seed.
+        data_info : `DataInfo` object
+            Returned by `build_trainset`, whose encoder is used to map
+            original values to indices. Must be provided.
+        num_threads : int, optional
+            Number of threads used for encoding columns.
 
         Returns
         -------
@@ -377,11 +591,12 @@ class DatasetFeat(Dataset):
             test_data = test_data.sample(
                 frac=1, random_state=seed).reset_index(drop=True)
 
+        encoder = cls._get_encoder(data_info)
         (test_user_indices,
-         test_item_indices) = cls._get_user_item_sparse_indices(
-            test_data, mode="test")
-        test_sparse_indices = cls._get_sparse_indices_matrix(
-            test_data, sparse_col, mode="test") if sparse_col else None
+         test_item_indices,
+         test_sparse_indices,
+         unknown_rates) = cls._encode(encoder, test_data, sparse_col,
+                                      num_threads)
         test_dense_values = (
             test_data[dense_col].to_numpy() if dense_col else None)
 
@@ -398,7 +613,7 @@ class DatasetFeat(Dataset):
                                           test_sparse_indices,
                                           test_dense_values,
                                           train=False)
-
+        test_transformed.unknown_rates = unknown_rates
         return test_transformed
 
     @classmethod
@@ -446,6 +661,6 @@ class DatasetFeat(Dataset):
             train_data, user_col, item_col, sparse_col, dense_col,
             shuffle[0], seed)
         testset = cls.build_testset(
-            test_data, sparse_col, dense_col, shuffle[1], seed)
+            test_data, sparse_col, dense_col, shuffle[1], seed, data_info)
         return trainset, testset, data_info
 
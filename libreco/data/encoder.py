@@ -0,0 +1,215 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from .growable import append_rows
+
+
+class FeatureEncoder(object):
+    """Vocabularies of user, item and sparse feature columns, which map
+    original values to inner indices.
+
+    Every vocabulary is an array of unique values, which is sorted when
+    built from train data, and new users and items added by `extend` are
+    appended at the end, so existing indices never change. Lookups go through
+    a hash index built lazily from the array, which maps values to indices
+    and detects unknown values in one pass. The hash indices are only a
+    cache and are not pickled, so the encoder can be shared with worker
+    processes, and used to encode data concurrently from multiple threads.
+
+    Unknown values are mapped to the vocabulary size, i.e. `n_users`,
+    `n_items` or `len(sparse_unique_vals[col])`.
+
+    Parameters
+    ----------
+    user_unique_vals : numpy.ndarray
+        Sorted unique users.
+    item_unique_vals : numpy.ndarray
+        Sorted unique items.
+    sparse_unique_vals : dict of {str : numpy.ndarray}, optional
+        Sorted unique values of every sparse feature column.
+    """
+
+    def __init__(self, user_unique_vals, item_unique_vals,
+                 sparse_unique_vals=None):
+        self.user_unique_vals = user_unique_vals
+        self.item_unique_vals = item_unique_vals
+        self.sparse_unique_vals = dict(sparse_unique_vals or {})
+        self._indexes = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_indexes"] = dict()
+        return state
+
+    @classmethod
+    def fit(cls, data, sparse_col=None):
+        """Build vocabularies from train data.
+
+        Parameters
+        ----------
+        data : `pandas.DataFrame`
+            Data that contains `user`, `item` and `sparse_col` columns.
+        sparse_col : list of str, optional
+            Sparse feature column names.
+
+        Returns
+        -------
+        encoder : `FeatureEncoder` object
+        """
+        sparse_unique_vals = {
+            col: np.unique(data[col]) for col in (sparse_col or [])
+        }
+        return cls(np.unique(data["user"]),
+                   np.unique(data["item"]),
+                   sparse_unique_vals)
+
+    def vocab(self, key, sparse=False):
+        """Vocabulary of `key`, which is "user", "item" or a sparse
+        column name if `sparse` is True. Note a sparse column may also be
+        named "user" or "item", whose vocabulary is fixed after fitting."""
+        if sparse:
+            return self.sparse_unique_vals[key]
+        elif key == "user":
+            return self.user_unique_vals
+        elif key == "item":
+            return self.item_unique_vals
+        raise ValueError(f"unknown vocabulary: {key}")
+
+    def _get_index(self, key, sparse=False):
+        index = self._indexes.get((key, sparse))
+        if index is None:
+            # concurrent threads may build the same index, which is harmless
+            index = pd.Index(self.vocab(key, sparse))
+            self._indexes[(key, sparse)] = index
+        return index
+
+    def lookup(self, key, values, sparse=False):
+        """Map values to indices in vocabulary `key` in one pass.
+
+        Returns
+        -------
+        indices : numpy.ndarray
+            Unknown values are mapped to vocabulary size.
+        n_unknown : int
+            Number of unknown values.
+        """
+        index = self._get_index(key, sparse)
+        indices = index.get_indexer(np.asarray(values))
+        unknown_mask = indices == -1
+        n_unknown = int(np.count_nonzero(unknown_mask))
+        if n_unknown > 0:
+            indices[unknown_mask] = len(index)
+        return indices, n_unknown
+
+    def encode_users(self, users):
+        return self.lookup("user", users)[0]
+
+    def encode_items(self, items):
+        return self.lookup("item", items)[0]
+
+    def encode_col(self, col, values):
+        return self.lookup(col, values, sparse=True)[0]
+
+    def extend(self, users=None, items=None):
+        """Append users and items that are not in the vocabularies yet,
+        in order of first appearance.
+
+        Sparse feature vocabularies are fixed, since growing one of them
+        would shift the offsets of all the following columns. New feature
+        values are mapped to the unknown index of their column.
+
+        Returns
+        -------
+        n_new_users : int
+        n_new_items : int
+        """
+        n_new_users = self._extend_vocab("user", users)
+        n_new_items = self._extend_vocab("item", items)
+        return n_new_users, n_new_items
+
+    def _extend_vocab(self, key, values):
+        if values is None:
+            return 0
+        values = pd.unique(np.asarray(values))
+        indices, n_unknown = self.lookup(key, values)
+        if n_unknown == 0:
+            return 0
+        vocab = self.vocab(key)
+        vocab = append_rows(vocab, values[indices == len(vocab)])
+        if key == "user":
+            self.user_unique_vals = vocab
+        else:
+            self.item_unique_vals = vocab
+        self._indexes.pop((key, False), None)
+        return n_unknown
+
+    def feature_offset(self, sparse_col, unknown_slot=True):
+        """Offsets of sparse columns in the shared feature index space.
+
+        With `unknown_slot`, every column reserves one more index for
+        values that only appear in test data.
+        """
+        extra = 1 if unknown_slot else 0
+        unique_values = [
+            len(self.sparse_unique_vals[col]) + extra for col in sparse_col
+        ]
+        return np.cumsum(np.array([0] + unique_values))
+
+    def transform(self, data, sparse_col=None, unknown_slot=True,
+                  num_threads=1):
+        """Encode `user`, `item` and all `sparse_col` columns of data.
+
+        Columns are independent, so they are encoded in `num_threads`
+        threads. Hash lookups of numeric values release the GIL.
+
+        Parameters
+        ----------
+        data : `pandas.DataFrame`
+            Data that contains `user`, `item` and `sparse_col` columns.
+        sparse_col : list of str, optional
+            Sparse feature column names.
+        unknown_slot : bool, optional
+            Whether every sparse column reserves one more index for unknown
+            values, see `feature_offset`.
+        num_threads : int, optional
+            Number of threads used for encoding columns.
+
+        Returns
+        -------
+        user_indices : numpy.ndarray
+        item_indices : numpy.ndarray
+        sparse_indices : numpy.ndarray or None
+            Feature indices of `sparse_col`, shifted by column offsets.
+        unknown_rates : dict of {str : float}
+            Fraction of unknown values in every column.
+        """
+        sparse_col = list(sparse_col) if sparse_col else []
+        keys = ["user", "item"] + sparse_col
+        is_sparse = [False, False] + [True] * len(sparse_col)
+
+        def encode(key, sparse):
+            return self.lookup(key, data[key].to_numpy(), sparse)
+
+        if num_threads > 1 and len(keys) > 1:
+            with ThreadPoolExecutor(
+                    max_workers=min(num_threads, len(keys))) as executor:
+                results = list(executor.map(encode, keys, is_sparse))
+        else:
+            results = [encode(key, sparse)
+                       for key, sparse in zip(keys, is_sparse)]
+
+        n_samples = len(data)
+        unknown_rates = {
+            key: n_unknown / n_samples if n_samples > 0 else 0.0
+            for key, (_, n_unknown) in zip(keys, results)
+        }
+        user_indices, item_indices = results[0][0], results[1][0]
+        sparse_indices = None
+        if sparse_col:
+            sparse_indices = np.empty((n_samples, len(sparse_col)),
+                                      dtype=np.int32)
+            for i, (col_indices, _) in enumerate(results[2:]):
+                sparse_indices[:, i] = col_indices
+            feature_offset = self.feature_offset(sparse_col, unknown_slot)
+            sparse_indices += feature_offset[:-1].astype(np.int32)
+        return user_indices, item_indices, sparse_indices, unknown_rates
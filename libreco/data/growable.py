@@ -0,0 +1,71 @@
+import numpy as np
+
+
+class _Buffer(np.ndarray):
+    """Over-allocated array, of which only the first `n_used` rows are in
+    use. Arrays returned by `append_rows` are prefix views of it."""
+    n_used = 0
+
+
+def append_rows(array, rows):
+    """Append `rows` to `array` along the first axis.
+
+    The result is a view of a buffer whose capacity doubles whenever it is
+    full, so appending to the returned array again reuses the spare
+    capacity, and a sequence of appends takes amortized O(1) time per row.
+    A buffer is only written in place by its latest view, appending to a
+    stale view copies the data into a new buffer. Arrays not created by
+    this function, e.g. memory-mapped ones, are always copied.
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+    rows : array_like
+        Rows of the same trailing shape as `array`.
+
+    Returns
+    -------
+    array : numpy.ndarray
+        Array of length `len(array) + len(rows)`.
+    """
+    rows = np.asarray(rows, dtype=array.dtype)
+    if rows.ndim == array.ndim - 1:
+        rows = rows[np.newaxis]
+    n_old, n_new = len(array), len(rows)
+    if n_new == 0:
+        return array
+
+    buffer = _find_buffer(array)
+    if not (isinstance(buffer, _Buffer)
+            and buffer.n_used == n_old
+            and len(buffer) >= n_old + n_new
+            and _same_start(buffer, array)):
+        capacity = max(n_old + n_new, 2 * n_old)
+        buffer = _Buffer((capacity,) + array.shape[1:], dtype=array.dtype)
+        buffer[:n_old] = array
+    buffer[n_old: n_old + n_new] = rows
+    buffer.n_used = n_old + n_new
+    return buffer.view(np.ndarray)[:n_old + n_new]
+
+
+def grow_rows(array, n_rows, fill_value=0):
+    """Append `n_rows` rows filled with `fill_value` to `array`,
+    see `append_rows`."""
+    rows = np.full((n_rows,) + array.shape[1:], fill_value, dtype=array.dtype)
+    return append_rows(array, rows)
+
+
+def _find_buffer(array):
+    base = array.base
+    # views of `_Buffer` are plain ndarrays, whose base chain stops at
+    # the subclass boundary
+    while isinstance(base, np.ndarray) and not isinstance(base, _Buffer):
+        base = base.base
+    return base
+
+
+def _same_start(buffer, array):
+    return (array.flags.c_contiguous
+            and array.shape[1:] == buffer.shape[1:]
+            and (array.__array_interface__["data"][0]
+                 == buffer.__array_interface__["data"][0]))
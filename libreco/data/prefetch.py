@@ -0,0 +1,132 @@
+import time
+from collections import deque
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, wait as wait_futures
+)
+from itertools import islice
+
+_worker_generator = None
+
+
+class Prefetcher(object):
+    """Produce batches of a data generator ahead of time in background
+    workers, so batch construction overlaps with model training.
+
+    The wrapped generator must provide `batch_tasks(shuffle, batch_size)`,
+    which shuffles data and returns a task for every batch, and
+    `make_batch(*task)`, which builds a batch from a task without touching
+    any shared random state. All tasks of an epoch are created in the main
+    process and batches are yielded in task order, so the output is
+    deterministic given the same seed, regardless of the number of workers.
+
+    Parameters
+    ----------
+    data_generator : object
+        Data generator such as `DataGenFeat` or `NegativeSampling`.
+    prefetch_size : int, optional
+        Maximum number of batches that are produced in advance. If it is 0,
+        batches are produced synchronously in the calling thread.
+    num_workers : int, optional
+        Number of background workers.
+    backend : str, optional
+        Either "thread" or "process". Threads are cheap to start and share
+        data with the main thread, which suits batches built mostly by numpy
+        and cython code that releases the GIL. Processes avoid the GIL for
+        pure Python batch construction, but results have to be pickled.
+        Workers are started once and reused across epochs, so the data
+        generator is sent to every process only once, and every batch task
+        carries its shuffled row indices instead.
+
+    Attributes
+    ----------
+    wait_time : float
+        Seconds the consumer has spent waiting for batches in the latest
+        epoch.
+
+    Call `close` after training to shut down the workers.
+    """
+
+    def __init__(self, data_generator, prefetch_size=0, num_workers=1,
+                 backend="thread"):
+        self._executor = None
+        if backend not in ("thread", "process"):
+            raise ValueError("backend must either be 'thread' or 'process'")
+        self.data_generator = data_generator
+        self.prefetch_size = prefetch_size
+        self.num_workers = max(1, num_workers)
+        self.backend = backend
+        self.wait_time = 0.0
+
+    def __call__(self, shuffle=True, batch_size=None):
+        self.wait_time = 0.0
+        tasks = self.data_generator.batch_tasks(shuffle, batch_size)
+        if self.prefetch_size <= 0:
+            return self._iter_sync(tasks)
+        return self._iter_prefetch(tasks)
+
+    def _iter_sync(self, tasks):
+        for task in tasks:
+            start = time.perf_counter()
+            batch = self.data_generator.make_batch(*task)
+            self.wait_time += time.perf_counter() - start
+            yield batch
+
+    def _iter_prefetch(self, tasks):
+        executor, make_batch = self._get_executor()
+        if self.backend == "process":
+            # workers keep the data generator of the first epoch, so the
+            # shuffled order is resolved here
+            tasks = ((self.data_generator._batch_index(task[0]), *task[1:])
+                     for task in tasks)
+        futures = deque()
+        try:
+            tasks = iter(tasks)
+            for task in islice(tasks, self.prefetch_size):
+                futures.append(executor.submit(make_batch, *task))
+            while futures:
+                start = time.perf_counter()
+                batch = futures.popleft().result()
+                self.wait_time += time.perf_counter() - start
+                for task in islice(tasks, 1):
+                    futures.append(executor.submit(make_batch, *task))
+                yield batch
+        finally:
+            # iteration may stop early, e.g. with an exception in training
+            for future in futures:
+                future.cancel()
+            wait_futures(futures)
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.backend == "thread":
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.num_workers)
+            else:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    initializer=_init_worker,
+                    initargs=(self.data_generator,))
+        if self.backend == "thread":
+            return self._executor, self.data_generator.make_batch
+        return self._executor, _make_batch_in_worker
+
+    def close(self):
+        """Shut down the background workers, which are started again if
+        more batches are requested."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __del__(self):
+        self.close()
+
+
+def _init_worker(data_generator):
+    global _worker_generator
+    # tasks carry row indices, so they must not be shuffled again
+    data_generator.batch_order = None
+    _worker_generator = data_generator
+
+
+def _make_batch_in_worker(*task):
+    return _worker_generator.make_batch(*task)
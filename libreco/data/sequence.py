@@ -4,12 +4,12 @@ import numpy as np
 
 
 def sparse_user_interacted(user_indices, item_indices, user_consumed,
-                           mode=None, num=None):
+                           mode=None, num=None, random_state=np.random):
     for j, (u, i) in enumerate(zip(user_indices, item_indices)):
         consumed_items = user_consumed[u]
         interacted_indices = []
         interacted_items = []
-        position = consumed_items.index(i)
+        position = _item_position(consumed_items, i)
         if position == 0:  # first item, no history interaction
             continue
         elif position < num:
@@ -21,7 +21,7 @@ def sparse_user_interacted(user_indices, item_indices, user_consumed,
             interacted_items.extend(consumed_items[start_index: position])
         elif position >= num and mode == "random":
             interacted_indices.extend([j] * num)
-            chosen_items = np.random.choice(
+            chosen_items = random_state.choice(
                 consumed_items, num, replace=False).tolist()
             interacted_items.extend(chosen_items)
 
@@ -57,45 +57,47 @@ def sparse_user_last_interacted(user_indices, user_consumed, recent_num=10):
     return indices, interacted_items
 
 
-def sample_item_with_tolerance(num, consumed_items, consumed_len, tolerance=5):
+def sample_item_with_tolerance(num, consumed_items, consumed_len, tolerance=5,
+                               random_state=None):
     assert num > tolerance
+    rand = random if random_state is None else random_state.random_sample
     sampled = []
     first_len = num - tolerance
     while len(sampled) < first_len:
-        i = floor(random() * consumed_len)
+        i = floor(rand() * consumed_len)
         if consumed_items[i] not in sampled:
             sampled.append(consumed_items[i])
     for _ in range(tolerance):
-        i = floor(random() * consumed_len)
+        i = floor(rand() * consumed_len)
         sampled.append(consumed_items[i])
     return sampled
 
 
 def user_interacted_seq(user_indices, item_indices, user_consumed, pad_index,
-                        mode=None, num=None, user_consumed_set=None):
+                        mode=None, num=None, random_state=None):
     batch_size = len(user_indices)
     batch_interacted = np.full((batch_size, num), pad_index, dtype=np.int32)
     batch_interacted_len = []
+    is_consumed = user_consumed.contains(user_indices, item_indices)
     for j, (u, i) in enumerate(zip(user_indices, item_indices)):
         consumed_items = user_consumed[u]
         consumed_len = len(consumed_items)
-        consumed_set = user_consumed_set[u]
         # If i is a negative item, then random sample some items
         # from user's past interacted items.
-        if i not in consumed_set:
+        if not is_consumed[j]:
             if consumed_len >= num:
                 # `np.random.choice` is too slow,
                 # so here we use a custom sample function with
                 # some tolerance of duplicate items
                 chosen_items = sample_item_with_tolerance(
-                    num, consumed_items, consumed_len, 5)
+                    num, consumed_items, consumed_len, 5, random_state)
                 batch_interacted[j] = chosen_items
                 batch_interacted_len.append(float(num))
             else:
                 batch_interacted[j, :consumed_len] = consumed_items
                 batch_interacted_len.append(float(consumed_len))
         else:
-            position = consumed_items.index(i)
+            position = _item_position(consumed_items, i)
             if position == 0:
                 # first item, no historical interaction,
                 # assign to pad_index by default, and length is 1.
@@ -108,14 +110,19 @@ def user_interacted_seq(user_indices, item_indices, user_consumed, pad_index,
                 batch_interacted[j] = consumed_items[start_index: position]
                 batch_interacted_len.append(float(num))
             elif position >= num and mode == "random":
-                chosen_items = np.random.choice(consumed_items, num,
-                                                replace=False)
+                chosen_items = (random_state or np.random).choice(
+                    consumed_items, num, replace=False)
                 batch_interacted[j] = chosen_items
                 batch_interacted_len.append(float(num))
 
     return batch_interacted, batch_interacted_len
 
 
+def _item_position(consumed_items, item):
+    # position of the first occurrence of item in user's consumed items
+    return np.argmax(consumed_items == item)
+
+
 # most recent num items an user has interacted, assume already sorted by time.
 def user_last_interacted(user_indices, user_consumed, pad_index, recent_num=10):
     size = len(user_indices)
@@ -0,0 +1,62 @@
+import json
+import os
+import numpy as np
+
+
+def save_arrays(path, arrays, metadata, metadata_name):
+    """Save every array as a `.npy` file in directory `path`, together
+    with a json metadata file, which also records the saved array names.
+
+    Arrays that are None are skipped.
+    """
+    os.makedirs(path, exist_ok=True)
+    saved_names = []
+    for name, array in arrays.items():
+        if array is None:
+            continue
+        saved_names.append(name)
+        array_path = os.path.join(path, f"{name}.npy")
+        if _is_memmap_of(array, array_path):
+            # already backed by the target file, e.g. built with `mmap_dir`
+            array.flush()
+            continue
+        # object arrays (e.g. string ids) need pickle and can't be memmapped
+        np.save(array_path, np.asarray(array), allow_pickle=True)
+
+    metadata = dict(metadata, arrays=saved_names)
+    with open(os.path.join(path, metadata_name), "w") as f:
+        json.dump(metadata, f, indent=4)
+
+
+def _is_memmap_of(array, array_path):
+    return (isinstance(array, np.memmap)
+            and array.filename is not None
+            and os.path.exists(array_path)
+            and os.path.samefile(array.filename, array_path))
+
+
+def load_metadata(path, metadata_name):
+    metadata_path = os.path.join(path, metadata_name)
+    if not os.path.exists(metadata_path):
+        raise FileNotFoundError(f"no {metadata_name} found in {path}")
+    with open(metadata_path) as f:
+        return json.load(f)
+
+
+def load_arrays(path, names, mmap_mode="r"):
+    """Load arrays saved by `save_arrays`, memory-mapped with `mmap_mode`.
+
+    Arrays of Python objects can't be memory-mapped, so they are fully
+    loaded. Arrays that were not saved are returned as None.
+    """
+    arrays = dict()
+    for name in names:
+        array_path = os.path.join(path, f"{name}.npy")
+        if not os.path.exists(array_path):
+            arrays[name] = None
+            continue
+        try:
+            arrays[name] = np.load(array_path, mmap_mode=mmap_mode)
+        except ValueError:
+            arrays[name] = np.load(array_path, allow_pickle=True)
+    return arrays
@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+def iter_chunks(path, chunksize, columns=None, file_format=None,
+                **read_kwargs):
+    """Read CSV or Parquet files in chunks of at most `chunksize` rows.
+
+    Parameters
+    ----------
+    path : str or list of str
+        File path or list of file paths.
+    chunksize : int
+        Number of rows in each chunk.
+    columns : list of str, optional
+        Columns to read, default is all columns.
+    file_format : {"csv", "parquet"}, optional
+        Inferred from file extension if not provided.
+    read_kwargs : dict
+        Other arguments passed to `pandas.read_csv`, e.g. `sep`.
+
+    Yields
+    ------
+    chunk : `pandas.DataFrame`
+    """
+    paths = [path] if isinstance(path, (str, os.PathLike)) else list(path)
+    for p in paths:
+        fmt = file_format or _infer_file_format(p)
+        if fmt == "csv":
+            yield from pd.read_csv(p, usecols=columns, chunksize=chunksize,
+                                   **read_kwargs)
+        elif fmt == "parquet":
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError("pyarrow is required to read parquet files")
+            parquet_file = pq.ParquetFile(p)
+            for batch in parquet_file.iter_batches(batch_size=chunksize,
+                                                   columns=columns):
+                yield batch.to_pandas()
+        else:
+            raise ValueError("file_format must either be 'csv' or 'parquet'")
+
+
+def _infer_file_format(path):
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+    return "csv"
+
+
+def allocate_array(shape, dtype, mmap_dir=None, name=None):
+    """Preallocate an array, which is a memory-mapped `.npy` file in
+    `mmap_dir` if provided, so that it can also be loaded by
+    `TransformedSet.load` after saving."""
+    shape = (shape,) if np.isscalar(shape) else tuple(shape)
+    if mmap_dir is None:
+        return np.empty(shape, dtype=dtype)
+    os.makedirs(mmap_dir, exist_ok=True)
+    return np.lib.format.open_memmap(os.path.join(mmap_dir, f"{name}.npy"),
+                                     mode="w+", dtype=dtype, shape=shape)
+
+
+def scan_vocabs(chunks, vocab_cols):
+    """First pass of streaming building, which collects sorted unique values
+    of `vocab_cols` and total number of rows."""
+    vocabs = {col: None for col in vocab_cols}
+    n_rows = 0
+    for chunk in chunks:
+        n_rows += len(chunk)
+        for col in vocab_cols:
+            unique_vals = np.unique(chunk[col].to_numpy())
+            vocabs[col] = (unique_vals if vocabs[col] is None
+                           else np.union1d(vocabs[col], unique_vals))
+    return vocabs, n_rows
@@ -1,9 +1,14 @@
 import numpy as np
-from array import array
-from collections import defaultdict
 from scipy.sparse import csr_matrix
+from .consumed import ConsumedIndex
+from .growable import append_rows
+from .storage import save_arrays, load_arrays, load_metadata
 from ..utils.sampling import NegativeSampling
 
+_METADATA_NAME = "transformed_set.json"
+_DATA_NAMES = ["user_indices", "item_indices", "labels",
+               "sparse_indices", "dense_values"]
+
 
 class TransformedSet(object):
     def __init__(self, user_indices=None, item_indices=None, labels=None,
@@ -14,6 +19,10 @@ class TransformedSet(object):
         self._sparse_indices = sparse_indices
         self._dense_values = dense_values
         self.has_sampled = False
+        self._sparse_interaction = None
+        # fraction of values unknown to train data in every column,
+        # only set for test data
+        self.unknown_rates = None
         if train:
             self._sparse_interaction = csr_matrix(
                 (labels, (user_indices, item_indices)),
@@ -30,15 +39,13 @@ class TransformedSet(object):
         self.dense_values_orig = None
 
     def __interaction_consumed(self):
-        user_consumed = defaultdict(lambda: array("I"))
-        item_consumed = defaultdict(lambda: array("I"))
-        for u, i in zip(self.user_indices, self.item_indices):
-            user_consumed[u].append(i)
-            item_consumed[i].append(u)
+        user_consumed = ConsumedIndex(self.user_indices, self.item_indices)
+        item_consumed = ConsumedIndex(self.item_indices, self.user_indices)
         return user_consumed, item_consumed
 
     def build_negative_samples(self, data_info, num_neg=1,
-                               item_gen_mode="random", seed=42):
+                               item_gen_mode="random", seed=42,
+                               num_threads=1, pop_power=1.0):
         self.has_sampled = True
         self.user_indices_orig = self._user_indices
         self.item_indices_orig = self._item_indices
@@ -46,27 +53,162 @@ class TransformedSet(object):
         self.sparse_indices_orig = self._sparse_indices
         self.dense_values_orig = self._dense_values
 
-        self._build_negative_samples(data_info, num_neg, item_gen_mode, seed)
+        self._build_negative_samples(data_info, num_neg, item_gen_mode, seed,
+                                     num_threads, pop_power)
 
     def _build_negative_samples(self, data_info, num_neg=1,
-                                item_gen_mode="random", seed=42):
+                                item_gen_mode="random", seed=42,
+                                num_threads=1, pop_power=1.0):
 
         if self.sparse_indices is None and self.dense_values is None:
             neg = NegativeSampling(self, data_info, num_neg,
-                                   sparse=False, dense=False)
+                                   sparse=False, dense=False,
+                                   num_threads=num_threads)
         elif self.sparse_indices is None:
             neg = NegativeSampling(self, data_info, num_neg,
-                                   sparse=False, dense=True)
+                                   sparse=False, dense=True,
+                                   num_threads=num_threads)
         elif self.dense_values is None:
             neg = NegativeSampling(self, data_info, num_neg,
-                                   sparse=True, dense=False)
+                                   sparse=True, dense=False,
+                                   num_threads=num_threads)
         else:
             neg = NegativeSampling(self, data_info, num_neg,
-                                   sparse=True, dense=True)
+                                   sparse=True, dense=True,
+                                   num_threads=num_threads)
 
         (self._user_indices, self._item_indices, self._labels,
          self._sparse_indices, self._dense_values
-         ) = neg.generate_all(seed=seed, item_gen_mode=item_gen_mode)
+         ) = neg.generate_all(seed=seed, item_gen_mode=item_gen_mode,
+                              pop_power=pop_power)
+
+    def extend(self, user_indices, item_indices, labels, sparse_indices=None,
+               dense_values=None):
+        """Append encoded train data in place, e.g. data encoded by
+        `Dataset.extend_trainset`, which may contain new users and items.
+
+        Data arrays grow with amortized doubling capacity, and the
+        interaction matrix and consumed indices are merged with the new
+        interactions in O(nnz) time. If negative samples have been built,
+        new data is appended to the original data, and negative sampling
+        must be done again with `build_negative_samples`.
+        """
+        new_data = {"user_indices": user_indices,
+                    "item_indices": item_indices,
+                    "labels": labels,
+                    "sparse_indices": sparse_indices,
+                    "dense_values": dense_values}
+        if len(labels) == 0:
+            return
+        for name in _DATA_NAMES:
+            attr = f"{name}_orig" if self.has_sampled else f"_{name}"
+            array = getattr(self, attr)
+            if array is not None and new_data[name] is not None:
+                array = append_rows(array, new_data[name])
+            # sampled data is dropped, and will be rebuilt from original data
+            setattr(self, f"_{name}", array)
+            setattr(self, f"{name}_orig", None)
+        self.has_sampled = False
+
+        labels = np.asarray(labels, dtype=np.float32)
+        if self._sparse_interaction is not None:
+            self._sparse_interaction = _merge_interaction(
+                self._sparse_interaction, user_indices, item_indices, labels)
+        self._user_consumed = self._user_consumed.append(
+            user_indices, item_indices)
+        self._item_consumed = self._item_consumed.append(
+            item_indices, user_indices)
+
+    def save(self, path):
+        """Save to directory `path` as `.npy` files plus a metadata file,
+        which can be loaded by `TransformedSet.load` with memory-mapping.
+
+        Parameters
+        ----------
+        path : str
+            Directory to save data, will be created if not exists.
+        """
+        arrays = {name: getattr(self, name) for name in _DATA_NAMES}
+        if self.has_sampled:
+            arrays.update({f"{name}_orig": getattr(self, f"{name}_orig")
+                           for name in _DATA_NAMES})
+        if self._sparse_interaction is not None:
+            arrays.update({
+                "interaction_data": self._sparse_interaction.data,
+                "interaction_indices": self._sparse_interaction.indices,
+                "interaction_indptr": self._sparse_interaction.indptr
+            })
+        for name in ("user_consumed", "item_consumed"):
+            consumed = getattr(self, name)
+            arrays[f"{name}_indices"] = consumed.indices
+            arrays[f"{name}_indptr"] = consumed.indptr
+
+        metadata = {
+            "has_sampled": self.has_sampled,
+            "interaction_shape": (list(self._sparse_interaction.shape)
+                                  if self._sparse_interaction is not None
+                                  else None),
+            "user_consumed_n_cols": self.user_consumed.n_cols,
+            "item_consumed_n_cols": self.item_consumed.n_cols,
+            "unknown_rates": self.unknown_rates
+        }
+        save_arrays(path, arrays, metadata, _METADATA_NAME)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Load data saved by `TransformedSet.save`.
+
+        All arrays are memory-mapped by default, so loading is nearly
+        instant and multiple processes can share the same page cache.
+
+        Parameters
+        ----------
+        path : str
+            Directory of saved data.
+        mmap_mode : {None, "r", "r+", "c"}, optional
+            Memory-map mode passed to `numpy.load`, None means loading
+            everything into memory.
+
+        Returns
+        -------
+        data : `TransformedSet` object
+        """
+        metadata = load_metadata(path, _METADATA_NAME)
+        arrays = load_arrays(path, metadata["arrays"], mmap_mode)
+        get = arrays.get
+
+        data = cls.__new__(cls)
+        data._user_indices = get("user_indices")
+        data._item_indices = get("item_indices")
+        data._labels = get("labels")
+        data._sparse_indices = get("sparse_indices")
+        data._dense_values = get("dense_values")
+        data.has_sampled = metadata["has_sampled"]
+        data.unknown_rates = metadata.get("unknown_rates")
+        for name in _DATA_NAMES:
+            setattr(data, f"{name}_orig", get(f"{name}_orig"))
+
+        if metadata["interaction_shape"] is not None:
+            data._sparse_interaction = csr_matrix(
+                (get("interaction_data"),
+                 get("interaction_indices"),
+                 get("interaction_indptr")),
+                shape=metadata["interaction_shape"],
+                copy=False
+            )
+        else:
+            data._sparse_interaction = None
+        data._user_consumed = ConsumedIndex.from_arrays(
+            get("user_consumed_indices"),
+            get("user_consumed_indptr"),
+            metadata["user_consumed_n_cols"]
+        )
+        data._item_consumed = ConsumedIndex.from_arrays(
+            get("item_consumed_indices"),
+            get("item_consumed_indptr"),
+            metadata["item_consumed_n_cols"]
+        )
+        return data
 
     def __len__(self):
         return len(self.labels)
@@ -107,3 +249,17 @@ class TransformedSet(object):
     def item_consumed(self):
         return self._item_consumed
 
+
+def _merge_interaction(interaction, user_indices, item_indices, labels):
+    n_rows = max(interaction.shape[0], int(np.max(user_indices)) + 1)
+    n_cols = max(interaction.shape[1], int(np.max(item_indices)) + 1)
+    indptr = np.concatenate([
+        interaction.indptr,
+        np.full(n_rows - interaction.shape[0], interaction.indptr[-1],
+                dtype=interaction.indptr.dtype)
+    ])
+    old = csr_matrix((interaction.data, interaction.indices, indptr),
+                     shape=(n_rows, n_cols))
+    new = csr_matrix((labels, (user_indices, item_indices)),
+                     shape=(n_rows, n_cols), dtype=np.float32)
+    return old + new
@@ -175,20 +175,18 @@ def compute_probs(model, data, batch_size):
 
 
 def compute_recommends(model, users, k):
+    users = list(users)
+    items, _ = model.recommend_users(users, k)
     y_recommends = dict()
-    no_rec_num = 0
     no_rec_users = []
-    for u in users:
-        reco = model.recommend_user(u, k)
-        if not reco or reco == -1:   # user_cf
-            # print("no recommend user: ", u)
-            no_rec_num += 1
+    for u, reco in zip(users, items):
+        reco = reco[reco >= 0]
+        if len(reco) == 0:
             no_rec_users.append(u)
             continue
-        reco = [r[0] for r in reco]
-        y_recommends[u] = reco
-    if no_rec_num > 0:
-        print(f"{no_rec_num} users has no recommendation")
+        y_recommends[u] = reco.tolist()
+    if no_rec_users:
+        print(f"{len(no_rec_users)} users has no recommendation")
         users = list(set(users).difference(no_rec_users))
     return y_recommends, users
 
@@ -0,0 +1,55 @@
+#cython: language_level=3
+cimport cython
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline void heap_push(float *scores, int *ids, int k, float score,
+                           int idx) noexcept nogil:
+    # bounded min-heap, the root is the smallest of the k kept scores
+    cdef int pos = 0, child
+    if score <= scores[0]:
+        return
+    while True:
+        child = 2 * pos + 1
+        if child >= k:
+            break
+        if child + 1 < k and scores[child + 1] < scores[child]:
+            child += 1
+        if scores[child] >= score:
+            break
+        scores[pos] = scores[child]
+        ids[pos] = ids[child]
+        pos = child
+    scores[pos] = score
+    ids[pos] = idx
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline void heap_sort(float *scores, int *ids, int k) noexcept nogil:
+    # pop the root repeatedly, leaving scores in descending order
+    cdef int size, pos, child
+    cdef float score
+    cdef int idx
+    for size in range(k - 1, 0, -1):
+        score = scores[size]
+        idx = ids[size]
+        scores[size] = scores[0]
+        ids[size] = ids[0]
+        pos = 0
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                break
+            if child + 1 < size and scores[child + 1] < scores[child]:
+                child += 1
+            if scores[child] >= score:
+                break
+            scores[pos] = scores[child]
+            ids[pos] = ids[child]
+            pos = child
+        scores[pos] = score
+        ids[pos] = idx
@@ -0,0 +1,102 @@
+#cython: language_level=3
+import numpy as np
+cimport numpy as np
+cimport cython
+from cython.parallel import prange
+from libcpp.algorithm cimport binary_search
+from libcpp.vector cimport vector
+
+
+cdef extern from "<random>" namespace "std" nogil:
+    cdef cppclass mt19937:
+        mt19937(unsigned int)
+
+    cdef cppclass uniform_int_distribution[T]:
+        uniform_int_distribution(T, T)
+        T operator()(mt19937)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline bint check_consumed(const np.int64_t[:] indices,
+                                const np.int64_t[:] indptr,
+                                np.int64_t user,
+                                np.int64_t item_neg) nogil:
+    return binary_search(&indices[indptr[user]],
+                         &indices[indptr[user+1]],
+                         item_neg)
+
+
+def negative_sampling(user_indices, sorted_indices, indptr, distinct_lengths,
+                      n_items, num_neg=1, num_threads=1, seed=42):
+    """Sample `num_neg` negative items for every user in `user_indices`.
+
+    Items are rejected if they can be found in the user's row of the
+    CSR interaction matrix (`sorted_indices` and `indptr`), whose indices
+    must be sorted within each row. Users whose number of distinct items
+    in `distinct_lengths` reaches `n_items` are never rejected. Data is split into `num_threads`
+    contiguous chunks and every chunk owns an `mt19937` generator seeded
+    with `seed + chunk_index`, so result is reproducible given the same
+    seed and number of threads.
+
+    Returns
+    -------
+    item_neg : numpy.ndarray of shape (len(user_indices), num_neg)
+    """
+    user_indices = np.ascontiguousarray(user_indices, dtype=np.int64)
+    sorted_indices = np.ascontiguousarray(sorted_indices, dtype=np.int64)
+    indptr = np.ascontiguousarray(indptr, dtype=np.int64)
+    distinct_lengths = np.ascontiguousarray(distinct_lengths, dtype=np.int64)
+    item_neg = np.empty((len(user_indices), num_neg), dtype=np.int64)
+    if len(user_indices) > 0:
+        _negative_sampling(user_indices, sorted_indices, indptr,
+                           distinct_lengths, item_neg, n_items, num_threads,
+                           seed)
+    return item_neg
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _negative_sampling(const np.int64_t[:] user_indices,
+                             const np.int64_t[:] sorted_indices,
+                             const np.int64_t[:] indptr,
+                             const np.int64_t[:] distinct_lengths,
+                             np.int64_t[:, ::1] item_neg,
+                             long n_items,
+                             int num_threads,
+                             unsigned int seed):
+
+    cdef Py_ssize_t t, i, k, start, end
+    cdef Py_ssize_t length = user_indices.shape[0]
+    cdef Py_ssize_t num_neg = item_neg.shape[1]
+    cdef Py_ssize_t chunk_size = (length + num_threads - 1) // num_threads
+    cdef np.int64_t user, item, n_rows = indptr.shape[0] - 1
+    cdef long lower_bound = 0, upper_bound = n_items - 1
+
+    cdef vector[mt19937] rng
+    cdef vector[uniform_int_distribution[long]] dist
+
+    for t in range(num_threads):
+        rng.push_back(mt19937(seed + t))
+        dist.push_back(uniform_int_distribution[long](
+            lower_bound, upper_bound))
+
+    with nogil:
+        for t in prange(num_threads, num_threads=num_threads,
+                        schedule="static"):
+            start = t * chunk_size
+            end = start + chunk_size if start + chunk_size < length else length
+            for i in range(start, end):
+                user = user_indices[i]
+                for k in range(num_neg):
+                    item = dist[t](rng[t])
+                    # unknown users have no consumed items, and a user
+                    # who has consumed all items can't be rejected forever
+                    if (0 <= user < n_rows and
+                            distinct_lengths[user] < n_items):
+                        while check_consumed(sorted_indices, indptr,
+                                             user, item):
+                            item = dist[t](rng[t])
+                    item_neg[i, k] = item
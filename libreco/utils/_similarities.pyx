@@ -3,362 +3,384 @@ from cython.parallel import prange, parallel
 import numpy as np
 cimport numpy as np
 cimport cython
-from libc.math cimport sqrt as csqrt, pow as cpow
+from libc.math cimport sqrt as csqrt, pow as cpow, INFINITY
 from libcpp.vector cimport vector
 from libc.stdlib cimport malloc, calloc, free
 from libc.string cimport memset
+from libcpp.algorithm cimport sort
+from ._heap cimport heap_push, heap_sort
 
 ctypedef unsigned int uint
 
-
-@cython.boundscheck(False)
-@cython.wraparound(False)
-@cython.cdivision(True)
-cdef Py_ssize_t count_freq(
-    const int[:] indices, 
-    const int[:] indptr, 
-    int min_common, 
-    int n_x, 
-    int n_y, 
-    int block_size, 
-    int block_num, 
-    int n_threads
-) nogil:
-
-    cdef: 
-        Py_ssize_t x_start, x_end, p, x1, x2, i, j, index
-        Py_ssize_t block_index, block_start, block_end, scount
-        Py_ssize_t res_count = 0
-    cdef uint *pre_freq
-    cdef uint *sum_array = <uint *> calloc(block_num, sizeof(uint))
-
-    for block_index in prange(block_num, num_threads=n_threads):
-        pre_freq = <uint *> malloc(sizeof(uint) * n_x * block_size)
-        memset(pre_freq, 0, sizeof(uint) * n_x * block_size)
-        block_start = block_index * block_size
-        block_end = (
-            n_x if n_x < block_start + block_size 
-                else block_start + block_size
-        )
-
-        for p in range(n_y):
-            x_start = indptr[p]
-            x_end = indptr[p + 1]
-            for i in range(x_start, x_end):
-                x1 = indices[i]
-                if x1 >= block_start and x1 < block_end:
-                    for j in range(i + 1, x_end):
-                        x2 = indices[j]
-                        index = (x1 - block_start) * n_x + x2
-                        pre_freq[index] += 1
-
-        for x1 in range(block_start, block_end):
-            for x2 in range(x1 + 1, n_x):
-                index = (x1 - block_start) * n_x + x2
-                scount = pre_freq[index]
-                if scount >= min_common:
-                    sum_array[block_index] += 1
-
-        free(pre_freq)
-
-    for i in range(block_num):
-        res_count += sum_array[i]
-    free(sum_array)
-    return res_count
+cdef enum Metric:
+    COSINE
+    JACCARD
+    ASYMMETRIC
+    DOT
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
-cdef void compute_cosine(
-    const int[:] indices, 
-    const int[:] indptr, 
-    const float[:] data, 
-    const float[:] x_norm, 
-    int min_common, 
-    int n_x, 
-    int n_y, 
-    int block_size, 
-    int block_num, 
-    int n_threads, 
-    float[:] res_data, 
-    uint[:] res_indices, 
-    uint[:] res_indptr
-) nogil:
-
-    cdef: 
-        Py_ssize_t x_start, x_end, p, x1, x2, i, j, index
-        Py_ssize_t block_index, block_start, block_end, scount
-        Py_ssize_t res_index = 0
-    cdef float sprods, sqi, sqj, cosine
-
+cdef void compute_invert(
+    const int[:] x_indices,
+    const int[:] x_indptr,
+    const float[:] x_data,
+    const int[:] y_indices,
+    const int[:] y_indptr,
+    const float[:] y_data,
+    const float[:] x_center,
+    const float[:] y_center,
+    const float[:] x_weight,
+    const float[:] y_weight,
+    const float[:] x_norm,
+    const int[:] x_count,
+    int metric,
+    float alpha,
+    int min_common,
+    int n_x,
+    int chunk_size,
+    int n_threads,
+    vector[vector[int]] &chunk_indices,
+    vector[vector[float]] &chunk_data,
+    np.int64_t[::1] row_counts,
+    float[:, ::1] topk_data,
+    int[:, ::1] topk_indices
+) noexcept nogil:
+    # Rows are computed one by one in a single pass, with sparse
+    # accumulators of size n_x per task: co-occurring x2 of row x1 are
+    # gathered through its y, i.e. x_indices, then the inverted index
+    # y_indices. Only touched entries are visited and reset afterwards.
+    # Without topk, the upper triangular part of every row is appended to
+    # the growable buffers of its chunk in ascending order of x2, otherwise
+    # the full row is pushed into a bounded heap of topk neighbors.
+    # Asymmetric rows are always full.
+    # Every value is transformed as
+    # (value - x_center[x] - y_center[y]) * x_weight[x] * y_weight[y],
+    # where empty vectors are skipped.
+    cdef:
+        Py_ssize_t chunk, x1, x2, y, a, b, t, n_touched, scount
+        Py_ssize_t n_chunks = (n_x + chunk_size - 1) // chunk_size
+        int topk = topk_data.shape[1]
+        bint use_topk = topk_data.shape[0] > 0
+        bint full_rows = use_topk or metric == ASYMMETRIC
+        bint has_x_center = x_center.shape[0] > 0
+        bint has_y_center = y_center.shape[0] > 0
+        bint has_x_weight = x_weight.shape[0] > 0
+        bint has_y_weight = y_weight.shape[0] > 0
+    cdef float v1, v2, sprods, sqi, sqj, sim, union
     cdef float *prods
     cdef uint *freq
-
-    for block_index in range(block_num):
-        prods = <float *> malloc(sizeof(float) * n_x * block_size)
-        freq = <uint *> malloc(sizeof(uint) * n_x * block_size)
-        memset(prods, 0, sizeof(float) * n_x * block_size)
-        memset(freq, 0, sizeof(uint) * n_x * block_size)
-
-        block_start = block_index * block_size
-        block_end = (
-            n_x if n_x < block_start + block_size 
-                else block_start + block_size
-        )
-
-        for p in range(n_y):
-            x_start = indptr[p]
-            x_end = indptr[p + 1]
-            for i in range(x_start, x_end):
-                x1 = indices[i]
-                if x1 >= block_start and x1 < block_end:
-                    for j in range(i + 1, x_end):
-                        x2 = indices[j]
-                        index = (x1 - block_start) * n_x + x2
-                        prods[index] += data[i] * data[j]
-                        freq[index] += 1
-
-        for x1 in range(block_start, block_end):
-            for x2 in range(x1 + 1, n_x):
-                index = (x1 - block_start) * n_x + x2
-                scount = freq[index]
-                if scount >= min_common:
-                    sprods = prods[index]
+    cdef int *touched
+
+    for chunk in prange(n_chunks, num_threads=n_threads, schedule="dynamic"):
+        prods = <float *> calloc(n_x, sizeof(float))
+        freq = <uint *> calloc(n_x, sizeof(uint))
+        touched = <int *> malloc(sizeof(int) * n_x)
+
+        for x1 in range(chunk * chunk_size,
+                        min((chunk + 1) * chunk_size, n_x)):
+            n_touched = 0
+            for a in range(x_indptr[x1], x_indptr[x1 + 1]):
+                y = x_indices[a]
+                v1 = x_data[a]
+                if has_x_center:
+                    v1 = v1 - x_center[x1]
+                if has_y_center:
+                    v1 = v1 - y_center[y]
+                if has_x_weight:
+                    v1 = v1 * x_weight[x1]
+                if has_y_weight:
+                    # weight of y on both sides of the product
+                    v1 = v1 * y_weight[y] * y_weight[y]
+                for b in range(y_indptr[y], y_indptr[y + 1]):
+                    x2 = y_indices[b]
+                    if x2 == x1 or (not full_rows and x2 < x1):
+                        continue
+                    if freq[x2] == 0:
+                        touched[n_touched] = x2
+                        n_touched = n_touched + 1
+                    freq[x2] += 1
+                    if metric != JACCARD:
+                        v2 = y_data[b]
+                        if has_x_center:
+                            v2 = v2 - x_center[x2]
+                        if has_y_center:
+                            v2 = v2 - y_center[y]
+                        if has_x_weight:
+                            v2 = v2 * x_weight[x2]
+                        prods[x2] += v1 * v2
+
+            if not use_topk:
+                sort(touched, touched + n_touched)
+            for t in range(n_touched):
+                x2 = touched[t]
+                scount = freq[x2]
+                sprods = prods[x2]
+                freq[x2] = 0
+                prods[x2] = 0.0
+                if scount < min_common:
+                    continue
+                if metric == JACCARD:
+                    union = x_count[x1] + x_count[x2] - scount
+                    sim = scount / union
+                elif metric == DOT:
+                    sim = sprods
+                else:
                     sqi = x_norm[x1]
                     sqj = x_norm[x2]
                     if sprods == 0.0 or sqi == 0.0 or sqj == 0.0:
-                        cosine = 0.0
+                        sim = 0.0
+                    elif metric == COSINE:
+                        sim = sprods / (sqi * sqj)
                     else:
-                        cosine = sprods / (sqi * sqj)
-                    res_data[res_index] = cosine
-                    res_indices[res_index] = x2
-                    res_index += 1
-            res_indptr[x1 + 1] = res_index
+                        sim = sprods / (cpow(sqi, 2.0 * alpha)
+                                        * cpow(sqj, 2.0 - 2.0 * alpha))
+                if use_topk:
+                    # zeros are dropped like in `sim + sim.T`
+                    if sim != 0.0:
+                        heap_push(&topk_data[x1, 0], &topk_indices[x1, 0],
+                                  topk, sim, <int> x2)
+                else:
+                    chunk_indices[chunk].push_back(<int> x2)
+                    chunk_data[chunk].push_back(sim)
+                    row_counts[x1] += 1
+            if use_topk:
+                heap_sort(&topk_data[x1, 0], &topk_indices[x1, 0], topk)
 
         free(prods)
         free(freq)
+        free(touched)
+
+
+cdef invert_sim(const int[:] x_indices, const int[:] x_indptr,
+                const float[:] x_data, const int[:] y_indices,
+                const int[:] y_indptr, const float[:] y_data,
+                const float[:] x_center, const float[:] y_center,
+                const float[:] x_weight, const float[:] y_weight,
+                const float[:] x_norm, const int[:] x_count, int metric,
+                float alpha, int min_common, int n_x, int chunk_size,
+                int num_threads, int topk):
+    cdef vector[vector[int]] chunk_indices
+    cdef vector[vector[float]] chunk_data
+    cdef Py_ssize_t c, offset = 0
+    cdef size_t n
+    chunk_size = max(1, chunk_size)
+    # unused vectors are passed as empty arrays
+    empty_float = np.zeros(0, dtype=np.single)
+    if x_center is None:
+        x_center = empty_float
+    if y_center is None:
+        y_center = empty_float
+    if x_weight is None:
+        x_weight = empty_float
+    if y_weight is None:
+        y_weight = empty_float
+    if x_norm is None:
+        x_norm = empty_float
+    if x_count is None:
+        x_count = np.zeros(0, dtype=np.intc)
+    row_counts = np.zeros(n_x, dtype=np.int64)
+    if topk > 0:
+        topk = min(topk, n_x)
+        topk_data = np.full((n_x, topk), -np.inf, dtype=np.single)
+        topk_indices = np.full((n_x, topk), -1, dtype=np.intc)
+    else:
+        n_chunks = (n_x + chunk_size - 1) // chunk_size
+        chunk_indices.resize(n_chunks)
+        chunk_data.resize(n_chunks)
+        topk_data = np.zeros((0, 1), dtype=np.single)
+        topk_indices = np.zeros((0, 1), dtype=np.intc)
+
+    compute_invert(x_indices, x_indptr, x_data, y_indices, y_indptr, y_data,
+                   x_center, y_center, x_weight, y_weight, x_norm, x_count,
+                   metric, alpha, min_common, n_x, chunk_size, num_threads,
+                   chunk_indices, chunk_data, row_counts, topk_data,
+                   topk_indices)
+
+    if topk > 0:
+        # every row is sorted by similarity, with padding at the end
+        valid = topk_indices >= 0
+        row_counts = np.count_nonzero(valid, axis=1)
+        res_indices, res_data = topk_indices[valid], topk_data[valid]
+    else:
+        # chunks hold consecutive rows, so concatenation is in row order
+        res_indices = np.empty(row_counts.sum(), dtype=np.intc)
+        res_data = np.empty(row_counts.sum(), dtype=np.single)
+        for c in range(chunk_indices.size()):
+            n = chunk_indices[c].size()
+            if n > 0:
+                res_indices[offset: offset + n] = (
+                    <int[:n]> chunk_indices[c].data())
+                res_data[offset: offset + n] = (
+                    <float[:n]> chunk_data[c].data())
+            offset += n
+    res_indptr = np.zeros(n_x + 1, dtype=np.int64)
+    np.cumsum(row_counts, out=res_indptr[1:])
+    return res_indices, res_indptr, res_data
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
-@cython.cdivision(True)
 cpdef invert_cosine(
-    const int[:] indices, 
-    const int[:] indptr, 
-    const float[:] data, 
-    const float[:] x_norm, 
-    int min_common, 
-    int n_x, 
-    int n_y, 
-    int block_size, 
-    int block_num, 
-    int num_threads=1
+    const int[:] x_indices,
+    const int[:] x_indptr,
+    const float[:] x_data,
+    const int[:] y_indices,
+    const int[:] y_indptr,
+    const float[:] y_data,
+    const float[:] x_norm,
+    int min_common,
+    int n_x,
+    int chunk_size=256,
+    int num_threads=1,
+    int topk=0
 ):
-
-    cdef Py_ssize_t res_count = count_freq(indices, indptr, min_common, 
-                                           n_x, n_y, block_size, block_num, 
-                                           num_threads)
-
-    cdef float[:] res_data = np.zeros(res_count, dtype=np.single)
-    cdef uint[:] res_indices = np.zeros(res_count, dtype=np.uintc)
-    cdef uint[:] res_indptr = np.zeros(n_x + 1, dtype=np.uintc)
-#    res_indptr[0] = 0
-
-    compute_cosine(indices, indptr, data, x_norm, min_common, n_x, n_y, 
-        block_size, block_num, num_threads, res_data, res_indices, res_indptr)
-
-    return np.asarray(res_indices), np.asarray(res_indptr), np.asarray(res_data)
-
-
-@cython.boundscheck(False)
-@cython.wraparound(False)
-@cython.cdivision(True)
-cdef void compute_pearson(
-    const int[:] indices, 
-    const int[:] indptr, 
-    const float[:] data, 
-    const float[:] x_mean, 
-    const float[:] x_mean_centered_norm, 
-    int min_common, 
-    int n_x, 
-    int n_y, 
-    int block_size, 
-    int block_num, 
-    int n_threads, 
-    float[:] res_data, 
-    uint[:] res_indices, 
-    uint[:] res_indptr
-) nogil:
-
-    cdef: 
-        Py_ssize_t x_start, x_end, p, x1, x2, i, j, index
-        Py_ssize_t block_index, block_start, block_end, scount
-        Py_ssize_t res_index = 0
-    cdef float sprods, smeani, smeanj, sqi, sqj, pearson
-
-    cdef float *prods
-    cdef uint *freq
-
-    for block_index in range(block_num):
-        prods = <float *> malloc(sizeof(float) * n_x * block_size)
-        freq = <uint *> malloc(sizeof(uint) * n_x * block_size)
-        memset(prods, 0, sizeof(float) * n_x * block_size)
-        memset(freq, 0, sizeof(uint) * n_x * block_size)
-
-        block_start = block_index * block_size
-        block_end = (
-            n_x if n_x < block_start + block_size 
-                else block_start + block_size
-        )
-
-        for p in range(n_y):
-            x_start = indptr[p]
-            x_end = indptr[p + 1]
-            for i in range(x_start, x_end):
-                x1 = indices[i]
-                if x1 >= block_start and x1 < block_end:
-                    for j in range(i + 1, x_end):
-                        x2 = indices[j]
-                        index = (x1 - block_start) * n_x + x2
-                        smeani = data[i] - x_mean[x1]
-                        smeanj = data[j] - x_mean[x2]
-                        prods[index] += (smeani * smeanj)
-                        freq[index] += 1
-
-        for x1 in range(block_start, block_end):
-            for x2 in range(x1 + 1, n_x):
-                index = (x1 - block_start) * n_x + x2
-                scount = freq[index]
-                if scount >= min_common:
-                    sprods = prods[index]
-                    sqi = x_mean_centered_norm[x1]
-                    sqj = x_mean_centered_norm[x2]
-                    if sprods == 0.0 or sqi == 0.0 or sqj == 0.0:
-                        pearson = 0.0
-                    else:
-                        pearson = sprods / (sqi * sqj)
-                    res_data[res_index] = pearson
-                    res_indices[res_index] = x2
-                    res_index += 1
-            res_indptr[x1 + 1] = res_index
-
-        free(prods)
-        free(freq)
+    return invert_sim(x_indices, x_indptr, x_data, y_indices, y_indptr,
+                      y_data, None, None, None, None, x_norm, None, COSINE,
+                      0.5, min_common, n_x, chunk_size, num_threads, topk)
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
-@cython.cdivision(True)
 cpdef invert_pearson(
-    const int[:] indices, 
-    const int[:] indptr, 
-    const float[:] data, 
-    const float[:] x_mean, 
-    const float[:] x_mean_centered_norm, 
-    int min_common, 
-    int n_x, 
-    int n_y, 
-    int block_size, 
-    int block_num, 
-    int num_threads=1
+    const int[:] x_indices,
+    const int[:] x_indptr,
+    const float[:] x_data,
+    const int[:] y_indices,
+    const int[:] y_indptr,
+    const float[:] y_data,
+    const float[:] x_mean,
+    const float[:] x_mean_centered_norm,
+    int min_common,
+    int n_x,
+    int chunk_size=256,
+    int num_threads=1,
+    int topk=0
 ):
-
-    cdef Py_ssize_t res_count = count_freq(
-        indices, indptr, min_common, n_x, n_y, block_size, block_num, num_threads)
-
-    cdef float[:] res_data = np.zeros(res_count, dtype=np.single)
-    cdef uint[:] res_indices = np.zeros(res_count, dtype=np.uintc)
-    cdef uint[:] res_indptr = np.zeros(n_x + 1, dtype=np.uintc)
-#    res_indptr[0] = 0
-
-    compute_pearson(indices, indptr, data, x_mean, x_mean_centered_norm, min_common, 
-        n_x, n_y, block_size, block_num, num_threads, res_data, res_indices, res_indptr)
-
-    return np.asarray(res_indices), np.asarray(res_indptr), np.asarray(res_data)
+    # cosine of rows centered by their means
+    return invert_sim(x_indices, x_indptr, x_data, y_indices, y_indptr,
+                      y_data, x_mean, None, None, None, x_mean_centered_norm,
+                      None, COSINE, 0.5, min_common, n_x, chunk_size,
+                      num_threads, topk)
+
+
+cpdef invert_jaccard(
+    const int[:] x_indices,
+    const int[:] x_indptr,
+    const float[:] x_data,
+    const int[:] y_indices,
+    const int[:] y_indptr,
+    const float[:] y_data,
+    const int[:] x_count,
+    int min_common,
+    int n_x,
+    int chunk_size=256,
+    int num_threads=1,
+    int topk=0
+):
+    return invert_sim(x_indices, x_indptr, x_data, y_indices, y_indptr,
+                      y_data, None, None, None, None, None, x_count, JACCARD,
+                      0.5, min_common, n_x, chunk_size, num_threads, topk)
+
+
+cpdef invert_weighted(
+    const int[:] x_indices,
+    const int[:] x_indptr,
+    const float[:] x_data,
+    const int[:] y_indices,
+    const int[:] y_indptr,
+    const float[:] y_data,
+    const float[:] y_center,
+    const float[:] x_weight,
+    const float[:] y_weight,
+    const float[:] x_norm,
+    str normalization,
+    float alpha,
+    int min_common,
+    int n_x,
+    int chunk_size=256,
+    int num_threads=1,
+    int topk=0
+):
+    # values are centered by y_center, then weighted by x_weight and
+    # y_weight, any of which can be None. x_norm is the norm of weighted
+    # rows, normalization is one of "cosine", "asymmetric" and "none"
+    if normalization == "cosine":
+        metric = COSINE
+    elif normalization == "asymmetric":
+        metric = ASYMMETRIC
+    elif normalization == "none":
+        metric = DOT
+    else:
+        raise ValueError("normalization must be one of "
+                         "('cosine', 'asymmetric', 'none')")
+    return invert_sim(x_indices, x_indptr, x_data, y_indices, y_indptr,
+                      y_data, None, y_center, x_weight, y_weight, x_norm,
+                      None, metric, alpha, min_common, n_x, chunk_size,
+                      num_threads, topk)
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-@cython.cdivision(True)
-cdef void compute_jaccard(
-    const int[:] indices, 
-    const int[:] indptr, 
-    const float[:] data, 
-    const int[:] x_count, 
-    int min_common, 
-    int n_x, 
-    int n_y, 
-    int block_size, 
-    int block_num, 
-    int n_threads, 
-    float[:] res_data, 
-    uint[:] res_indices, 
-    uint[:] res_indptr
-) nogil:
-
-    cdef: 
-        Py_ssize_t x_start, x_end, p, x1, x2, i, j, index
-        Py_ssize_t block_index, block_start, block_end, scount
-        Py_ssize_t res_index = 0
-    cdef float jaccard, intersection, union
-    cdef uint *freq
-
-    for block_index in range(block_num):
-        freq = <uint *> malloc(sizeof(uint) * n_x * block_size)
-        memset(freq, 0, sizeof(uint) * n_x * block_size)
-
-        block_start = block_index * block_size
-        block_end = (
-            n_x if n_x < block_start + block_size 
-                else block_start + block_size
-        )
-
-        for p in range(n_y):
-            x_start = indptr[p]
-            x_end = indptr[p + 1]
-            for i in range(x_start, x_end):
-                x1 = indices[i]
-                if x1 >= block_start and x1 < block_end:
-                    for j in range(i + 1, x_end):
-                        x2 = indices[j]
-                        index = (x1 - block_start) * n_x + x2
-                        freq[index] += 1
-
-        for x1 in range(block_start, block_end):
-            for x2 in range(x1 + 1, n_x):
-                index = (x1 - block_start) * n_x + x2
-                intersection = freq[index]
-                if intersection >= min_common:
-                    union = x_count[x1] + x_count[x2] - intersection
-                    jaccard = intersection / union
-                    res_data[res_index] = jaccard
-                    res_indices[res_index] = x2
-                    res_index += 1
-            res_indptr[x1 + 1] = res_index
+cpdef pair_products(const int[::1] indices, const int[::1] indptr,
+                    const float[::1] data, const np.int64_t[::1] x1,
+                    const np.int64_t[::1] x2, int num_threads):
+    # dot products of row pairs (x1[p], x2[p]) by merging their sorted
+    # indices, e.g. to compute exact similarities of LSH candidates
+    cdef Py_ssize_t p, i, j, end1, end2, n_pairs = x1.shape[0]
+    cdef int y1, y2
+    cdef float prods
+    products = np.zeros(n_pairs, dtype=np.single)
+    cdef float[::1] products_view = products
 
-        free(freq)
+    with nogil:
+        for p in prange(n_pairs, num_threads=num_threads,
+                        schedule="static"):
+            i = indptr[x1[p]]
+            j = indptr[x2[p]]
+            end1 = indptr[x1[p] + 1]
+            end2 = indptr[x2[p] + 1]
+            prods = 0.0
+            while i < end1 and j < end2:
+                y1 = indices[i]
+                y2 = indices[j]
+                # branchless merge
+                if y1 == y2:
+                    prods = prods + data[i] * data[j]
+                i = i + (y1 <= y2)
+                j = j + (y2 <= y1)
+            products_view[p] = prods
+    return products
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-@cython.cdivision(True)
-cpdef invert_jaccard(const int[:] indices, const int[:] indptr, const float[:] data, 
-                    const int[:] x_count, int min_common, int n_x, int n_y, 
-                    int block_size, int block_num, int num_threads=1):
-
-    cdef Py_ssize_t res_count = count_freq(
-        indices, indptr, min_common, n_x, n_y, block_size, block_num, num_threads)
+cdef inline void push_unique(float *scores, int *ids, int k, float score,
+                             int idx) noexcept nogil:
+    # a pair may come up again in later blocks of LSH candidates
+    cdef int t
+    if score <= scores[0]:
+        return
+    for t in range(k):
+        if ids[t] == idx:
+            return
+    heap_push(scores, ids, k, score, idx)
 
-    cdef float[:] res_data = np.zeros(res_count, dtype=np.single)
-    cdef uint[:] res_indices = np.zeros(res_count, dtype=np.uintc)
-    cdef uint[:] res_indptr = np.zeros(n_x + 1, dtype=np.uintc)
-#    res_indptr[0] = 0
 
-    compute_jaccard(indices, indptr, data, x_count, min_common, n_x, n_y, 
-        block_size, block_num, num_threads, res_data, res_indices, res_indptr)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef push_topk_pairs(const np.int64_t[::1] x1, const np.int64_t[::1] x2,
+                      const float[::1] sims, float[:, ::1] topk_data,
+                      int[:, ::1] topk_indices):
+    # push symmetric pairs into bounded heaps of both rows, positive
+    # similarities only
+    cdef Py_ssize_t p, n_pairs = x1.shape[0]
+    cdef int topk = topk_data.shape[1]
 
-    return np.asarray(res_indices), np.asarray(res_indptr), np.asarray(res_data)
+    with nogil:
+        for p in range(n_pairs):
+            if sims[p] > 0.0:
+                push_unique(&topk_data[x1[p], 0], &topk_indices[x1[p], 0],
+                            topk, sims[p], <int> x2[p])
+                push_unique(&topk_data[x2[p], 0], &topk_indices[x2[p], 0],
+                            topk, sims[p], <int> x1[p])
 
 
 @cython.boundscheck(False)
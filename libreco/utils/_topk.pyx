@@ -0,0 +1,158 @@
+#cython: language_level=3
+import numpy as np
+cimport numpy as np
+cimport cython
+cimport openmp
+from cython.parallel import parallel, prange
+from libc.math cimport INFINITY
+from libc.stdlib cimport malloc, free
+from libcpp.algorithm cimport lower_bound
+from ._heap cimport heap_push, heap_sort
+
+cimport scipy.linalg.cython_blas as cython_blas
+
+
+cdef inline void gemm(char *transa, char *transb, int *m, int *n, int *k,
+                      float *alpha, float *a, int *lda, float *b, int *ldb,
+                      float *beta, float *c, int *ldc) noexcept nogil:
+    cython_blas.sgemm(transa, transb, m, n, k, alpha, a, lda, b, ldb,
+                      beta, c, ldc)
+
+
+def topk_dot(queries, items, k, item_bias=None, exclude_indptr=None,
+             exclude_indices=None, num_threads=1, query_block=64,
+             item_block=1024):
+    """Exact top `k` items of `queries @ items.T + item_bias` for every
+    query.
+
+    Items are split into blocks of `item_block`, which are distributed
+    over `num_threads` threads. For every block of `query_block` queries,
+    a thread scores its item blocks with one GEMM each, and pushes scores
+    into bounded heaps of its own, which are merged at the end. Excluded
+    items of every query are given as CSR `exclude_indptr` and
+    `exclude_indices`, whose indices must be sorted within each row. The
+    GIL is released during computation.
+
+    Returns
+    -------
+    indices : numpy.ndarray of shape (n_queries, k)
+        Padded with -1 if a query has fewer than `k` items left.
+    scores : numpy.ndarray of shape (n_queries, k)
+        Padded with -inf.
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    items = np.ascontiguousarray(items, dtype=np.float32)
+    n_queries, n_items = len(queries), len(items)
+    k = min(k, n_items)
+    indices = np.full((n_queries, k), -1, dtype=np.int32)
+    scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+    if k <= 0 or n_queries == 0:
+        return indices.astype(np.int64), scores
+
+    has_bias = item_bias is not None
+    bias = (np.ascontiguousarray(item_bias, dtype=np.float32) if has_bias
+            else np.zeros(1, dtype=np.float32))
+    has_exclude = exclude_indptr is not None
+    if has_exclude:
+        exclude_indptr = np.ascontiguousarray(exclude_indptr, dtype=np.int64)
+        exclude_indices = np.ascontiguousarray(exclude_indices,
+                                               dtype=np.int64)
+    else:
+        exclude_indptr = np.zeros(n_queries + 1, dtype=np.int64)
+        exclude_indices = np.zeros(0, dtype=np.int64)
+    # one more element so that taking the address is always valid
+    exclude_indices = np.append(exclude_indices, n_items)
+
+    num_threads = max(1, num_threads)
+    query_block = max(1, min(query_block, n_queries))
+    item_block = max(1, min(item_block, n_items))
+    heap_scores = np.empty((num_threads, query_block, k), dtype=np.float32)
+    heap_indices = np.empty((num_threads, query_block, k), dtype=np.int32)
+    _topk_dot(queries, items, bias, has_bias, exclude_indptr,
+              exclude_indices, has_exclude, indices, scores, heap_scores,
+              heap_indices, num_threads, query_block, item_block)
+    return indices.astype(np.int64), scores
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _topk_dot(const float[:, ::1] queries,
+                    const float[:, ::1] items,
+                    const float[::1] bias,
+                    bint has_bias,
+                    const np.int64_t[::1] exclude_indptr,
+                    const np.int64_t[::1] exclude_indices,
+                    bint has_exclude,
+                    int[:, ::1] out_indices,
+                    float[:, ::1] out_scores,
+                    float[:, :, ::1] heap_scores,
+                    int[:, :, ::1] heap_indices,
+                    int num_threads,
+                    int query_block,
+                    int item_block) noexcept nogil:
+    cdef int n_queries = queries.shape[0], dim = queries.shape[1]
+    cdef int n_items = items.shape[0], k = out_scores.shape[1]
+    cdef int n_blocks = (n_items + item_block - 1) // item_block
+    cdef int n_query_blocks = (n_queries + query_block - 1) // query_block
+    cdef int qb, q_start, n_q, b, i_start, n_i, q, t, j, tid
+    cdef long e
+    cdef const np.int64_t *excluded
+    cdef float alpha = 1.0, beta = 0.0
+    cdef float *buf
+    cdef char trans = b"T", no_trans = b"N"
+
+    for qb in range(n_query_blocks):
+        q_start = qb * query_block
+        n_q = min(query_block, n_queries - q_start)
+        for t in range(num_threads):
+            for q in range(n_q):
+                for j in range(k):
+                    heap_scores[t, q, j] = -INFINITY
+                    heap_indices[t, q, j] = -1
+
+        with parallel(num_threads=num_threads):
+            tid = openmp.omp_get_thread_num()
+            buf = <float *> malloc(sizeof(float) * query_block * item_block)
+            try:
+                for b in prange(n_blocks, schedule="static"):
+                    i_start = b * item_block
+                    n_i = min(item_block, n_items - i_start)
+                    # column-major (n_i, n_q) result, i.e. row-major
+                    # (n_q, n_i), one row of item scores for every query
+                    gemm(&trans, &no_trans, &n_i, &n_q, &dim, &alpha,
+                         <float *> &items[i_start, 0], &dim,
+                         <float *> &queries[q_start, 0], &dim, &beta,
+                         buf, &n_i)
+                    for q in range(n_q):
+                        if has_bias:
+                            for j in range(n_i):
+                                buf[q * n_i + j] += bias[i_start + j]
+                        if has_exclude:
+                            excluded = lower_bound(
+                                &exclude_indices[exclude_indptr[q_start + q]],
+                                &exclude_indices[exclude_indptr[q_start + q + 1]],
+                                <np.int64_t> i_start)
+                            e = excluded - &exclude_indices[0]
+                            while (e < exclude_indptr[q_start + q + 1]
+                                   and exclude_indices[e] < i_start + n_i):
+                                buf[q * n_i + exclude_indices[e] - i_start] = (
+                                    -INFINITY)
+                                e = e + 1
+                        for j in range(n_i):
+                            heap_push(&heap_scores[tid, q, 0],
+                                      &heap_indices[tid, q, 0], k,
+                                      buf[q * n_i + j], i_start + j)
+            finally:
+                free(buf)
+
+        # merge heaps of all threads into the first one
+        for q in prange(n_q, num_threads=num_threads, schedule="static"):
+            for t in range(1, num_threads):
+                for j in range(k):
+                    heap_push(&heap_scores[0, q, 0], &heap_indices[0, q, 0],
+                              k, heap_scores[t, q, j], heap_indices[t, q, j])
+            heap_sort(&heap_scores[0, q, 0], &heap_indices[0, q, 0], k)
+            for j in range(k):
+                out_scores[q_start + q, j] = heap_scores[0, q, j]
+                out_indices[q_start + q, j] = heap_indices[0, q, j]
@@ -0,0 +1,372 @@
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+from .topk import top_k
+from ..data.storage import save_arrays, load_arrays, load_metadata
+
+_METADATA_NAME = "ann_index.json"
+_FAISS_INDEX_NAME = "faiss.index"
+
+
+class IVFIndex(object):
+    """Inverted file index for approximate maximum inner product search
+    over item vectors.
+
+    Items are clustered by k-means into `n_lists` lists. A query only
+    scores the items in the `n_probe` lists whose centroids have the
+    largest inner products with it, so `n_probe` trades recall for
+    latency, and `n_probe = n_lists` is exact search. Items of every list
+    are stored contiguously, so scoring a list for all the queries that
+    probe it is one matrix multiplication.
+
+    Item bias is supported by appending it to item vectors, and a constant
+    1 to query vectors. With `mips_transform`, which is the default, item
+    vectors are also norm-augmented by `mips_augment_items`, so that
+    inner products of any scale, e.g. embeddings with biases, are ranked
+    by L2 distance, which is what k-means clustering and probing optimize.
+    Candidates are always scored by exact inner products.
+
+    Parameters
+    ----------
+    n_lists : int, optional
+        Number of lists, default is about `sqrt(n_items)`.
+    n_probe : int, optional
+        Default number of lists searched for every query.
+    backend : {"numpy", "faiss"}, optional
+        Use faiss `IndexIVFFlat` if "faiss", which must be installed.
+    n_iter : int, optional
+        Number of k-means iterations.
+    seed : int, optional
+        Random seed of k-means.
+    mips_transform : bool, optional
+        Whether to reduce inner product search to L2 nearest neighbor
+        search by norm augmentation, see `mips_augment_items`.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, backend="numpy", n_iter=10,
+                 seed=42, mips_transform=True):
+        if backend not in ("numpy", "faiss"):
+            raise ValueError("backend must either be 'numpy' or 'faiss'")
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.backend = backend
+        self.n_iter = n_iter
+        self.seed = seed
+        self.mips_transform = mips_transform
+        self.n_items = 0
+        self.has_bias = False
+        self.max_norm = None
+        self.centroids = None
+        self.list_indptr = None
+        self.list_items = None
+        self.list_vectors = None
+        self.faiss_index = None
+        self._item_offsets = None
+
+    def build(self, item_vecs, item_bias=None):
+        """Cluster and store item vectors.
+
+        Parameters
+        ----------
+        item_vecs : numpy.ndarray of shape (n_items, dim)
+        item_bias : numpy.ndarray of shape (n_items,), optional
+
+        Returns
+        -------
+        self : `IVFIndex` object
+        """
+        if self.mips_transform:
+            vectors, self.max_norm = mips_augment_items(item_vecs, item_bias)
+        else:
+            vectors = _augment_items(item_vecs, item_bias)
+        self.has_bias = item_bias is not None
+        self.n_items = len(vectors)
+        if self.n_lists is None:
+            self.n_lists = max(1, int(np.sqrt(self.n_items)))
+        self.n_lists = min(self.n_lists, max(self.n_items, 1))
+
+        if self.backend == "faiss":
+            self._build_faiss(vectors)
+            return self
+
+        self.centroids = _kmeans(vectors, self.n_lists, self.n_iter,
+                                 self.seed)
+        assignments = _nearest_centroids(vectors, self.centroids)
+        self.list_items = np.argsort(assignments, kind="stable")
+        self.list_vectors = np.ascontiguousarray(vectors[self.list_items])
+        self.list_indptr = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=self.n_lists),
+                  out=self.list_indptr[1:])
+        return self
+
+    def _build_faiss(self, vectors):
+        faiss = _import_faiss()
+        dim = vectors.shape[1]
+        if self.mips_transform:
+            quantizer = faiss.IndexFlatL2(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, self.n_lists,
+                                       faiss.METRIC_L2)
+        else:
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, self.n_lists,
+                                       faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        self.faiss_index = index
+
+    def search(self, queries, k, n_probe=None, exclude=None):
+        """Approximate top `k` items of `queries @ item_vecs.T + item_bias`.
+
+        Parameters
+        ----------
+        queries : numpy.ndarray of shape (n_queries, dim)
+        k : int
+        n_probe : int, optional
+            Number of lists searched for every query, default is
+            `self.n_probe`.
+        exclude : tuple of (positions, items), optional
+            Excluded items, `items[j]` is excluded for query `positions[j]`,
+            e.g. the result of `ConsumedIndex.gather`.
+
+        Returns
+        -------
+        indices : numpy.ndarray of shape (n_queries, k)
+            Padded with -1 if fewer than `k` items are found.
+        scores : numpy.ndarray of shape (n_queries, k)
+            Padded with -inf.
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        if self.mips_transform:
+            queries = mips_augment_queries(queries, self.has_bias)
+        else:
+            queries = _augment_queries(queries, self.has_bias)
+        k = min(k, self.n_items)
+        if self.faiss_index is not None:
+            return self._search_faiss(queries, k, n_probe, exclude)
+
+        n_queries = len(queries)
+        # lists probed by every query, in descending order of centroid score
+        centroid_scores = queries @ self.centroids.T
+        if self.mips_transform:
+            # negative squared L2 distance without the norm of queries
+            centroid_scores = (2 * centroid_scores
+                               - np.sum(self.centroids ** 2, axis=1))
+        probes, _ = top_k(centroid_scores, n_probe)
+        # candidates of a query are the top k of every probed list
+        cand_items = np.full((n_queries, n_probe * k), -1, dtype=np.int64)
+        cand_scores = np.full((n_queries, n_probe * k), -np.inf,
+                              dtype=np.float32)
+        if exclude is not None:
+            excluded_lists, excluded_rows, excluded_cols = (
+                self._group_excluded(exclude))
+
+        probe_queries = np.argsort(probes, axis=None, kind="stable")
+        probe_lists = probes.ravel()[probe_queries]
+        bounds = np.searchsorted(probe_lists, np.arange(self.n_lists + 1))
+        row_in_list = np.full(n_queries, -1, dtype=np.int64)
+        for lst in np.unique(probe_lists):
+            start, end = self.list_indptr[lst], self.list_indptr[lst + 1]
+            if start == end:
+                continue
+            flat = probe_queries[bounds[lst]: bounds[lst + 1]]
+            qs, slots = np.divmod(flat, n_probe)
+            scores = queries[qs] @ self.list_vectors[start: end].T
+            if exclude is not None:
+                lo, hi = np.searchsorted(excluded_lists, [lst, lst + 1])
+                row_in_list[qs] = np.arange(len(qs))
+                rows = row_in_list[excluded_rows[lo: hi]]
+                mask = rows >= 0
+                scores[rows[mask], excluded_cols[lo: hi][mask] - start] = (
+                    -np.inf)
+                row_in_list[qs] = -1
+
+            ids, top_scores = top_k(scores, k)
+            width = ids.shape[1]
+            cols = slots[:, np.newaxis] * k + np.arange(width)
+            cand_items[qs[:, np.newaxis], cols] = self.list_items[start + ids]
+            cand_scores[qs[:, np.newaxis], cols] = top_scores
+
+        ids, scores = top_k(cand_scores, k)
+        indices = np.take_along_axis(cand_items, ids, axis=1)
+        indices[np.isneginf(scores)] = -1
+        return indices, scores
+
+    def _group_excluded(self, exclude):
+        positions, items = exclude
+        if self._item_offsets is None:
+            # position of every item in the list layout
+            self._item_offsets = np.empty(self.n_items, dtype=np.int64)
+            self._item_offsets[self.list_items] = np.arange(self.n_items)
+        offsets = self._item_offsets[items]
+        lists = np.searchsorted(self.list_indptr, offsets, side="right") - 1
+        order = np.argsort(lists, kind="stable")
+        return lists[order], positions[order], offsets[order]
+
+    def _search_faiss(self, queries, k, n_probe, exclude):
+        self.faiss_index.nprobe = n_probe
+        if exclude is None:
+            scores, indices = self.faiss_index.search(queries, k)
+            scores = self._faiss_scores(queries, scores)
+        else:
+            # faiss can't exclude items, so search more and filter out
+            positions, items = exclude
+            max_excluded = (np.bincount(positions).max()
+                            if len(positions) > 0 else 0)
+            n_search = min(k + int(max_excluded), self.n_items)
+            scores, indices = self.faiss_index.search(queries, n_search)
+            scores = self._faiss_scores(queries, scores)
+            rows = np.repeat(np.arange(len(queries)), n_search)
+            excluded = (indices.ravel() >= 0) & np.isin(
+                rows * self.n_items + indices.ravel(),
+                positions * self.n_items + items)
+            scores[excluded.reshape(scores.shape)] = -np.inf
+            ids, scores = top_k(scores, k)
+            indices = np.take_along_axis(indices, ids, axis=1)
+        scores = scores.astype(np.float32)
+        invalid = (indices < 0) | np.isneginf(scores)
+        indices = indices.astype(np.int64)
+        indices[invalid] = -1
+        scores[invalid] = -np.inf
+        return indices, scores
+
+    def _faiss_scores(self, queries, scores):
+        if not self.mips_transform:
+            return scores
+        # all augmented items have norm `max_norm`, and the last dimension
+        # of queries is 0, so distance = |q|^2 + max_norm^2 - 2 * q.x
+        query_norms = np.sum(queries ** 2, axis=1, keepdims=True)
+        return (query_norms + self.max_norm ** 2 - scores) / 2
+
+    def save(self, path):
+        """Save to directory `path`, which can be loaded by
+        `IVFIndex.load`. A faiss index is saved by `faiss.write_index`."""
+        metadata = {"n_lists": self.n_lists, "n_probe": self.n_probe,
+                    "backend": self.backend, "n_iter": self.n_iter,
+                    "seed": self.seed, "n_items": self.n_items,
+                    "has_bias": self.has_bias,
+                    "mips_transform": self.mips_transform,
+                    "max_norm": self.max_norm}
+        arrays = {"centroids": self.centroids,
+                  "list_indptr": self.list_indptr,
+                  "list_items": self.list_items,
+                  "list_vectors": self.list_vectors}
+        save_arrays(path, arrays, metadata, _METADATA_NAME)
+        if self.faiss_index is not None:
+            faiss = _import_faiss()
+            faiss.write_index(self.faiss_index,
+                              os.path.join(path, _FAISS_INDEX_NAME))
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Load index saved by `IVFIndex.save`, arrays are memory-mapped
+        by default."""
+        metadata = load_metadata(path, _METADATA_NAME)
+        arrays = load_arrays(path, metadata["arrays"], mmap_mode)
+        index = cls(metadata["n_lists"], metadata["n_probe"],
+                    metadata["backend"], metadata["n_iter"], metadata["seed"],
+                    metadata["mips_transform"])
+        index.n_items = metadata["n_items"]
+        index.has_bias = metadata["has_bias"]
+        index.max_norm = metadata["max_norm"]
+        index.centroids = arrays.get("centroids")
+        index.list_indptr = arrays.get("list_indptr")
+        index.list_items = arrays.get("list_items")
+        index.list_vectors = arrays.get("list_vectors")
+        if metadata["backend"] == "faiss":
+            faiss = _import_faiss()
+            index.faiss_index = faiss.read_index(
+                os.path.join(path, _FAISS_INDEX_NAME))
+        return index
+
+
+def _import_faiss():
+    try:
+        import faiss
+    except ImportError:
+        raise ImportError("faiss is required for backend 'faiss'")
+    return faiss
+
+
+def mips_augment_items(item_vecs, item_bias=None):
+    """Norm augmentation that reduces maximum inner product search to
+    L2 nearest neighbor search.
+
+    Item bias is appended to item vectors first, then every vector `x` is
+    augmented with `sqrt(M^2 - |x|^2)`, where `M` is the max norm, so all
+    augmented vectors have norm `M`. With queries augmented by
+    `mips_augment_queries`, `|q - x|^2 = |q|^2 + M^2 - 2 * q.x`, hence the
+    nearest items of any L2 index are exactly the items of largest inner
+    products, including bias.
+
+    Parameters
+    ----------
+    item_vecs : numpy.ndarray of shape (n_items, dim)
+    item_bias : numpy.ndarray of shape (n_items,), optional
+
+    Returns
+    -------
+    vectors : numpy.ndarray of shape (n_items, dim + 1), or
+        (n_items, dim + 2) with bias
+    max_norm : float
+    """
+    vectors = _augment_items(item_vecs, item_bias)
+    norms = np.sum(vectors.astype(np.float64) ** 2, axis=1)
+    max_norm = float(np.sqrt(norms.max())) if len(norms) > 0 else 0.0
+    extra = np.sqrt(np.maximum(max_norm ** 2 - norms, 0.0))
+    vectors = np.hstack([vectors, extra.astype(np.float32)[:, np.newaxis]])
+    return vectors, max_norm
+
+
+def mips_augment_queries(queries, has_bias=False):
+    """Augment queries to match `mips_augment_items`, i.e. append a
+    constant 1 if items have bias, then a 0."""
+    queries = _augment_queries(queries, has_bias)
+    return np.hstack([queries, np.zeros((len(queries), 1), dtype=np.float32)])
+
+
+def _augment_items(item_vecs, item_bias):
+    item_vecs = np.asarray(item_vecs, dtype=np.float32)
+    if item_bias is None:
+        return np.ascontiguousarray(item_vecs)
+    return np.hstack([item_vecs, np.asarray(item_bias, dtype=np.float32)
+                      .reshape(-1, 1)])
+
+
+def _augment_queries(queries, has_bias):
+    queries = np.asarray(queries, dtype=np.float32)
+    if not has_bias:
+        return np.ascontiguousarray(queries)
+    return np.hstack([queries, np.ones((len(queries), 1), dtype=np.float32)])
+
+
+def _nearest_centroids(vectors, centroids, block_size=65536):
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    centroid_norms = np.sum(centroids ** 2, axis=1)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start: start + block_size]
+        # squared distance without the constant norm of vectors
+        distances = centroid_norms - 2 * block @ centroids.T
+        assignments[start: start + block_size] = np.argmin(distances, axis=1)
+    return assignments
+
+
+def _kmeans(vectors, n_clusters, n_iter, seed, max_samples_per_cluster=256):
+    rng = np.random.default_rng(seed)
+    n_samples = min(len(vectors), n_clusters * max_samples_per_cluster)
+    samples = vectors[rng.choice(len(vectors), n_samples, replace=False)]
+    centroids = samples[rng.choice(n_samples, n_clusters, replace=False)]
+    for _ in range(n_iter):
+        assignments = _nearest_centroids(samples, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        membership = csr_matrix(
+            (np.ones(n_samples, dtype=np.float32),
+             (assignments, np.arange(n_samples))),
+            shape=(n_clusters, n_samples))
+        sums = membership @ samples
+        empty = counts == 0
+        centroids = np.where(empty[:, np.newaxis], centroids,
+                             sums / np.maximum(counts, 1)[:, np.newaxis])
+        if np.any(empty):
+            # restart empty clusters from random samples
+            centroids[empty] = samples[rng.choice(n_samples, empty.sum())]
+    return centroids.astype(np.float32)
@@ -0,0 +1,92 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def interactions_to_csr(item_ids, weights=None, n_items=None):
+    """Convert interacted items of one or many users to a csr_matrix.
+
+    Parameters
+    ----------
+    item_ids : array_like or list of array_like
+        Item indices of one user, or a list of them for a batch of users.
+    weights : array_like or list of array_like, optional
+        Weight of every item, e.g. ratings or counts, default is 1.0.
+    n_items : int
+        Number of items, unknown items are dropped.
+
+    Returns
+    -------
+    interaction : `scipy.sparse.csr_matrix` of shape (n_users, n_items)
+    is_batch : bool
+        Whether `item_ids` is a batch of users.
+    """
+    is_batch = (len(item_ids) > 0
+                and all(np.ndim(ids) == 1 for ids in item_ids))
+    if not is_batch:
+        item_ids = [item_ids]
+        weights = None if weights is None else [weights]
+    if weights is None:
+        weights = [np.ones(len(ids), dtype=np.float32) for ids in item_ids]
+
+    lengths = np.array([len(ids) for ids in item_ids], dtype=np.int64)
+    indices = (np.concatenate([np.asarray(ids, dtype=np.int64)
+                               for ids in item_ids])
+               if lengths.sum() > 0 else np.zeros(0, dtype=np.int64))
+    data = (np.concatenate([np.asarray(w, dtype=np.float32)
+                            for w in weights])
+            if lengths.sum() > 0 else np.zeros(0, dtype=np.float32))
+    rows = np.repeat(np.arange(len(item_ids)), lengths)
+    known = (indices >= 0) & (indices < n_items)
+    interaction = csr_matrix(
+        (data[known], (rows[known], indices[known])),
+        shape=(len(item_ids), n_items), dtype=np.float32)
+    return interaction, is_batch
+
+
+def weighted_ridge(indptr, indices, weights, targets, item_factors,
+                   base_matrix, block_size=256, max_nnz=1 << 18):
+    """Solve a ridge regression for every row of interactions:
+
+        x_u = (base + sum_i w_ui * y_i y_i^T)^-1 @ sum_i t_ui * y_i
+
+    where `y_i` is the row of `item_factors` of every interacted item. This
+    is the user step of ALS, which folds in new users against fixed items.
+
+    Rows are sorted by length and solved in blocks with batched
+    `np.linalg.solve`. The factors of a block are gathered into a padded
+    array, so `Y_u^T W_u Y_u` is one batched matmul. A block holds at most
+    `block_size` rows and about `max_nnz` padded interactions, so memory
+    is bounded by `max_nnz * k` instead of growing with `k^2`.
+
+    Returns
+    -------
+    user_factors : numpy.ndarray of shape (n_users, item_factors.shape[1])
+    """
+    n_users, k = len(indptr) - 1, item_factors.shape[1]
+    user_factors = np.zeros((n_users, k), dtype=np.float32)
+    lengths = np.diff(indptr)
+    # similar lengths in a block keep the padding small
+    order = np.argsort(lengths, kind="stable")
+    sorted_lengths = lengths[order]
+    start = np.searchsorted(sorted_lengths, 0, side="right")
+    # rows without interactions are solved to zeros
+    while start < n_users:
+        padded = (sorted_lengths[start: start + block_size]
+                  * np.arange(1, min(block_size, n_users - start) + 1))
+        end = start + max(1, np.searchsorted(padded, max_nnz, side="right"))
+        rows = order[start: end]
+        max_len = sorted_lengths[end - 1]
+        offsets = np.arange(max_len)
+        mask = offsets < lengths[rows, np.newaxis]
+        positions = np.where(mask, indptr[rows, np.newaxis] + offsets, 0)
+        factors = item_factors[indices[positions]] * mask[:, :, np.newaxis]
+        block_weights = np.where(mask, weights[positions], 0.0)
+        block_targets = np.where(mask, targets[positions], 0.0)
+
+        A = np.matmul(factors.transpose(0, 2, 1),
+                      factors * block_weights[:, :, np.newaxis]) + base_matrix
+        b = np.matmul(block_targets[:, np.newaxis, :], factors)
+        user_factors[rows] = np.linalg.solve(A, b.transpose(0, 2, 1))[
+            :, :, 0]
+        start = end
+    return user_factors
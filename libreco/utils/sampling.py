@@ -1,70 +1,80 @@
-from math import floor
-from random import random, seed as set_random_seed
+import logging
 import numpy as np
 from ..utils.misc import time_block
+try:
+    from ._sampling import negative_sampling
+except (ImportError, ModuleNotFoundError):
+    LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=LOG_FORMAT)
+    logging.warning("Sampling cython version is not available")
+    negative_sampling = None
+
+MAX_SEED = 2 ** 31 - 1
 
 
 class SamplingBase(object):
-    def __init__(self, dataset, data_info, num_neg=1):
+    def __init__(self, dataset, data_info, num_neg=1, num_threads=1,
+                 shuffle_block_size=None):
         self.dataset = dataset
         self.data_info = data_info
         self.num_neg = num_neg
+        self.num_threads = num_threads
+        self.shuffle_block_size = shuffle_block_size
+        self.batch_order = None
+
+    def _batch_index(self, batch_slice):
+        # gather rows through the shuffled order instead of copying data
+        if self.batch_order is None:
+            return batch_slice
+        return self.batch_order[batch_slice]
 
     def sample_items_random(self, seed=42):
-        set_random_seed(seed)
-        np.random.seed(seed)
         n_items = self.data_info.n_items
-        item_indices_sampled = list()
-        # set `list.append` as local variable to speed up
-        item_append = item_indices_sampled.append
-        # set is much faster for search contains
-        user_consumed = {
-            u: set(items) for u, items in self.dataset.user_consumed.items()
-        }
+        user_indices = self.dataset.user_indices
+        item_indices = self.dataset.item_indices
         # sample negative items for every user
         with time_block("random neg item sampling"):
-            for u, i in zip(self.dataset.user_indices,
-                            self.dataset.item_indices):
-                item_append(i)
-                for _ in range(self.num_neg):
-                    item_neg = floor(n_items * random())
-                    while item_neg in user_consumed[u]:
-                        item_neg = floor(n_items * random())
-                    item_append(item_neg)
-        return np.asarray(item_indices_sampled)
-
-    def sample_items_popular(self, seed=42):
-        set_random_seed(seed)
-        np.random.seed(seed)
-        data = self.data_info.get_indexed_interaction()
-        item_counts = data.item.value_counts().sort_index().to_numpy()
-        user_consumed = self.dataset.user_consumed
-        items = np.arange(self.data_info.n_items)
-
-        item_order = list()
-        item_indices_sampled = list()
+            item_neg = sample_negative_items(user_indices,
+                                             n_items,
+                                             self.dataset.user_consumed,
+                                             self.num_neg,
+                                             self.num_threads,
+                                             seed)
+        return self._merge_pos_neg_items(item_indices, item_neg)
+
+    def sample_items_popular(self, seed=42, power=1.0):
+        """Sample negative items with probability proportional to
+        `item_count ** power`, e.g. `power=0.75` as in word2vec."""
+        n_items = self.data_info.n_items
+        item_counts = np.zeros(n_items, dtype=np.float64)
+        counts = self.dataset.item_consumed.row_lengths[:n_items]
+        item_counts[:len(counts)] = counts
         with time_block("popularity-based neg item sampling"):
-            for user, u_data in data.groupby("user", sort=False):
-                item_indices = u_data.index.to_list()
-                item_indices = item_indices * (self.num_neg + 1)
-                item_order.extend(item_indices)
-
-                # add positive items
-                item_indices_sampled.extend(u_data.item.tolist())
-                u_consumed = user_consumed[user]
-                u_item_counts = item_counts.copy()
-                u_item_counts[u_consumed] = 0
-                item_prob = u_item_counts / np.sum(u_item_counts)
-                neg_size = len(u_consumed) * self.num_neg
-
-                neg_sampled = np.random.choice(
-                    items, size=neg_size, p=item_prob, replace=True)
-                item_indices_sampled.extend(neg_sampled)
-
-        item_indices_sampled = np.asarray(item_indices_sampled)
-        # must be stable sort to keep relative order
-        item_order = np.argsort(item_order, kind="mergesort")
-        return item_indices_sampled[item_order]
+            item_indices_sampled = self.sample_items_weighted(
+                np.power(item_counts, power), seed=seed)
+        return item_indices_sampled
+
+    def sample_items_weighted(self, item_weights, seed=42):
+        """Sample negative items with probability proportional to
+        `item_weights`, using a single alias table shared by all users."""
+        user_indices = self.dataset.user_indices
+        item_indices = self.dataset.item_indices
+        prob, alias = build_alias_table(item_weights)
+        item_neg = rejection_sample_weighted(
+            np.repeat(user_indices, self.num_neg),
+            prob,
+            alias,
+            self.dataset.user_consumed,
+            item_weights,
+            np.random.RandomState(seed)
+        )
+        return self._merge_pos_neg_items(item_indices, item_neg)
+
+    def _merge_pos_neg_items(self, item_pos, item_neg):
+        # every positive item is followed by its `num_neg` negative items
+        return np.column_stack(
+            [item_pos, np.reshape(item_neg, (-1, self.num_neg))]
+        ).ravel()
 
     def _label_negative_sampling(self, size):
         factor = self.num_neg + 1
@@ -76,8 +86,9 @@ class SamplingBase(object):
 
 class NegativeSampling(SamplingBase):
     def __init__(self, dataset, data_info, num_neg, sparse=None, dense=None,
-                 batch_sampling=False):
-        super(NegativeSampling, self).__init__(dataset, data_info, num_neg)
+                 batch_sampling=False, num_threads=1, shuffle_block_size=None):
+        super(NegativeSampling, self).__init__(
+            dataset, data_info, num_neg, num_threads, shuffle_block_size)
 
         if batch_sampling and dataset.has_sampled:
             self.user_indices = dataset.user_indices_orig
@@ -95,7 +106,7 @@ class NegativeSampling(SamplingBase):
         self.sparse = sparse
         self.dense = dense
 
-    def generate_all(self, seed=42, item_gen_mode="random"):
+    def generate_all(self, seed=42, item_gen_mode="random", pop_power=1.0):
         user_indices_sampled = np.repeat(
             self.user_indices, self.num_neg + 1, axis=0)
 
@@ -105,7 +116,8 @@ class NegativeSampling(SamplingBase):
         elif item_gen_mode == "random":
             item_indices_sampled = self.sample_items_random(seed=seed)
         elif item_gen_mode == "popular":
-            item_indices_sampled = self.sample_items_popular(seed=seed)
+            item_indices_sampled = self.sample_items_popular(
+                seed=seed, power=pop_power)
 
         sparse_indices_sampled = self._sparse_indices_sampling(
             self.sparse_indices, item_indices_sampled) if self.sparse else None
@@ -117,48 +129,48 @@ class NegativeSampling(SamplingBase):
                 sparse_indices_sampled, dense_values_sampled)
 
     def __call__(self, shuffle=True, batch_size=None):
-        if shuffle:
-            mask = np.random.permutation(range(self.data_size))
-            self.sparse_indices = (
-                self.sparse_indices[mask] if self.sparse else None)
-            self.dense_values = (
-                self.dense_values[mask] if self.dense else None)
+        tasks = self.batch_tasks(shuffle, batch_size)
+        return (self.make_batch(*task) for task in tasks)
+
+    def batch_tasks(self, shuffle=True, batch_size=None):
+        self.batch_order = shuffle_indices(
+            self.data_size, self.shuffle_block_size) if shuffle else None
+        # seeds are drawn in order, so batches are reproducible
+        # no matter how many workers are building them
+        return [(slice(k, k + batch_size), np.random.randint(MAX_SEED))
+                for k in range(0, self.data_size, batch_size)]
+
+    def make_batch(self, batch_slice, seed):
+        batch_index = self._batch_index(batch_slice)
+        batch_user_indices = self.user_indices[batch_index]
+        batch_item_indices = self.item_indices[batch_index]
+        batch_sparse_indices = (
+            self.sparse_indices[batch_index] if self.sparse else None)
+        batch_dense_values = (
+            self.dense_values[batch_index] if self.dense else None)
+
+        item_neg = sample_negative_items(batch_user_indices,
+                                         self.data_info.n_items,
+                                         self.dataset.user_consumed,
+                                         self.num_neg,
+                                         self.num_threads,
+                                         seed)
+        user_indices_sampled = np.repeat(
+            batch_user_indices, self.num_neg + 1)
+        item_indices_sampled = self._merge_pos_neg_items(
+            batch_item_indices, item_neg)
 
-        user_consumed = {
-            u: set(items) for u, items in self.dataset.user_consumed.items()
-        }
-        n_items = self.data_info.n_items
-        return self.sample_batch(user_consumed, n_items, batch_size)
-
-    def sample_batch(self, user_consumed, n_items, batch_size):
-        for k in range(0, self.data_size, batch_size):
-            batch_slice = slice(k, k + batch_size)
-            batch_user_indices = self.user_indices[batch_slice]
-            batch_item_indices = self.item_indices[batch_slice]
-            batch_sparse_indices = (
-                self.sparse_indices[batch_slice] if self.sparse else None)
-            batch_dense_values = (
-                self.dense_values[batch_slice] if self.dense else None)
-
-            item_indices_sampled = list()
-            for u, i in zip(batch_user_indices, batch_item_indices):
-                item_indices_sampled.append(i)
-                for _ in range(self.num_neg):
-                    item_neg = floor(random() * n_items)
-                    while item_neg in user_consumed[u]:
-                        item_neg = floor(random() * n_items)
-                    item_indices_sampled.append(item_neg)
-
-            sparse_indices_sampled = self._sparse_indices_sampling(
-                batch_sparse_indices, item_indices_sampled
-            ) if self.sparse else None
-            dense_values_sampled = self._dense_values_sampling(
-                batch_dense_values, item_indices_sampled
-            ) if self.dense else None
-            label_sampled = self._label_negative_sampling(batch_size)
-
-            yield (batch_user_indices, batch_item_indices, label_sampled,
-                   sparse_indices_sampled, dense_values_sampled)
+        sparse_indices_sampled = self._sparse_indices_sampling(
+            batch_sparse_indices, item_indices_sampled
+        ) if self.sparse else None
+        dense_values_sampled = self._dense_values_sampling(
+            batch_dense_values, item_indices_sampled
+        ) if self.dense else None
+        label_sampled = self._label_negative_sampling(
+            len(batch_user_indices))
+
+        return (user_indices_sampled, item_indices_sampled, label_sampled,
+                sparse_indices_sampled, dense_values_sampled)
 
     def _sparse_indices_sampling(self, sparse_indices, item_indices_sampled):
         user_sparse_col = self.data_info.user_sparse_col.index
@@ -233,10 +245,18 @@ class NegativeSampling(SamplingBase):
 
 
 class PairwiseSampling(SamplingBase):
-    def __init__(self, dataset, data_info, num_neg=1):
-        super(PairwiseSampling, self).__init__(dataset, data_info, num_neg)
-
-        if dataset.has_sampled:
+    def __init__(self, dataset, data_info, num_neg=1, num_threads=1,
+                 shuffle_block_size=None, user_indices=None,
+                 item_indices=None):
+        super(PairwiseSampling, self).__init__(
+            dataset, data_info, num_neg, num_threads, shuffle_block_size)
+
+        # positive pairs can be provided explicitly, e.g. in incremental
+        # training, while negative items are still sampled against `dataset`
+        if user_indices is not None and item_indices is not None:
+            self.user_indices = user_indices
+            self.item_indices = item_indices
+        elif dataset.has_sampled:
             self.user_indices = dataset.user_indices_orig
             self.item_indices = dataset.item_indices_orig
         else:
@@ -245,33 +265,193 @@ class PairwiseSampling(SamplingBase):
         self.data_size = len(self.user_indices)
 
     def __call__(self, shuffle=True, batch_size=None):
-        if shuffle:
-            mask = np.random.permutation(range(self.data_size))
-            self.user_indices = self.user_indices[mask]
-            self.item_indices = self.item_indices[mask]
-
-        user_consumed = {
-            u: set(items) for u, items in self.dataset.user_consumed.items()
-        }
-        n_items = self.data_info.n_items
-        return self.sample_batch(user_consumed, n_items, batch_size)
-
-    def sample_batch(self, user_consumed, n_items, batch_size):
-        for k in range(0, self.data_size, batch_size):
-            batch_slice = slice(k, k + batch_size)
-            batch_user_indices = self.user_indices[batch_slice]
-            batch_item_indices_pos = self.item_indices[batch_slice]
-
-            batch_item_indices_neg = list()
-            for u in batch_user_indices:
-                item_neg = floor(n_items * random())
-                while item_neg in user_consumed[u]:
-                    item_neg = floor(n_items * random())
-                batch_item_indices_neg.append(item_neg)
-
-            batch_item_indices_neg = np.asarray(batch_item_indices_neg)
-        #    batch_item_diff
-            yield (batch_user_indices,
-                   batch_item_indices_pos,
-                   batch_item_indices_neg)
-
+        tasks = self.batch_tasks(shuffle, batch_size)
+        return (self.make_batch(*task) for task in tasks)
+
+    def batch_tasks(self, shuffle=True, batch_size=None):
+        self.batch_order = shuffle_indices(
+            self.data_size, self.shuffle_block_size) if shuffle else None
+        return [(slice(k, k + batch_size), np.random.randint(MAX_SEED))
+                for k in range(0, self.data_size, batch_size)]
+
+    def make_batch(self, batch_slice, seed):
+        batch_index = self._batch_index(batch_slice)
+        batch_user_indices = self.user_indices[batch_index]
+        batch_item_indices_pos = self.item_indices[batch_index]
+        batch_item_indices_neg = sample_negative_items(
+            batch_user_indices,
+            self.data_info.n_items,
+            self.dataset.user_consumed,
+            num_neg=1,
+            num_threads=self.num_threads,
+            seed=seed
+        ).ravel()
+        return (batch_user_indices,
+                batch_item_indices_pos,
+                batch_item_indices_neg)
+
+
+def shuffle_indices(data_size, block_size=None, random_state=np.random):
+    """Random permutation of data indices, used to gather shuffled batches
+    without copying the data.
+
+    If `block_size` is provided, the order of contiguous blocks of rows is
+    shuffled, and then rows are shuffled within each block. So every batch
+    gathers rows from a few nearby memory regions, which is more cache
+    friendly for large feature arrays, at the cost of a weaker shuffle.
+    """
+    if not block_size or block_size >= data_size:
+        return random_state.permutation(data_size)
+
+    n_blocks = (data_size + block_size - 1) // block_size
+    block_order = random_state.permutation(n_blocks)
+    indices = (block_order[:, np.newaxis] * block_size
+               + np.arange(block_size))
+    within_block = np.argsort(
+        random_state.random_sample(indices.shape), axis=1)
+    indices = np.take_along_axis(indices, within_block, axis=1).ravel()
+    # the last block may be partial
+    return indices[indices < data_size]
+
+
+def sample_negative_items(user_indices, n_items, user_consumed, num_neg=1,
+                          num_threads=1, seed=42):
+    """Sample `num_neg` negative items for every user in `user_indices`.
+
+    Use the multi-threaded cython sampler if available, otherwise fall back
+    to vectorized rejection sampling in numpy.
+
+    Parameters
+    ----------
+    user_indices : numpy.ndarray
+        Users to sample for.
+    n_items : int
+        Number of items.
+    user_consumed : `ConsumedIndex` object
+        Consumed items of every user, sampled items must not be in it.
+    num_neg : int, optional
+        Number of negative items for each user.
+    num_threads : int, optional
+        Number of threads used in cython sampler.
+    seed : int, optional
+        Random seed, result is reproducible given the same seed and
+        num_threads.
+
+    Returns
+    -------
+    item_neg : numpy.ndarray of shape (len(user_indices), num_neg)
+    """
+    if negative_sampling is not None:
+        return negative_sampling(user_indices,
+                                 user_consumed.sorted_indices,
+                                 user_consumed.indptr,
+                                 user_consumed.distinct_lengths,
+                                 n_items,
+                                 num_neg,
+                                 num_threads,
+                                 seed)
+
+    item_neg = rejection_sample_items(np.repeat(user_indices, num_neg),
+                                      n_items,
+                                      user_consumed,
+                                      np.random.RandomState(seed))
+    return item_neg.reshape(-1, num_neg)
+
+
+def rejection_sample_items(user_indices, n_items, user_consumed,
+                           random_state=np.random):
+    """Sample one random negative item for every user in `user_indices`.
+
+    All items are drawn at once, then the ones that have been consumed by
+    the corresponding user are redrawn until none of them is consumed.
+    Users who have consumed all items keep their first draw, like in the
+    cython sampler. `user_consumed` should be a `ConsumedIndex` object.
+    """
+    item_neg = random_state.randint(0, n_items, size=len(user_indices))
+    rejected = np.flatnonzero(user_consumed.contains(user_indices, item_neg))
+    # only known users can be rejected, and redrawing never ends for the
+    # saturated ones, whose repeated items must not be counted
+    saturated = (user_consumed.distinct_lengths[user_indices[rejected]]
+                 >= n_items)
+    rejected = rejected[~saturated]
+    while len(rejected) > 0:
+        item_neg[rejected] = random_state.randint(
+            0, n_items, size=len(rejected))
+        still_consumed = user_consumed.contains(
+            user_indices[rejected], item_neg[rejected])
+        rejected = rejected[still_consumed]
+    return item_neg
+
+
+def build_alias_table(weights):
+    """Build Walker's alias table with Vose's method, after which every
+    weighted draw costs O(1).
+
+    Parameters
+    ----------
+    weights : array_like
+        Non-negative and unnormalized weight of every item.
+
+    Returns
+    -------
+    prob : numpy.ndarray
+        Probability of keeping the drawn bucket.
+    alias : numpy.ndarray
+        Alternative item of every bucket.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if len(weights) == 0 or np.any(weights < 0) or weights.sum() <= 0:
+        raise ValueError("weights must be non-negative and sum to positive")
+
+    n = len(weights)
+    prob = (weights * n / weights.sum()).tolist()
+    alias = list(range(n))
+    small = [i for i, p in enumerate(prob) if p < 1.0]
+    large = [i for i, p in enumerate(prob) if p >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        alias[s] = l
+        prob[l] = prob[l] + prob[s] - 1.0
+        if prob[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    # remaining ones should be 1.0, apart from numerical error
+    for i in small + large:
+        prob[i] = 1.0
+    return np.asarray(prob), np.asarray(alias, dtype=np.int64)
+
+
+def alias_draw(prob, alias, size, random_state=np.random):
+    buckets = random_state.randint(0, len(prob), size=size)
+    keep = random_state.random_sample(size) < prob[buckets]
+    return np.where(keep, buckets, alias[buckets])
+
+
+def rejection_sample_weighted(user_indices, prob, alias, user_consumed,
+                              item_weights, random_state=np.random):
+    """Sample one weighted negative item for every user in `user_indices`,
+    drawing from the alias table and redrawing consumed items.
+
+    Users whose consumed items take all the weight can't get a negative
+    item, so their draws are kept as they are.
+    """
+    item_weights = np.asarray(item_weights, dtype=np.float64)
+    item_neg = alias_draw(prob, alias, len(user_indices), random_state)
+    consumed_weights = np.zeros(len(user_indices))
+    known = (user_indices >= 0) & (user_indices < user_consumed.n_rows)
+    consumed_weights[known] = user_consumed.row_sums(
+        item_weights)[user_indices[known]]
+    remaining = item_weights.sum() - consumed_weights
+    can_reject = remaining > item_weights.sum() * 1e-10
+
+    rejected = np.flatnonzero(
+        can_reject & user_consumed.contains(user_indices, item_neg))
+    while len(rejected) > 0:
+        item_neg[rejected] = alias_draw(
+            prob, alias, len(rejected), random_state)
+        still_consumed = user_consumed.contains(
+            user_indices[rejected], item_neg[rejected])
+        rejected = rejected[still_consumed]
+    return item_neg
@@ -1,5 +1,4 @@
 import time
-import math
 import logging
 import numpy as np
 from scipy.sparse import csr_matrix
@@ -12,7 +11,10 @@ try:
         forward_pearson,
         invert_pearson,
         forward_jaccard,
-        invert_jaccard
+        invert_jaccard,
+        invert_weighted,
+        pair_products,
+        push_topk_pairs
     )
 except (ImportError, ModuleNotFoundError):
     LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
@@ -21,28 +23,42 @@ except (ImportError, ModuleNotFoundError):
     pass
 
 
-def _choose_blocks(num, b_size=None):
-    # To calculate an n by n similarity matrix (n is num of user or item),
-    # memory is usually a big concern, so the matrix is divided into several
-    # blocks to calculate separately. The default block size is 1024, so num
-    # of elements in a block is 2e8, which is roughly 1024 * 200000 users/items.
-    # Of course num of users/items will vary in various datasets,
-    # so here default block num is defined as how many blocks can exist,
-    # and block size is calculated to make sure data are divided evenly.
-    if not b_size:
-        block_num = math.ceil(num / (2e8 / num))
-        block_size = math.ceil(num / block_num)
-    else:
-        block_size = b_size
-        block_num = math.ceil(num / block_size)
-    print(f"Final block size and num: {block_size, block_num}")
-    return block_size, block_num
+def _invert_inputs(sparse_data_x, sparse_data_y):
+    # rows of x are computed in one pass by going through
+    # x -> y in sparse_data_x, then the inverted index y -> x
+    return (sparse_data_x.indices.astype(np.int32),
+            sparse_data_x.indptr.astype(np.int32),
+            sparse_data_x.data.astype(np.float32),
+            sparse_data_y.indices.astype(np.int32),
+            sparse_data_y.indptr.astype(np.int32),
+            sparse_data_y.data.astype(np.float32))
+
+
+def _build_sim_matrix(res_indices, res_indptr, res_data, n_x, mode, topk,
+                      symmetric=True):
+    if topk and mode == "invert":
+        # full rows of top k neighbors, sorted by similarity
+        return csr_matrix((res_data, res_indices, res_indptr),
+                          shape=(n_x, n_x), dtype=np.float32)
+    if not symmetric:
+        # full rows
+        return csr_matrix((res_data, res_indices, res_indptr),
+                          shape=(n_x, n_x), dtype=np.float32)
+    sim_upper_triangular = csr_matrix(
+        (res_data, res_indices, res_indptr),
+        shape=(n_x, n_x), dtype=np.float32
+    )
+    sim_matrix = sim_upper_triangular + sim_upper_triangular.transpose()
+    if topk:
+        return _top_k_rows(sim_matrix, topk, positive=False)
+    return sim_matrix
 
 
 def cosine_sim(sparse_data_x, sparse_data_y, num_x, num_y, block_size=None,
-               num_threads=1, min_common=1, mode="invert"):
-    block_size, block_num = _choose_blocks(num_x, block_size)
-    n_x, n_y = num_x, num_y
+               num_threads=1, min_common=1, mode="invert", topk=None,
+               lsh_params=None):
+    n_x = num_x
+    chunk_size = block_size or 256
 
     if mode == "forward":
         indices = sparse_data_x.indices.astype(np.int32)
@@ -54,29 +70,30 @@ def cosine_sim(sparse_data_x, sparse_data_y, num_x, num_y, block_size=None,
             indices, indptr, data, x_norm, min_common, n_x)
 
     elif mode == "invert":
-        indices = sparse_data_y.indices.astype(np.int32)
-        indptr = sparse_data_y.indptr.astype(np.int32)
-        data = sparse_data_y.data.astype(np.float32)
         x_norm = compute_sparse_norm(sparse_data_x)
 
         res_indices, res_indptr, res_data = invert_cosine(
-            indices, indptr, data, x_norm, min_common, n_x, n_y,
-            block_size, block_num, num_threads)
+            *_invert_inputs(sparse_data_x, sparse_data_y), x_norm,
+            min_common, n_x, chunk_size, num_threads, topk or 0)
+
+    elif mode == "lsh":
+        # approximate, min_common is not applied
+        return minhash_cosine_sim(sparse_data_x, n_x, topk=topk,
+                                  num_threads=num_threads,
+                                  **(lsh_params or {}))
 
     else:
-        raise ValueError("mode must either be 'forward' or 'invert'")
+        raise ValueError("mode must be one of ('forward', 'invert', 'lsh')")
 
-    sim_upper_triangular = csr_matrix(
-        (res_data, res_indices, res_indptr),
-        shape=(n_x, n_x), dtype=np.float32
-    )
-    return sim_upper_triangular + sim_upper_triangular.transpose()
+    return _build_sim_matrix(res_indices, res_indptr, res_data, n_x, mode,
+                             topk)
 
 
 def pearson_sim(sparse_data_x, sparse_data_y, num_x, num_y, block_size=None,
-                num_threads=1, min_common=1, mode="invert"):
-    block_size, block_num = _choose_blocks(num_x, block_size)
-    n_x, n_y = num_x, num_y
+                num_threads=1, min_common=1, mode="invert", topk=None,
+                lsh_params=None):
+    n_x = num_x
+    chunk_size = block_size or 256
 
     if mode == "forward":
         indices = sparse_data_x.indices.astype(np.int32)
@@ -90,30 +107,27 @@ def pearson_sim(sparse_data_x, sparse_data_y, num_x, num_y, block_size=None,
             min_common, n_x)
 
     elif mode == "invert":
-        indices = sparse_data_y.indices.astype(np.int32)
-        indptr = sparse_data_y.indptr.astype(np.int32)
-        data = sparse_data_y.data.astype(np.float32)
         x_mean = compute_sparse_mean(sparse_data_x)
         x_mean_centered_norm = compute_sparse_mean_centered_norm(sparse_data_x)
 
         res_indices, res_indptr, res_data = invert_pearson(
-            indices, indptr, data, x_mean, x_mean_centered_norm, min_common,
-            n_x, n_y, block_size, block_num, num_threads)
+            *_invert_inputs(sparse_data_x, sparse_data_y), x_mean,
+            x_mean_centered_norm, min_common, n_x, chunk_size, num_threads,
+            topk or 0)
 
     else:
+        # no locality sensitive hashing for pearson
         raise ValueError("mode must either be 'forward' or 'invert'")
 
-    sim_upper_triangular = csr_matrix(
-        (res_data, res_indices, res_indptr),
-        shape=(n_x, n_x), dtype=np.float32
-    )
-    return sim_upper_triangular + sim_upper_triangular.transpose()
+    return _build_sim_matrix(res_indices, res_indptr, res_data, n_x, mode,
+                             topk)
 
 
 def jaccard_sim(sparse_data_x, sparse_data_y, num_x, num_y, block_size=None,
-                num_threads=1, min_common=1, mode="invert"):
-    block_size, block_num = _choose_blocks(num_x, block_size)
-    n_x, n_y = num_x, num_y
+                num_threads=1, min_common=1, mode="invert", topk=None,
+                lsh_params=None):
+    n_x = num_x
+    chunk_size = block_size or 256
 
     if mode == "forward":
         indices = sparse_data_x.indices.astype(np.int32)
@@ -125,23 +139,464 @@ def jaccard_sim(sparse_data_x, sparse_data_y, num_x, num_y, block_size=None,
             indices, indptr, data, x_count, min_common, n_x)
 
     elif mode == "invert":
-        indices = sparse_data_y.indices.astype(np.int32)
-        indptr = sparse_data_y.indptr.astype(np.int32)
-        data = sparse_data_y.data.astype(np.float32)
-        x_count = compute_sparse_count(sparse_data_x)
+        x_count = compute_sparse_count(sparse_data_x).astype(np.int32)
 
         res_indices, res_indptr, res_data = invert_jaccard(
-            indices, indptr, data, x_count, min_common,
-            n_x, n_y, block_size, block_num, num_threads)
+            *_invert_inputs(sparse_data_x, sparse_data_y), x_count,
+            min_common, n_x, chunk_size, num_threads, topk or 0)
+
+    elif mode == "lsh":
+        # approximate, min_common is not applied
+        return minhash_jaccard_sim(sparse_data_x, n_x, topk=topk,
+                                   num_threads=num_threads,
+                                   **(lsh_params or {}))
 
     else:
-        raise ValueError("mode must either be 'forward' or 'invert'")
+        raise ValueError("mode must be one of ('forward', 'invert', 'lsh')")
+
+    return _build_sim_matrix(res_indices, res_indptr, res_data, n_x, mode,
+                             topk)
+
+
+def adjusted_cosine_sim(sparse_data_x, sparse_data_y, num_x, num_y,
+                        block_size=None, num_threads=1, min_common=1,
+                        mode="invert", topk=None, lsh_params=None):
+    """Cosine similarity of rows after the mean of every column is
+    subtracted, e.g. item similarity with user bias removed."""
+    y_center = compute_sparse_mean(sparse_data_y)
+    return _weighted_sim(sparse_data_x, sparse_data_y, num_x, block_size,
+                         num_threads, min_common, mode, topk, lsh_params,
+                         normalization="cosine", y_center=y_center)
+
+
+def tfidf_sim(sparse_data_x, sparse_data_y, num_x, num_y, block_size=None,
+              num_threads=1, min_common=1, mode="invert", topk=None,
+              lsh_params=None):
+    """Cosine similarity of rows with every column weighted by its
+    smoothed idf, `log((1 + num_x) / (1 + count)) + 1`, so columns that
+    interact with many rows contribute less."""
+    counts = compute_sparse_count(sparse_data_y)
+    y_weight = np.log((1 + num_x) / (1 + counts)) + 1
+    return _weighted_sim(sparse_data_x, sparse_data_y, num_x, block_size,
+                         num_threads, min_common, mode, topk, lsh_params,
+                         normalization="cosine", y_weight=y_weight)
+
+
+def bm25_sim(sparse_data_x, sparse_data_y, num_x, num_y, block_size=None,
+             num_threads=1, min_common=1, mode="invert", topk=None,
+             lsh_params=None, k1=1.2, b=0.75):
+    """Dot product of BM25 weighted rows.
+
+    Every column is weighted by its BM25 idf, and every row by the term
+    frequency saturation of a binary interaction,
+    `(k1 + 1) / (1 + k1 * (1 - b + b * length / avg_length))`, so long
+    rows get smaller similarities. Values scale the weights linearly.
+    There is no normalization, and similarities are not bounded by 1.
+    """
+    if mode != "invert":
+        raise ValueError("bm25 similarity only supports 'invert' mode")
+    counts = compute_sparse_count(sparse_data_y)
+    y_weight = np.log(1 + (num_x - counts + 0.5) / (counts + 0.5))
+    lengths = compute_sparse_count(sparse_data_x)
+    length_norm = (1 - b) + b * lengths / max(lengths.mean(), 1e-8)
+    x_weight = (k1 + 1) / (1 + k1 * length_norm)
+    return _weighted_sim(sparse_data_x, sparse_data_y, num_x, block_size,
+                         num_threads, min_common, mode, topk, lsh_params,
+                         normalization="none", x_weight=x_weight,
+                         y_weight=y_weight)
+
+
+def asymmetric_cosine_sim(sparse_data_x, sparse_data_y, num_x, num_y,
+                          block_size=None, num_threads=1, min_common=1,
+                          mode="invert", topk=None, lsh_params=None,
+                          alpha=0.5):
+    """Asymmetric cosine similarity,
+    `dot(x1, x2) / (|x1| ^ (2 * alpha) * |x2| ^ (2 - 2 * alpha))`.
+
+    With binary data it is `common / (count1 ^ alpha * count2 ^ (1 - alpha))`,
+    and `alpha=0.5` gives cosine similarity. Larger `alpha` penalizes the
+    row itself less than its neighbors, so popular neighbors are favored
+    less. The result is not symmetric, and every row holds its own
+    similarities to all neighbors.
+    """
+    if mode != "invert":
+        raise ValueError("asymmetric cosine similarity only supports "
+                         "'invert' mode")
+    return _weighted_sim(sparse_data_x, sparse_data_y, num_x, block_size,
+                         num_threads, min_common, mode, topk, lsh_params,
+                         normalization="asymmetric", alpha=alpha)
+
+
+def _weighted_sim(sparse_data_x, sparse_data_y, n_x, block_size, num_threads,
+                  min_common, mode, topk, lsh_params, normalization,
+                  alpha=0.5, y_center=None, x_weight=None, y_weight=None):
+    y_center, x_weight, y_weight = (
+        None if v is None else np.asarray(v, dtype=np.float32)
+        for v in (y_center, x_weight, y_weight)
+    )
+    weighted_x = _weight_sparse(sparse_data_x, y_center, x_weight, y_weight)
+    chunk_size = block_size or 256
+
+    if mode == "invert":
+        x_norm = compute_sparse_norm(weighted_x)
+        res_indices, res_indptr, res_data = invert_weighted(
+            *_invert_inputs(sparse_data_x, sparse_data_y), y_center,
+            x_weight, y_weight, x_norm, normalization, alpha, min_common,
+            n_x, chunk_size, num_threads, topk or 0)
+
+    elif mode == "lsh":
+        # cosine of the weighted rows, min_common is not applied
+        return minhash_cosine_sim(weighted_x, n_x, topk=topk,
+                                  num_threads=num_threads,
+                                  **(lsh_params or {}))
 
-    sim_upper_triangular = csr_matrix(
-        (res_data, res_indices, res_indptr),
+    else:
+        raise ValueError("mode must either be 'invert' or 'lsh'")
+
+    return _build_sim_matrix(res_indices, res_indptr, res_data, n_x, mode,
+                             topk, symmetric=normalization != "asymmetric")
+
+
+def _weight_sparse(sparse_data, y_center, x_weight, y_weight):
+    # the same transform of values as in invert_weighted
+    data = sparse_data.data.astype(np.float32)
+    if y_center is not None:
+        data = data - y_center[sparse_data.indices]
+    if x_weight is not None:
+        rows = np.repeat(np.arange(sparse_data.shape[0]),
+                         np.diff(sparse_data.indptr))
+        data = data * x_weight[rows]
+    if y_weight is not None:
+        data = data * y_weight[sparse_data.indices]
+    return csr_matrix((data, sparse_data.indices, sparse_data.indptr),
+                      shape=sparse_data.shape, dtype=np.float32)
+
+
+_LSH_PAIR_BLOCK = 1 << 22
+_LSH_KEY_SHIFT = 10
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def minhash_jaccard_sim(sparse_data_x, num_x, n_hashes=64, n_bands=64,
+                        max_bucket_size=16, topk=None, num_threads=1,
+                        seed=42):
+    """Approximate Jaccard similarity by MinHash signatures and LSH banding.
+
+    Every row gets `n_hashes` min-hash values of its interacted columns,
+    and the probability that two rows have the same value is their Jaccard
+    similarity. Signatures are split into `n_bands` bands, and only rows
+    that fall into the same bucket in at least one band become candidates,
+    whose exact similarities are then computed from `sparse_data_x`. With
+    `r = n_hashes // n_bands` values per band, rows of similarity `s` are
+    found with probability `1 - (1 - s^r)^n_bands`, so more bands give
+    higher recall but more candidates. Interaction data usually has small
+    similarities, for which `r` should be 1 or 2.
+
+    The cost is linear in the number of rows and doesn't depend on how
+    popular the columns are, whereas the "invert" mode costs the sum of
+    squared column counts. So it pays off for large data whose columns
+    have a long tail of popularity, e.g. item similarities with very
+    active users.
+
+    Parameters
+    ----------
+    sparse_data_x : scipy.sparse.csr_matrix
+        Interactions of every row, e.g. item as row and user as column.
+    num_x : int
+        Number of rows.
+    n_hashes : int, optional
+        Length of signatures.
+    n_bands : int, optional
+        Number of LSH bands, at most `n_hashes`.
+    max_bucket_size : int, optional
+        In every band, rows of a bucket are shuffled and every row is paired
+        with at most `max_bucket_size - 1` following rows, which bounds the
+        cost of huge buckets.
+    topk : int, optional
+        Only keep the `topk` most similar neighbors of every row.
+    num_threads : int, optional
+        Number of threads used for computing similarities of candidates.
+    seed : int, optional
+
+    Returns
+    -------
+    sim_matrix : scipy.sparse.csr_matrix of shape (num_x, num_x)
+    """
+    x_count = compute_sparse_count(sparse_data_x)
+    binary = csr_matrix(
+        (np.ones_like(sparse_data_x.data, dtype=np.float32),
+         sparse_data_x.indices, sparse_data_x.indptr),
+        shape=sparse_data_x.shape)
+    inputs = _pair_inputs(binary)
+
+    def pair_sims(x1, x2):
+        intersections = pair_products(*inputs, x1, x2, num_threads)
+        return intersections / (x_count[x1] + x_count[x2] - intersections)
+
+    return _minhash_sim(sparse_data_x, num_x, x_count > 0, pair_sims,
+                        n_hashes, n_bands, max_bucket_size, topk, seed)
+
+
+def minhash_cosine_sim(sparse_data_x, num_x, n_hashes=64, n_bands=64,
+                       max_bucket_size=16, topk=None, num_threads=1,
+                       seed=42):
+    """Approximate cosine similarity, with candidates found by MinHash.
+
+    Candidates are rows whose interacted columns overlap a lot, found the
+    same way as in `minhash_jaccard_sim`, and their exact cosine
+    similarities are computed from `sparse_data_x`. Unlike sign bits of
+    random projections, min-hash values still tell apart the small
+    similarities of interaction data. See `minhash_jaccard_sim` for the
+    parameters.
+
+    Returns
+    -------
+    sim_matrix : scipy.sparse.csr_matrix of shape (num_x, num_x)
+    """
+    x_norm = compute_sparse_norm(sparse_data_x)
+    inputs = _pair_inputs(sparse_data_x)
+
+    def pair_sims(x1, x2):
+        return (pair_products(*inputs, x1, x2, num_threads)
+                / (x_norm[x1] * x_norm[x2]))
+
+    return _minhash_sim(sparse_data_x, num_x, x_norm > 0, pair_sims,
+                        n_hashes, n_bands, max_bucket_size, topk, seed)
+
+
+def _minhash_sim(sparse_data_x, num_x, valid, pair_sims, n_hashes, n_bands,
+                 max_bucket_size, topk, seed):
+    _check_lsh_params(n_hashes, n_bands)
+    signatures = _minhash_signatures(sparse_data_x, n_hashes, seed)
+    candidates = _lsh_candidates(signatures, valid, n_bands,
+                                 max_bucket_size, seed)
+    return _lsh_sim_matrix(candidates, pair_sims, num_x, topk)
+
+
+def _pair_inputs(sparse_data_x):
+    # merging rows in `pair_products` requires sorted indices
+    if not sparse_data_x.has_sorted_indices:
+        sparse_data_x = sparse_data_x.sorted_indices()
+    return (sparse_data_x.indices.astype(np.int32),
+            sparse_data_x.indptr.astype(np.int32),
+            sparse_data_x.data.astype(np.float32))
+
+
+def _check_lsh_params(n_hashes, n_bands):
+    # every band needs at least one value of signatures
+    if not 0 < n_bands <= n_hashes:
+        raise ValueError(f"n_bands must be in [1, n_hashes], "
+                         f"got n_bands={n_bands}, n_hashes={n_hashes}")
+
+
+def _minhash_signatures(sparse_data_x, n_hashes, seed):
+    # universal hashing (a * col + b) mod p simulates random permutations
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MERSENNE_PRIME, n_hashes, dtype=np.int64)
+    b = rng.integers(0, _MERSENNE_PRIME, n_hashes, dtype=np.int64)
+    n_rows = sparse_data_x.shape[0]
+    signatures = np.full((n_rows, n_hashes), _MERSENNE_PRIME,
+                         dtype=np.uint32)
+    starts = sparse_data_x.indptr[:-1]
+    nonempty = np.flatnonzero(np.diff(sparse_data_x.indptr))
+    if len(nonempty) == 0:
+        return signatures
+    cols = sparse_data_x.indices.astype(np.int64)
+    hash_block = max(1, (1 << 24) // max(len(cols), 1))
+    for h in range(0, n_hashes, hash_block):
+        values = (a[h: h + hash_block, np.newaxis] * cols
+                  + b[h: h + hash_block, np.newaxis]) % _MERSENNE_PRIME
+        # empty rows have no segment, so the next start ends every row
+        signatures[nonempty, h: h + hash_block] = np.minimum.reduceat(
+            values, starts[nonempty], axis=1).T
+    return signatures
+
+
+def _lsh_candidates(signatures, valid, n_bands, max_bucket_size, seed):
+    # rows with the same values in a band fall into the same bucket, keys
+    # of bands are random linear combinations with wrap-around overflow.
+    # Candidate pairs are yielded in blocks of about `_LSH_PAIR_BLOCK`
+    # unique pairs, so memory doesn't grow with the number of bands.
+    n_rows, n_hashes = signatures.shape
+    rows_per_band = n_hashes // n_bands
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(0, np.iinfo(np.uint64).max, n_hashes,
+                               dtype=np.uint64, endpoint=True) | 1
+    rows = np.flatnonzero(valid)
+    pair_keys, n_pairs = [], 0
+    for start in range(0, rows_per_band * n_bands, rows_per_band):
+        band = slice(start, start + rows_per_band)
+        keys = (signatures[rows, band].astype(np.uint64)
+                * multipliers[band]).sum(axis=1, dtype=np.uint64)
+        # rows of a bucket are in random order, so capped buckets pair
+        # every row with different rows in every band
+        shuffled = rng.permutation(len(keys))
+        order = shuffled[np.argsort(keys[shuffled], kind="stable")]
+        sorted_keys = keys[order]
+        bucket_starts = np.flatnonzero(
+            np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]]))
+        bucket_ends = np.append(bucket_starts[1:], len(keys))
+        ends = np.repeat(bucket_ends, np.diff(np.append(bucket_starts,
+                                                        len(keys))))
+        # pair every row with the following rows of its bucket
+        positions = np.arange(len(keys))
+        counts = np.minimum(ends - positions - 1, max_bucket_size - 1)
+        left = np.repeat(positions, counts)
+        offsets = np.arange(len(left)) - np.repeat(np.cumsum(counts) - counts,
+                                                   counts)
+        x1 = rows[order[left]]
+        x2 = rows[order[left + 1 + offsets]]
+        # pairs are unique within a band
+        pair_keys.append(_encode_pairs(x1, x2, n_rows))
+        n_pairs += len(x1)
+        if n_pairs >= _LSH_PAIR_BLOCK:
+            yield _unique_pairs(pair_keys, n_rows)
+            pair_keys, n_pairs = [], 0
+    if n_pairs > 0:
+        yield _unique_pairs(pair_keys, n_rows)
+
+
+def _encode_pairs(x1, x2, n_rows):
+    # Sorted keys order pairs by blocks of the smaller row, then by the
+    # larger row, so that rows of a block stay in cache when computing
+    # similarities, while the other rows are visited in memory order.
+    low, high = np.minimum(x1, x2), np.maximum(x1, x2)
+    block_mask = (1 << _LSH_KEY_SHIFT) - 1
+    return (((low >> _LSH_KEY_SHIFT) * n_rows + high) << _LSH_KEY_SHIFT
+            | (low & block_mask))
+
+
+def _unique_pairs(pair_keys, n_rows):
+    # sorting is much faster than hash based `np.unique` for int keys
+    pair_keys = np.sort(np.concatenate(pair_keys))
+    pair_keys = pair_keys[np.concatenate(
+        [[True], pair_keys[1:] != pair_keys[:-1]])]
+    block_mask = (1 << _LSH_KEY_SHIFT) - 1
+    block, high = np.divmod(pair_keys >> _LSH_KEY_SHIFT, n_rows)
+    return block << _LSH_KEY_SHIFT | (pair_keys & block_mask), high
+
+
+def _lsh_sim_matrix(candidates, pair_sims, n_x, topk):
+    # candidates are scored block by block, and with `topk` only bounded
+    # heaps of every row are kept
+    if topk:
+        topk = min(topk, n_x)
+        topk_data = np.full((n_x, topk), -np.inf, dtype=np.float32)
+        topk_indices = np.full((n_x, topk), -1, dtype=np.intc)
+    else:
+        parts = []
+    for x1, x2 in candidates:
+        sims = pair_sims(x1, x2).astype(np.float32)
+        if topk:
+            push_topk_pairs(x1, x2, sims, topk_data, topk_indices)
+        else:
+            positive = sims > 0
+            parts.append((x1[positive], x2[positive], sims[positive]))
+
+    if topk:
+        order = np.argsort(-topk_data, axis=1, kind="stable")
+        topk_data = np.take_along_axis(topk_data, order, axis=1)
+        topk_indices = np.take_along_axis(topk_indices, order, axis=1)
+        valid = topk_indices >= 0
+        indptr = np.zeros(n_x + 1, dtype=np.int64)
+        np.cumsum(np.count_nonzero(valid, axis=1), out=indptr[1:])
+        return csr_matrix((topk_data[valid], topk_indices[valid], indptr),
+                          shape=(n_x, n_x), dtype=np.float32)
+
+    if not parts:
+        return csr_matrix((n_x, n_x), dtype=np.float32)
+    x1, x2, sims = (np.concatenate(p) for p in zip(*parts))
+    # blocks may share pairs, which must not be summed up
+    order = np.argsort(x1 * n_x + x2)
+    x1, x2, sims = x1[order], x2[order], sims[order]
+    first = np.concatenate([[True], (x1[1:] != x1[:-1])
+                            | (x2[1:] != x2[:-1])])
+    x1, x2, sims = x1[first], x2[first], sims[first]
+    return csr_matrix(
+        (np.concatenate([sims, sims]),
+         (np.concatenate([x1, x2]), np.concatenate([x2, x1]))),
         shape=(n_x, n_x), dtype=np.float32
     )
-    return sim_upper_triangular + sim_upper_triangular.transpose()
+
+
+def top_k_sim(sim_matrix, k):
+    """Keep the `k` largest positive similarities of every row.
+
+    Entries are ranked within rows by one global lexsort instead of
+    sorting every row in Python, and indices of the result are sorted.
+
+    Parameters
+    ----------
+    sim_matrix : scipy.sparse.csr_matrix of shape (n, n)
+    k : int
+
+    Returns
+    -------
+    topk_matrix : scipy.sparse.csr_matrix of shape (n, n)
+    """
+    topk_matrix = _top_k_rows(sim_matrix, k, positive=True)
+    topk_matrix.sort_indices()
+    return topk_matrix
+
+
+def _top_k_rows(sim_matrix, k, positive):
+    # entries of every row are kept in descending order of similarity
+    n_rows = sim_matrix.shape[0]
+    row_ids = np.repeat(np.arange(n_rows), np.diff(sim_matrix.indptr))
+    order = np.lexsort((-sim_matrix.data, row_ids))
+    rank = np.arange(len(order)) - sim_matrix.indptr[row_ids]
+    keep = rank < k
+    if positive:
+        keep &= sim_matrix.data[order] > 0
+    keep = order[keep]
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_ids[keep], minlength=n_rows), out=indptr[1:])
+    return csr_matrix(
+        (sim_matrix.data[keep], sim_matrix.indices[keep], indptr),
+        shape=sim_matrix.shape, dtype=np.float32
+    )
+
+
+def common_neighbor_sums(sim_matrix, sim_rows, interaction, interaction_rows,
+                         max_nnz=1 << 24):
+    """Sums over the common columns of `sim_matrix[sim_rows[p]]` and
+    `interaction[interaction_rows[p]]` for every pair `p`.
+
+    Rows of both matrices are gathered for a block of pairs, and multiplied
+    element-wise as two CSR matrices, so merging of neighbors and
+    interactions runs in scipy's native code. Blocks are split to hold
+    about `max_nnz` gathered interactions.
+
+    Returns
+    -------
+    weighted_sums : numpy.ndarray
+        Sum of similarity * interaction value.
+    sim_sums : numpy.ndarray
+        Sum of similarities.
+    counts : numpy.ndarray
+        Number of common columns.
+    """
+    n_pairs = len(sim_rows)
+    weighted_sums = np.zeros(n_pairs, dtype=np.float64)
+    sim_sums = np.zeros(n_pairs, dtype=np.float64)
+    counts = np.zeros(n_pairs, dtype=np.int64)
+    lengths = np.diff(interaction.indptr)[interaction_rows]
+    bounds = np.searchsorted(np.cumsum(lengths),
+                             np.arange(max_nnz, lengths.sum(), max_nnz))
+    bounds = np.unique(np.concatenate([[0], bounds + 1, [n_pairs]]))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        start, end = min(start, n_pairs), min(end, n_pairs)
+        if start >= end:
+            continue
+        sims = sim_matrix[sim_rows[start: end]]
+        labels = interaction[interaction_rows[start: end]]
+        weighted = sims.multiply(labels).tocsr()
+        labels.data = np.ones_like(labels.data)
+        common = sims.multiply(labels).tocsr()
+        weighted_sums[start: end] = np.asarray(weighted.sum(axis=1)).ravel()
+        sim_sums[start: end] = np.asarray(common.sum(axis=1)).ravel()
+        counts[start: end] = np.diff(common.indptr)
+    return weighted_sums, sim_sums, counts
 
 
 def compute_sparse_norm(sparse_data):
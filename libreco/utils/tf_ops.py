@@ -141,3 +141,68 @@ def user_recent_interact(num, indices, values):
     indices = indices[recent_indices]
     values = values[recent_indices]
     return indices, values
+
+
+class TfDataInput(object):
+    """`tf.data` input pipeline built on a data generator.
+
+    Batches are created by the generator's `make_batch` in `py_func`, with
+    `num_parallel_calls` batches being built concurrently and `prefetch_size`
+    batches buffered ahead of training. Models use `inputs` as the defaults
+    of their input placeholders, so training steps need no `feed_dict`,
+    whereas evaluation and prediction can still feed the placeholders.
+
+    Parameters
+    ----------
+    data_generator : object
+        Data generator that provides `batch_tasks` and `make_batch`.
+    input_names : list of (str, int)
+        Name of every model input and its position in the batch tuple.
+    num_parallel_calls : int, optional
+        Number of batches built in parallel.
+    prefetch_size : int, optional
+        Number of batches prefetched.
+    """
+
+    # dtype and ndim of all model inputs
+    input_spec = {
+        "user_indices": (tf.int32, 1),
+        "item_indices": (tf.int32, 1),
+        "labels": (tf.float32, 1),
+        "sparse_indices": (tf.int32, 2),
+        "dense_values": (tf.float32, 2),
+        "user_interacted_seq": (tf.int32, 2),
+        "user_interacted_len": (tf.float32, 1),
+    }
+
+    def __init__(self, data_generator, input_names, num_parallel_calls=1,
+                 prefetch_size=1):
+        self.data_generator = data_generator
+        self.names = [name for name, _ in input_names]
+        self.positions = [pos for _, pos in input_names]
+        self.dtypes = [self.input_spec[name][0] for name in self.names]
+        self.tasks = []
+
+        self.n_batches = tf.placeholder(tf.int64, shape=[])
+        dataset = tf.data.Dataset.range(self.n_batches).map(
+            self._map_batch, num_parallel_calls=num_parallel_calls
+        ).prefetch(prefetch_size)
+        self.iterator = tf.data.make_initializable_iterator(dataset)
+        self.inputs = dict(zip(self.names, self.iterator.get_next()))
+
+    def _map_batch(self, k):
+        outputs = tf.py_func(self._make_batch, [k], self.dtypes)
+        for name, output in zip(self.names, outputs):
+            output.set_shape([None] * self.input_spec[name][1])
+        return tuple(outputs)
+
+    def _make_batch(self, k):
+        batch = self.data_generator.make_batch(*self.tasks[k])
+        return [np.asarray(batch[pos], dtype=dtype.as_numpy_dtype)
+                for pos, dtype in zip(self.positions, self.dtypes)]
+
+    def initialize(self, sess, shuffle=True, batch_size=None):
+        """Shuffle data and restart the iterator for a new epoch."""
+        self.tasks = self.data_generator.batch_tasks(shuffle, batch_size)
+        sess.run(self.iterator.initializer,
+                 feed_dict={self.n_batches: len(self.tasks)})
@@ -0,0 +1,138 @@
+import logging
+import numpy as np
+try:
+    from ._topk import topk_dot
+except (ImportError, ModuleNotFoundError):
+    LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=LOG_FORMAT)
+    logging.warning("Top-k cython version is not available")
+    topk_dot = None
+
+
+def top_k(scores, k):
+    """Top `k` columns of every row of `scores`, in descending order of
+    score.
+
+    Uses `np.argpartition` to select candidates in O(n_cols) per row, then
+    only sorts the `k` selected ones.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray of shape (n_rows, n_cols)
+    k : int
+        Number of columns to select, truncated to `n_cols`.
+
+    Returns
+    -------
+    indices : numpy.ndarray of shape (n_rows, k)
+    top_scores : numpy.ndarray of shape (n_rows, k)
+    """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return (np.zeros((len(scores), 0), dtype=np.int64),
+                np.zeros((len(scores), 0), dtype=scores.dtype))
+    if k < scores.shape[1]:
+        # partition from the end avoids a negated copy of all the scores
+        n_cols = scores.shape[1]
+        indices = np.argpartition(scores, n_cols - k, axis=1)[:, n_cols - k:]
+    else:
+        indices = np.tile(np.arange(k), (len(scores), 1))
+    top_scores = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    indices = np.take_along_axis(indices, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    return indices, top_scores
+
+
+def top_k_dot(queries, items, k, item_bias=None, exclude=None,
+              num_threads=1):
+    """Exact top `k` items of `queries @ items.T + item_bias` for every
+    query, skipping excluded items.
+
+    Use the multi-threaded cython kernel if available, which scores items
+    block by block with bounded heaps and never materializes the full
+    score matrix, otherwise fall back to numpy.
+
+    Parameters
+    ----------
+    queries : numpy.ndarray of shape (n_queries, dim)
+    items : numpy.ndarray of shape (n_items, dim)
+    k : int
+    item_bias : numpy.ndarray of shape (n_items,), optional
+    exclude : tuple of (positions, items), optional
+        Excluded items, `items[j]` is excluded for query `positions[j]`,
+        e.g. the result of `ConsumedIndex.gather`.
+    num_threads : int, optional
+        Number of threads used in cython kernel.
+
+    Returns
+    -------
+    indices : numpy.ndarray of shape (n_queries, k)
+        Padded with -1 if a query has fewer than `k` items left.
+    top_scores : numpy.ndarray of shape (n_queries, k)
+        Padded with -inf.
+    """
+    if topk_dot is not None:
+        exclude_indptr = exclude_indices = None
+        if exclude is not None:
+            positions, excluded = exclude
+            # the kernel requires sorted indices within each row
+            order = np.lexsort((excluded, positions))
+            exclude_indices = excluded[order]
+            exclude_indptr = np.zeros(len(queries) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(positions, minlength=len(queries)),
+                      out=exclude_indptr[1:])
+        return topk_dot(queries, items, k, item_bias, exclude_indptr,
+                        exclude_indices, num_threads)
+
+    scores = queries @ items.T
+    if item_bias is not None:
+        scores += item_bias
+    if exclude is not None:
+        scores[exclude[0], exclude[1]] = -np.inf
+    indices, top_scores = top_k(scores, k)
+    indices[np.isneginf(top_scores)] = -1
+    return indices, top_scores
+
+
+def top_k_sparse(scores, k, exclude=None):
+    """Top `k` stored columns of every row of a sparse score matrix, in
+    descending order of score. Columns not stored in `scores` are never
+    selected.
+
+    Entries of all the rows are ranked by one lexsort, instead of sorting
+    every row separately.
+
+    Parameters
+    ----------
+    scores : scipy.sparse.csr_matrix of shape (n_rows, n_cols)
+    k : int
+    exclude : tuple of (positions, cols), optional
+        Excluded entries, `cols[j]` is excluded for row `positions[j]`,
+        e.g. the result of `ConsumedIndex.gather`.
+
+    Returns
+    -------
+    indices : numpy.ndarray of shape (n_rows, k)
+        Padded with -1 if a row has fewer than `k` entries left.
+    top_scores : numpy.ndarray of shape (n_rows, k)
+        Padded with -inf.
+    """
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    indices = np.full((n_rows, k), -1, dtype=np.int64)
+    top_scores = np.full((n_rows, k), -np.inf, dtype=np.float32)
+    rows = np.repeat(np.arange(n_rows), np.diff(scores.indptr))
+    cols, data = scores.indices, scores.data
+    if exclude is not None and len(exclude[0]) > 0:
+        keep = ~np.isin(rows * n_cols + cols,
+                        exclude[0] * n_cols + exclude[1])
+        rows, cols, data = rows[keep], cols[keep], data[keep]
+    order = np.lexsort((cols, -data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    starts = np.searchsorted(rows, np.arange(n_rows))
+    rank = np.arange(len(rows)) - starts[rows]
+    selected = rank < k
+    indices[rows[selected], rank[selected]] = cols[selected]
+    top_scores[rows[selected], rank[selected]] = data[selected]
+    return indices, top_scores
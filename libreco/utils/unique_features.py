@@ -64,8 +64,11 @@ def get_predict_indices_and_values(data_info, user, item, n_items,
 
 
 def get_recommend_indices_and_values(data_info, user, n_items, sparse, dense):
+    """Features of `user` paired with all items. `user` can also be an
+    array of users, then samples are grouped by user, i.e. sample
+    `u * n_items + i` is the pair of `user[u]` and item `i`."""
     user_indices = np.repeat(user, n_items)
-    item_indices = np.arange(n_items)
+    item_indices = np.tile(np.arange(n_items), np.size(user))
 
     sparse_indices = get_sparse_indices(
         data_info, user, n_items=n_items, mode="recommend") if sparse else None
@@ -100,16 +103,17 @@ def get_sparse_indices(data_info, user, item=None, n_items=None,
 
     elif mode == "recommend":
         if user_sparse_col and item_sparse_col:
-            user_sparse_part = np.tile(data_info.user_sparse_unique[user],
-                                       (n_items, 1))
-            item_sparse_part = data_info.item_sparse_unique
+            user_sparse_part = _repeat_rows(data_info.user_sparse_unique[user],
+                                            n_items)
+            item_sparse_part = np.tile(data_info.item_sparse_unique,
+                                       (np.size(user), 1))
             sparse_indices = np.concatenate(
                 [user_sparse_part, item_sparse_part], axis=-1)[:, col_reindex]
             return sparse_indices
         elif user_sparse_col:
-            return np.tile(data_info.user_sparse_unique[user], (n_items, 1))
+            return _repeat_rows(data_info.user_sparse_unique[user], n_items)
         elif item_sparse_col:
-            return data_info.item_sparse_unique
+            return np.tile(data_info.item_sparse_unique, (np.size(user), 1))
 
 
 def get_dense_indices(data_info, user, n_items=None, mode="predict"):
@@ -143,14 +147,19 @@ def get_dense_values(data_info, user, item=None, n_items=None, mode="predict"):
 
     elif mode == "recommend":
         if user_dense_col and item_dense_col:
-            user_dense_part = np.tile(data_info.user_dense_unique[user],
-                                      (n_items, 1))
-            item_dense_part = data_info.item_dense_unique
+            user_dense_part = _repeat_rows(data_info.user_dense_unique[user],
+                                           n_items)
+            item_dense_part = np.tile(data_info.item_dense_unique,
+                                      (np.size(user), 1))
             dense_values = np.concatenate(
                 [user_dense_part, item_dense_part], axis=-1)[:, col_reindex]
             return dense_values
         elif user_dense_col:
-            return np.tile(data_info.user_dense_unique[user], (n_items, 1))
+            return _repeat_rows(data_info.user_dense_unique[user], n_items)
         elif item_dense_col:
-            return data_info.item_dense_unique
+            return np.tile(data_info.item_dense_unique, (np.size(user), 1))
 
+
+def _repeat_rows(values, n_items):
+    # one row for a single user, or one row per user in a batch
+    return np.repeat(np.atleast_2d(values), n_items, axis=0)
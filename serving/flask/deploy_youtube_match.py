@@ -21,15 +21,24 @@ def get_item_vector_from_redis(name):
     return item_vectors
 
 
+def mips_augment(item_vectors):
+    # make all item vectors have the same norm, so that L2 nearest
+    # neighbors of [user_vector, 0] are the items of largest inner product
+    norms = np.sum(item_vectors ** 2, axis=1)
+    extra = np.sqrt(np.maximum(norms.max() - norms, 0.0))
+    return np.hstack([item_vectors, extra[:, np.newaxis]]).astype(np.float32)
+
+
 r = redis.Redis(host="localhost", port=6379, decode_responses=True)
 user_consumed = r.get("user_consumed")
 user_consumed = json.loads(user_consumed)
 item_vector = get_item_vector_from_redis("item_vector")
 
-quantizer = faiss.IndexFlatL2(item_vector.shape[1])
-index = faiss.IndexIVFFlat(quantizer, item_vector.shape[1], 100)
-index.train(item_vector)
-index.add(item_vector)
+augmented_item_vector = mips_augment(item_vector)
+quantizer = faiss.IndexFlatL2(augmented_item_vector.shape[1])
+index = faiss.IndexIVFFlat(quantizer, augmented_item_vector.shape[1], 100)
+index.train(augmented_item_vector)
+index.add(augmented_item_vector)
 
 
 @app.route("/<algo>", methods=['POST'])
@@ -64,7 +73,8 @@ def recommend(user, n_rec, use_faiss):
     )
 
     if use_faiss:
-        _, recos = index.search(user_vector.reshape(1, -1), n_rec)
+        query = np.append(user_vector, 0.0).astype(np.float32)
+        _, recos = index.search(query.reshape(1, -1), n_rec)
         return recos.flatten().tolist()
     else:
         recos = item_vector @ user_vector
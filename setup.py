@@ -53,12 +53,24 @@ extensions = [
               language="c++",
               extra_compile_args=compile_args,
               extra_link_args=link_args),
-    Extension('libreco._similarities',
+    Extension('libreco.utils._similarities',
               [os.path.join("libreco", "utils", "_similarities" + ext)],
               include_dirs=[np.get_include()],
               language="c++",
               extra_compile_args=compile_args,
               extra_link_args=link_args),
+    Extension('libreco.utils._sampling',
+              [os.path.join("libreco", "utils", "_sampling" + ext)],
+              include_dirs=[np.get_include()],
+              language="c++",
+              extra_compile_args=compile_args,
+              extra_link_args=link_args),
+    Extension('libreco.utils._topk',
+              [os.path.join("libreco", "utils", "_topk" + ext)],
+              include_dirs=[np.get_include()],
+              language="c++",
+              extra_compile_args=compile_args,
+              extra_link_args=link_args),
 ]
 
 if USE_CYTHON: